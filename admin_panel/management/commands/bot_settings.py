@@ -0,0 +1,78 @@
+"""
+Настройки бота (таблица bot_settings)
+
+python manage.py bot_settings list
+python manage.py bot_settings set text_welcome "Добро пожаловать!"
+python manage.py bot_settings set regions '[["bali", "🌴 Бали"], ["cyprus", "🏖️ Кипр"]]'
+python manage.py bot_settings delete text_welcome
+
+Бот держит настройки в памяти и подхватывает изменения по updated_at в
+течение SETTINGS_REFRESH секунд, а при SETTINGS_NOTIFY=redis - сразу.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from bot_settings import parse_value, publish_change
+
+
+class Command(BaseCommand):
+    help = "Просмотр и изменение настроек бота: list, set, delete"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        subparsers.add_parser('list', help="Все настройки")
+
+        set_parser = subparsers.add_parser('set', help="Задать значение (текст или JSON)")
+        set_parser.add_argument('key')
+        set_parser.add_argument('value')
+        set_parser.add_argument('--description', default='')
+
+        delete = subparsers.add_parser('delete', help="Удалить настройку (вернется значение по умолчанию)")
+        delete.add_argument('key')
+
+    def handle(self, *args, **options):
+        getattr(self, options['action'])(options)
+
+    def list(self, options):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT key, value, updated_at FROM bot_settings ORDER BY key")
+            rows = cursor.fetchall()
+        if not rows:
+            self.stdout.write("Настроек нет, бот использует значения по умолчанию")
+        for key, value, updated_at in rows:
+            value = value if len(value) <= 60 else value[:57] + '...'
+            self.stdout.write(f"   {key} = {value!r} ({updated_at})")
+
+    def set(self, options):
+        if len(options['key']) > 100:
+            raise CommandError("Ключ не длиннее 100 символов")
+        if options['key'] == 'visa_rules':
+            # Бот не примет правила, в которых не все ответы приводят к рекомендации
+            from visa import DecisionTable
+
+            try:
+                DecisionTable(parse_value(options['value']))
+            except (KeyError, TypeError, ValueError) as e:
+                raise CommandError(f"Правила визового квиза не прошли проверку: {e}")
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO bot_settings (key, value, description, created_at, updated_at) "
+                "VALUES (%s, %s, %s, %s, %s) ON CONFLICT (key) DO UPDATE SET "
+                "value = excluded.value, updated_at = excluded.updated_at",
+                [options['key'], options['value'], options['description'], now, now],
+            )
+        publish_change(options['key'])
+        self.stdout.write(self.style.SUCCESS(f"✅ {options['key']} сохранена"))
+
+    def delete(self, options):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM bot_settings WHERE key = %s", [options['key']])
+            deleted = cursor.rowcount
+        if not deleted:
+            raise CommandError(f"Настройка {options['key']} не найдена")
+        publish_change(options['key'])
+        self.stdout.write(self.style.SUCCESS(f"✅ {options['key']} удалена"))
@@ -0,0 +1,138 @@
+"""
+Массовые действия с объектами и лидами
+
+python manage.py bulk boost --region bali --days 14
+python manage.py bulk boost <id> <id> --days 7
+python manage.py bulk deactivate --source partner --region turkey
+python manage.py bulk resend --failed
+python manage.py bulk resend --status new
+
+Каждое действие - один UPDATE (или INSERT ... SELECT) по условию, а не
+чтение строк и сохранение по одной. Бот подхватывает измененные объекты
+по updated_at при следующем обновлении каталога, лиды из очереди
+amocrm_outbox - при следующем опросе очереди.
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+
+def now():
+    return connection.ops.adapt_datetimefield_value(timezone.now())
+
+
+def where_clause(filters):
+    """WHERE из пар (условие с %s, значение); значения None и пустые списки пропускаются"""
+    where, params = [], []
+    for condition, value in filters:
+        if value is None or value == []:
+            continue
+        if isinstance(value, list):
+            condition = condition.format(', '.join(['%s'] * len(value)))
+            params.extend(value)
+        else:
+            params.append(value)
+        where.append(condition)
+    return ' AND '.join(where), params
+
+
+class Command(BaseCommand):
+    help = "Массовые действия: boost, deactivate (объекты), resend (лиды в AmoCRM)"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        for name, help_text in [
+            ('boost', "Поднять объекты в выдаче на --days дней"),
+            ('deactivate', "Снять объекты с показа"),
+        ]:
+            action = subparsers.add_parser(name, help=help_text)
+            action.add_argument('ids', nargs='*', help="id объектов")
+            action.add_argument('--region')
+            action.add_argument('--source')
+            if name == 'boost':
+                action.add_argument('--days', type=int, default=7)
+
+        resend = subparsers.add_parser('resend', help="Отправить лиды в AmoCRM заново")
+        resend.add_argument('ids', nargs='*', help="id лидов")
+        resend.add_argument('--status')
+        resend.add_argument('--source')
+        resend.add_argument(
+            '--failed', action='store_true',
+            help="Только лиды, по которым выгрузка прекратила попытки",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = getattr(self, options['action'])(options)
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {options['action']}: {updated} строк за {(time.perf_counter() - started) * 1000:.0f} мс"
+        ))
+
+    def property_filters(self, options):
+        where, params = where_clause([
+            ("id IN ({})", [value.replace('-', '') for value in options['ids']]),
+            ("region = %s", options['region']),
+            ("source = %s", options['source']),
+        ])
+        if not where:
+            raise CommandError("Укажите id объектов, --region или --source")
+        return where, params
+
+    def boost(self, options):
+        if options['days'] <= 0:
+            raise CommandError("--days должно быть больше 0")
+        where, params = self.property_filters(options)
+        boost_expiry = connection.ops.adapt_datetimefield_value(
+            timezone.now() + timedelta(days=options['days'])
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE properties SET boost_expiry = %s, updated_at = %s WHERE is_active = %s AND {where}",
+                [boost_expiry, now(), True, *params],
+            )
+            return cursor.rowcount
+
+    def deactivate(self, options):
+        where, params = self.property_filters(options)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE properties SET is_active = %s, updated_at = %s WHERE is_active = %s AND {where}",
+                [False, now(), True, *params],
+            )
+            return cursor.rowcount
+
+    def resend(self, options):
+        with connection.cursor() as cursor:
+            if options['failed'] and not (options['ids'] or options['status'] or options['source']):
+                # Лиды, на которых выгрузка остановилась (next_attempt_at IS NULL)
+                cursor.execute(
+                    "UPDATE amocrm_outbox SET attempts = 0, next_attempt_at = %s, last_error = '' "
+                    "WHERE next_attempt_at IS NULL",
+                    [time.time()],
+                )
+                return cursor.rowcount
+
+            where, params = where_clause([
+                ("l.id IN ({})", [value.replace('-', '') for value in options['ids']]),
+                ("l.status = %s", options['status']),
+                ("l.source = %s", options['source']),
+            ])
+            if not where:
+                raise CommandError("Укажите id лидов, --status, --source или --failed")
+            if options['failed']:
+                where += " AND l.id IN (SELECT lead_id FROM amocrm_outbox WHERE next_attempt_at IS NULL)"
+            # Уже выгруженные лиды (с amo_crm_id) не отправляются повторно
+            queued_at = time.time()
+            cursor.execute(
+                "INSERT INTO amocrm_outbox (lead_id, attempts, next_attempt_at, last_error, created_at) "
+                f"SELECT l.id, 0, %s, '', %s FROM leads l WHERE l.amo_crm_id = '' AND {where} "
+                "ON CONFLICT (lead_id) DO UPDATE SET attempts = 0, "
+                "next_attempt_at = excluded.next_attempt_at, last_error = ''",
+                [queued_at, queued_at, *params],
+            )
+            return cursor.rowcount
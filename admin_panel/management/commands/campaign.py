@@ -0,0 +1,297 @@
+"""
+Рассылки по сегментам пользователей бота
+
+python manage.py campaign create spring-bali --text "..." --region bali --stage ready
+python manage.py campaign send spring-bali
+python manage.py campaign status spring-bali
+
+Получатели читаются одним запросом по сегменту через серверный курсор и
+отправляются пачками через очередь с лимитами Telegram (sender.py). После
+каждой пачки статусы доставки пишутся одной вставкой, а id последнего
+получателя сохраняется в campaigns.last_user_id: прерванная рассылка
+продолжается с этого места (повторно может уйти не больше одной пачки).
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from profiles import BUDGET_RANGES, FAMILY_MEMBERS
+
+STAGES = ['planning', 'searching', 'ready']
+
+
+def now():
+    return connection.ops.adapt_datetimefield_value(timezone.now())
+
+
+def segment_query(segment, after_id=0):
+    """SQL и параметры выборки получателей сегмента после after_id"""
+    where, params = ["is_active = %s", "id > %s"], [True, after_id]
+    filters = [
+        ('region', segment.get('region')),
+        ('stage', segment.get('stage')),
+        ('budget', [BUDGET_RANGES[code][0] for code in segment.get('budget', [])]),
+        ('family_members', [FAMILY_MEMBERS[code] for code in segment.get('family', [])]),
+    ]
+    for column, values in filters:
+        if values:
+            where.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+    return (
+        f"SELECT id, telegram_id FROM telegram_users WHERE {' AND '.join(where)} ORDER BY id",
+        params,
+    )
+
+
+def load_campaign(campaign_id):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT id, text, segment, status, last_user_id, sent, failed FROM campaigns WHERE id = %s",
+            [campaign_id],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        raise CommandError(f"Рассылка {campaign_id} не найдена")
+    return dict(zip(['id', 'text', 'segment', 'status', 'last_user_id', 'sent', 'failed'], row))
+
+
+class CampaignSender:
+    """
+    Отправка одной рассылки
+
+    Вся работа с базой идет в одном отдельном потоке (одно соединение Django
+    и серверный курсор), отправка - в цикле событий через bot.
+    """
+
+    def __init__(self, campaign_id, bot, batch_size=500, stdout=None):
+        self.campaign_id = campaign_id
+        self.bot = bot
+        self.batch_size = batch_size
+        self.stdout = stdout
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def _db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _recipients(self, campaign):
+        """Получатели пачками по batch_size, без загрузки сегмента в память"""
+        sql, params = segment_query(json.loads(campaign['segment']), campaign['last_user_id'])
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    return
+                yield rows
+
+    def _close(self):
+        # connection - прокси к соединению текущего потока, закрываем из потока базы
+        connection.close()
+
+    def _set_status(self, status):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE campaigns SET status = %s, updated_at = %s WHERE id = %s",
+                [status, now(), self.campaign_id],
+            )
+
+    def _checkpoint(self, deliveries, last_user_id):
+        """Статусы пачки и чекпоинт одной транзакцией"""
+        sent_at = now()
+        sent = sum(1 for _, status, _, _ in deliveries if status == 'sent')
+        blocked = [(user_id,) for user_id, status, _, _ in deliveries if status == 'blocked']
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO campaign_deliveries (campaign_id, user_id, status, message_id, error, sent_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (campaign_id, user_id) DO UPDATE SET "
+                "status = excluded.status, message_id = excluded.message_id, "
+                "error = excluded.error, sent_at = excluded.sent_at",
+                [(self.campaign_id, *delivery, sent_at) for delivery in deliveries],
+            )
+            if blocked:
+                # Пользователь заблокировал бота: в следующие рассылки не попадет
+                cursor.executemany(
+                    "UPDATE telegram_users SET is_active = %s, updated_at = %s WHERE id = %s",
+                    [(False, sent_at, user_id) for user_id, in blocked],
+                )
+            cursor.execute(
+                "UPDATE campaigns SET last_user_id = %s, sent = sent + %s, failed = failed + %s, "
+                "updated_at = %s WHERE id = %s",
+                [last_user_id, sent, len(deliveries) - sent, sent_at, self.campaign_id],
+            )
+
+    async def _deliver(self, text, user_id, telegram_id):
+        from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+        try:
+            message = await self.bot.send_message(telegram_id, text)
+        except TelegramForbiddenError as e:
+            return user_id, 'blocked', None, str(e)[:200]
+        except TelegramAPIError as e:
+            return user_id, 'failed', None, str(e)[:200]
+        return user_id, 'sent', message.message_id, ''
+
+    async def run(self):
+        """Отправка с чекпоинта до конца сегмента; возвращает (отправлено, ошибок)"""
+        try:
+            campaign = await self._db(load_campaign, self.campaign_id)
+            if campaign['status'] == 'done':
+                raise CommandError(f"Рассылка {self.campaign_id} уже завершена")
+            await self._db(self._set_status, 'running')
+            sent, failed = await self._send(campaign)
+            await self._db(self._set_status, 'done')
+            return sent, failed
+        finally:
+            await self._db(self._close)
+            self._executor.shutdown()
+
+    async def _send(self, campaign):
+        import sender
+
+        batches = await self._db(self._recipients, campaign)
+        sent = failed = 0
+        started = time.perf_counter()
+        try:
+            with sender.priority(sender.BROADCAST):
+                while True:
+                    rows = await self._db(next, batches, None)
+                    if rows is None:
+                        break
+                    deliveries = await asyncio.gather(*(
+                        self._deliver(campaign['text'], user_id, telegram_id)
+                        for user_id, telegram_id in rows
+                    ))
+                    await self._db(self._checkpoint, deliveries, rows[-1][0])
+                    batch_sent = sum(1 for delivery in deliveries if delivery[1] == 'sent')
+                    sent += batch_sent
+                    failed += len(deliveries) - batch_sent
+                    if self.stdout is not None:
+                        elapsed = time.perf_counter() - started
+                        self.stdout.write(
+                            f"   отправлено {sent}, ошибок {failed} ({(sent + failed) / elapsed:.1f} в секунду)"
+                        )
+        finally:
+            # Открытый курсор держит блокировку чтения: закрываем его в потоке базы
+            await self._db(batches.close)
+        return sent, failed
+
+
+class Command(BaseCommand):
+    help = "Рассылки по сегментам пользователей: create, send, status"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        create = subparsers.add_parser('create', help="Создать рассылку")
+        create.add_argument('campaign_id')
+        text = create.add_mutually_exclusive_group(required=True)
+        text.add_argument('--text', help="Текст сообщения")
+        text.add_argument('--text-file', help="Файл с текстом сообщения")
+        create.add_argument('--region', nargs='+', default=[])
+        create.add_argument('--stage', nargs='+', choices=STAGES, default=[])
+        create.add_argument('--budget', nargs='+', choices=sorted(BUDGET_RANGES), default=[])
+        create.add_argument('--family', nargs='+', choices=sorted(FAMILY_MEMBERS), default=[])
+
+        send = subparsers.add_parser('send', help="Отправить или продолжить рассылку")
+        send.add_argument('campaign_id')
+        send.add_argument('--batch-size', type=int, default=500)
+        send.add_argument(
+            '--rate', type=float,
+            help="Сообщений в секунду (по умолчанию и не больше CAMPAIGN_SEND_RATE: "
+                 "остаток SEND_RATE - запас для ответов бота)",
+        )
+
+        status = subparsers.add_parser('status', help="Прогресс рассылки")
+        status.add_argument('campaign_id')
+
+    def handle(self, *args, **options):
+        getattr(self, options['action'])(options)
+
+    def create(self, options):
+        if len(options['campaign_id']) > 50:
+            raise CommandError("id рассылки не длиннее 50 символов")
+        text = options['text']
+        if options['text_file']:
+            with open(options['text_file'], encoding='utf-8') as f:
+                text = f.read()
+        segment = {key: options[key] for key in ('region', 'stage', 'budget', 'family') if options[key]}
+
+        sql, params = segment_query(segment)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM ({sql}) segment", params)
+            recipients = cursor.fetchone()[0]
+            cursor.execute(
+                "INSERT INTO campaigns (id, text, segment, status, created_at, updated_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                [options['campaign_id'], text, json.dumps(segment), 'draft', now(), now()],
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Рассылка {options['campaign_id']} создана, получателей: {recipients}"
+        ))
+
+    def send(self, options):
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+
+        import sender
+
+        token = os.getenv('BOT_TOKEN')
+        if not token:
+            raise CommandError("BOT_TOKEN не задан")
+        # Бот шлет с тем же токеном: рассылка не должна выбирать общий лимит Telegram,
+        # иначе 429 достанутся ответам пользователям. При SEND_BUDGET=redis рассылка
+        # к тому же берет из общего ведра только то, что бот сейчас не тратит
+        rate = options['rate'] or sender.CAMPAIGN_SEND_RATE
+        if not 0 < rate <= sender.CAMPAIGN_SEND_RATE:
+            raise CommandError(
+                f"--rate от 0 до CAMPAIGN_SEND_RATE={sender.CAMPAIGN_SEND_RATE:g} "
+                f"(SEND_RATE={sender.SEND_RATE:g}, из них боту {sender.BOT_SEND_RATE:g})"
+            )
+        campaign = load_campaign(options['campaign_id'])
+        self.stdout.write(
+            f"📣 Рассылка {campaign['id']}: уже отправлено {campaign['sent']}, "
+            f"продолжаем после пользователя {campaign['last_user_id']}, {rate:g} сообщений/с"
+        )
+        # Django не дает работать с базой из потока с event loop: база - в CampaignSender
+        connection.close()
+
+        async def run():
+            api_url = os.getenv('TELEGRAM_API_URL')
+            session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+            bot = Bot(token=token, session=session)
+            scheduler = sender.SendScheduler(rate=rate, budget=sender.create_budget(sender.SEND_RESERVE))
+            bot.session.middleware(scheduler)
+            await scheduler.start()
+            try:
+                return await CampaignSender(
+                    campaign['id'], bot, options['batch_size'], self.stdout
+                ).run()
+            finally:
+                await scheduler.close()
+                await bot.session.close()
+
+        sent, failed = asyncio.run(run())
+        self.stdout.write(self.style.SUCCESS(f"✅ Готово: отправлено {sent}, ошибок {failed}"))
+
+    def status(self, options):
+        campaign = load_campaign(options['campaign_id'])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT status, COUNT(*) FROM campaign_deliveries WHERE campaign_id = %s GROUP BY status",
+                [campaign['id']],
+            )
+            deliveries = dict(cursor.fetchall())
+        self.stdout.write(
+            f"📣 {campaign['id']}: {campaign['status']}, отправлено {campaign['sent']}, "
+            f"ошибок {campaign['failed']}, последний получатель {campaign['last_user_id']}"
+        )
+        for status, count in sorted(deliveries.items()):
+            self.stdout.write(f"   {status}: {count}")
@@ -0,0 +1,74 @@
+"""
+Курсы валют для перевода цен объектов в USD
+
+python manage.py exchange_rates
+python manage.py exchange_rates EUR=1.08 THB=0.028
+python manage.py exchange_rates --url https://open.er-api.com/v6/latest/USD
+
+Курс - сколько USD стоит единица валюты. Бот подхватывает новые курсы при
+следующем обновлении каталога и пересчитывает только объекты в этих валютах.
+"""
+
+import json
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from pricing import DEFAULT_RATES
+
+
+def parse_rate(value):
+    currency, _, rate = value.partition('=')
+    try:
+        rate = float(rate)
+    except ValueError:
+        raise CommandError(f"Курс в формате ВАЛЮТА=USD_за_единицу: {value}")
+    if len(currency) != 3 or rate <= 0:
+        raise CommandError(f"Некорректный курс: {value}")
+    return currency.upper(), rate
+
+
+def fetch_rates(url):
+    """Курсы из JSON вида {"rates": {"EUR": 0.92, ...}} (единиц валюты за 1 USD)"""
+    with urllib.request.urlopen(url, timeout=30) as response:
+        data = json.load(response)
+    rates = data.get('rates') or {}
+    return {currency: 1 / rate for currency, rate in rates.items() if len(currency) == 3 and rate}
+
+
+class Command(BaseCommand):
+    help = "Просмотр и обновление курсов валют (USD за единицу валюты)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('rates', nargs='*', help="Курсы вида EUR=1.08")
+        parser.add_argument('--url', help="Загрузить курсы к USD из JSON API")
+
+    def handle(self, *args, **options):
+        rates = dict(parse_rate(value) for value in options['rates'])
+        if options['url']:
+            fetched = fetch_rates(options['url'])
+            # Обновляем только валюты, которые встречаются в объектах или заданы по умолчанию
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT DISTINCT price_currency FROM properties")
+                used = {row[0] for row in cursor.fetchall()} | set(DEFAULT_RATES)
+            rates.update({currency: rate for currency, rate in fetched.items() if currency in used})
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if rates:
+                now = connection.ops.adapt_datetimefield_value(timezone.now())
+                cursor.executemany(
+                    "INSERT INTO exchange_rates (currency, usd_rate, updated_at) VALUES (%s, %s, %s) "
+                    "ON CONFLICT (currency) DO UPDATE SET usd_rate = excluded.usd_rate, "
+                    "updated_at = excluded.updated_at",
+                    [(currency, rate, now) for currency, rate in rates.items()],
+                )
+            cursor.execute("SELECT currency, usd_rate FROM exchange_rates")
+            stored = dict(cursor.fetchall())
+
+        if rates:
+            self.stdout.write(self.style.SUCCESS(f"✅ Обновлено курсов: {len(rates)}"))
+        for currency, rate in sorted({**DEFAULT_RATES, **stored}.items()):
+            source = "" if currency in stored else " (по умолчанию)"
+            self.stdout.write(f"   {currency}: {rate:.6g} USD{source}")
@@ -0,0 +1,350 @@
+"""
+Импорт фида объектов недвижимости от партнера
+
+python manage.py import_feed feed.csv --source partner
+python manage.py import_feed feed.xml --source partner --xml-tag offer
+
+Фид (CSV, JSON/JSON Lines, XML) читается потоково, строка за строкой.
+Объекты сопоставляются по (source, external_id): новые вставляются,
+измененные обновляются, неизмененные (совпал хэш содержимого) пропускаются,
+пропавшие из фида деактивируются.
+"""
+
+import csv
+import hashlib
+import json
+import re
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+try:
+    import resource
+except ImportError:
+    # На Windows модуля resource нет, пиковую память не показываем
+    resource = None
+
+# Поля фида, которые попадают в properties (и участвуют в хэше содержимого)
+FIELDS = [
+    'title', 'description', 'region', 'city', 'price', 'price_currency', 'price_type',
+    'bedrooms', 'bathrooms', 'area', 'is_for_relocants', 'has_furniture',
+    'good_internet', 'contact_phone', 'contact_email',
+]
+INT_FIELDS = {'bedrooms', 'bathrooms'}
+DECIMAL_FIELDS = {'price', 'area'}
+BOOL_FIELDS = {'is_for_relocants', 'has_furniture', 'good_internet'}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'да'}
+# NOT NULL в properties, без которых объект не попадает в каталог
+REQUIRED_FIELDS = ('title', 'region', 'price')
+# Длины varchar-колонок properties (PostgreSQL отклоняет более длинные значения)
+MAX_LENGTHS = {
+    'external_id': 100, 'title': 200, 'region': 50, 'city': 100, 'price_currency': 3,
+    'price_type': 20, 'contact_phone': 20, 'contact_email': 254,
+}
+
+# Альтернативные названия полей в фидах партнеров
+ALIASES = {
+    'id': 'external_id',
+    'currency': 'price_currency',
+}
+
+# Пробелы и запятые между объектами JSON-массива или строками JSON Lines
+JSON_SEPARATOR = re.compile(r'[\s,]*')
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+
+def read_json(path, chunk_size=1 << 16, max_chunks=16):
+    """
+    JSON-массив объектов или JSON Lines, без загрузки файла целиком
+
+    Буфер разбирается с позиции pos и обрезается только при чтении следующего
+    блока. Объект, который не разобрался и в max_chunks блоках, считается
+    некорректным JSON: иначе битый фид дочитывался бы в память до конца.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        pos = JSON_SEPARATOR.match(buffer).end()
+        if buffer.startswith('[', pos):
+            pos += 1
+        while True:
+            pos = JSON_SEPARATOR.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if len(buffer) - pos > max_chunks * chunk_size:
+                    raise CommandError(f"Некорректный JSON в фиде: {buffer[pos:pos + 100]}")
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    if pos < len(buffer):
+                        raise CommandError(f"Некорректный JSON в конце фида: {buffer[pos:pos + 100]}")
+                    return
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+
+def read_xml(path, tag='property'):
+    """Элементы <tag> с дочерними полями; обработанные элементы сразу освобождаются"""
+    for event, element in ET.iterparse(path, events=('end',)):
+        if element.tag == tag:
+            item = {child.tag: (child.text or '').strip() for child in element}
+            item.update(element.attrib)
+            yield item
+            element.clear()
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'jsonl': read_json,
+    'xml': read_xml,
+}
+
+
+def normalize(field, value):
+    """Значение поля в виде, одинаковом для фида и для строки из базы"""
+    if value is None or value == '':
+        if field in BOOL_FIELDS:
+            return False
+        return None if field in INT_FIELDS | DECIMAL_FIELDS else ''
+    if field in BOOL_FIELDS:
+        if isinstance(value, str):
+            return value.strip().lower() in TRUE_VALUES
+        return bool(value)
+    if field in INT_FIELDS:
+        return int(Decimal(str(value)))
+    if field in DECIMAL_FIELDS:
+        number = Decimal(str(value))
+        if not number.is_finite():
+            raise ValueError(f"{field}: {value!r}")
+        return number.quantize(Decimal('0.01'))
+    return str(value).strip()
+
+
+def feed_external_id(item):
+    """external_id строки фида (или его псевдоним); '', если его нет или он длиннее колонки"""
+    external_id = ''
+    for key, value in item.items():
+        if ALIASES.get(key, key) == 'external_id':
+            external_id = str(value or '').strip()
+    return external_id if len(external_id) <= MAX_LENGTHS['external_id'] else ''
+
+
+def content_hash(values):
+    return hashlib.blake2b(
+        '\x1f'.join(map(str, values)).encode(), digest_size=16
+    ).digest()
+
+
+class FeedImporter:
+    """Пакетный импорт одного источника в properties"""
+
+    def __init__(self, source, batch_size=5000, deactivate=True):
+        self.source = source
+        self.batch_size = batch_size
+        self.deactivate = deactivate
+        self.stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0,
+                      'deactivated': 0, 'skipped': 0}
+
+    def prepare(self, item):
+        """
+        Строка фида -> (external_id, значения FIELDS)
+
+        None, если строку нельзя записать: нет id, пустое обязательное поле
+        (цена, заголовок, регион) или значение длиннее колонки. Такая строка
+        считается пропущенной, а не обрывает транзакцию пакета.
+        """
+        external_id = feed_external_id(item)
+        if not external_id:
+            return None
+        item = {ALIASES.get(key, key): value for key, value in item.items()}
+        values = dict(zip(FIELDS, (normalize(field, item.get(field)) for field in FIELDS)))
+        if any(values[field] in (None, '') for field in REQUIRED_FIELDS):
+            return None
+        if any(len(values[field]) > length for field, length in MAX_LENGTHS.items() if field in values):
+            return None
+        return external_id, tuple(values.values())
+
+    def run(self, items):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS feed_seen")
+            cursor.execute(
+                "CREATE TEMPORARY TABLE feed_seen (external_id varchar(100) PRIMARY KEY)"
+            )
+
+        batch, skipped = {}, []
+        for item in items:
+            self.stats['rows'] += 1
+            try:
+                prepared = self.prepare(item)
+            except (InvalidOperation, ValueError):
+                prepared = None
+            if prepared is None:
+                self.stats['skipped'] += 1
+                # Объект есть в фиде, хоть строку и нельзя записать: не деактивируем его
+                external_id = feed_external_id(item)
+                if external_id:
+                    skipped.append(external_id)
+                if len(skipped) >= self.batch_size:
+                    self.mark_seen(skipped)
+                    skipped = []
+                continue
+            # Повтор external_id внутри фида: остается последняя версия
+            batch[prepared[0]] = prepared[1]
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = {}
+        if batch:
+            self.write_batch(batch)
+        if skipped:
+            self.mark_seen(skipped)
+
+        # Деактивируем только после того, как фид прочитан целиком
+        if self.deactivate:
+            self.deactivate_missing()
+
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE feed_seen")
+        return self.stats
+
+    def write_batch(self, batch):
+        """Один пакет фида одной транзакцией"""
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        external_ids = list(batch)
+        placeholders = ', '.join(['%s'] * len(external_ids))
+        columns = ', '.join(f'"{field}"' for field in FIELDS)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT external_id, id, is_active, {columns} FROM properties "
+                f"WHERE source = %s AND external_id IN ({placeholders})",
+                [self.source, *external_ids],
+            )
+            existing = {}
+            for row in cursor.fetchall():
+                old_values = tuple(normalize(field, value) for field, value in zip(FIELDS, row[3:]))
+                existing[row[0]] = (row[1], bool(row[2]), content_hash(old_values))
+
+            inserts, updates = [], []
+            for external_id, values in batch.items():
+                old = existing.get(external_id)
+                if old is None:
+                    inserts.append((uuid.uuid4().hex, self.source, external_id, *values, True, now, now))
+                elif old[2] != content_hash(values) or not old[1]:
+                    updates.append((*values, True, now, old[0]))
+                else:
+                    self.stats['unchanged'] += 1
+
+            if inserts:
+                cursor.executemany(
+                    f"INSERT INTO properties (id, source, external_id, {columns}, is_active, "
+                    f"created_at, updated_at) VALUES ({', '.join(['%s'] * (len(FIELDS) + 6))})",
+                    inserts,
+                )
+            if updates:
+                assignments = ', '.join(f'"{field}" = %s' for field in FIELDS)
+                cursor.executemany(
+                    f"UPDATE properties SET {assignments}, is_active = %s, updated_at = %s "
+                    f"WHERE id = %s",
+                    updates,
+                )
+            self.mark_seen(external_ids)
+
+        self.stats['inserted'] += len(inserts)
+        self.stats['updated'] += len(updates)
+
+    def mark_seen(self, external_ids):
+        """Объекты, которые есть в фиде (их deactivate_missing не трогает)"""
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO feed_seen (external_id) VALUES (%s) ON CONFLICT DO NOTHING",
+                [(external_id,) for external_id in external_ids],
+            )
+
+    def deactivate_missing(self):
+        """
+        Деактивация объектов источника, которых нет в фиде
+
+        Фид без единой записанной строки (пустой, обрезанный, в другом формате)
+        не деактивирует весь источник: импорт завершается ошибкой.
+        """
+        if not self.stats['inserted'] + self.stats['updated'] + self.stats['unchanged']:
+            raise CommandError(
+                f"В фиде нет ни одного корректного объекта (строк: {self.stats['rows']}, "
+                f"пропущено: {self.stats['skipped']}), деактивация источника {self.source} отменена. "
+                f"Проверьте фид или запустите с --no-deactivate"
+            )
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE properties SET is_active = %s, updated_at = %s "
+                "WHERE source = %s AND is_active = %s "
+                "AND external_id NOT IN (SELECT external_id FROM feed_seen)",
+                [False, now, self.source, True],
+            )
+            self.stats['deactivated'] = cursor.rowcount
+
+
+def peak_rss_mb():
+    """Пиковая память процесса в МБ (ru_maxrss в Linux - в КБ)"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = "Потоковый импорт фида объектов (CSV, JSON, JSON Lines, XML) в properties"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл фида")
+        parser.add_argument('--source', required=True, help="Значение properties.source для фида")
+        parser.add_argument('--format', choices=sorted(READERS), help="Формат (по умолчанию по расширению)")
+        parser.add_argument('--xml-tag', default='property', help="Тег объекта в XML-фиде")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--no-deactivate', action='store_true',
+                            help="Не деактивировать объекты, которых нет в фиде")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if fmt not in READERS:
+            raise CommandError(f"Неизвестный формат фида: {fmt}")
+        if len(options['source']) > 10:
+            raise CommandError("source не длиннее 10 символов")
+
+        items = read_xml(path, options['xml_tag']) if fmt == 'xml' else READERS[fmt](path)
+        importer = FeedImporter(
+            options['source'],
+            batch_size=options['batch_size'],
+            deactivate=not options['no_deactivate'],
+        )
+
+        self.stdout.write(f"📥 Импорт {path} ({fmt}), источник {options['source']}...")
+        started = time.perf_counter()
+        stats = importer.run(items)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Готово за {elapsed:.1f} с: {stats['rows'] / elapsed:.0f} строк/с"
+        ))
+        self.stdout.write(
+            f"   строк: {stats['rows']}, новых: {stats['inserted']}, "
+            f"обновлено: {stats['updated']}, без изменений: {stats['unchanged']}, "
+            f"деактивировано: {stats['deactivated']}, пропущено: {stats['skipped']}"
+        )
+        rss = peak_rss_mb()
+        if rss is not None:
+            self.stdout.write(f"   пиковая память: {rss:.0f} МБ")
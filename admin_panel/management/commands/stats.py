@@ -0,0 +1,86 @@
+"""
+Статистика пользователей и лидов из сводки stats_daily
+
+python manage.py stats
+python manage.py stats --backfill
+
+--backfill пересчитывает сводку по telegram_users и leads одним проходом
+серверного курсора (в памяти только счетчики, не строки) и заменяет ее
+одной транзакцией. Бот обновляет сводку сам при записи пользователей и
+лидов (в том числе при смене региона или стадии), но не видит смену
+статуса лида в админке и правки в обход бота: после них сводка расходится
+с данными до следующего --backfill (например, ночного по cron).
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from stats import SUMMARY_SQL, Rollup, day, summarize, summary_params
+
+# Пользователи и лиды одним запросом: (created_at, регион, стадия, статус лида, пользователей, лидов)
+RAW_SQL = (
+    "SELECT created_at, region, stage, '', 1, 0 FROM telegram_users "
+    "UNION ALL "
+    "SELECT l.created_at, u.region, u.stage, l.status, 0, 1 "
+    "FROM leads l JOIN telegram_users u ON u.id = l.user_id"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Статистика пользователей и лидов; --backfill пересчитывает сводку. "
+        "Смена статуса лида в админке и правки в обход бота попадают в сводку "
+        "только после --backfill"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help="Пересчитать сводку с нуля (после смены статусов лидов в админке)")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.backfill(options['chunk_size'])
+
+        with connection.cursor() as cursor:
+            cursor.execute(SUMMARY_SQL.replace('?', '%s'), summary_params())
+            summary = summarize(cursor.fetchall())
+        self.stdout.write(
+            f"👥 Пользователей: {summary['users']} "
+            f"(сегодня +{summary['users_today']}, за неделю +{summary['users_week']})"
+        )
+        for title, counts in [("Регионы", summary['regions']), ("Стадии", summary['stages'])]:
+            self.stdout.write(f"   {title}: " + ", ".join(
+                f"{key} {count}" for key, count in sorted(counts.items(), key=lambda item: -item[1])
+            ))
+        self.stdout.write(f"📨 Лидов: {summary['leads']} (за неделю +{summary['leads_week']})")
+        for status, count in sorted(summary['lead_statuses'].items(), key=lambda item: -item[1]):
+            self.stdout.write(f"   {status}: {count}")
+
+    def backfill(self, chunk_size):
+        started = time.perf_counter()
+        rollup = Rollup()
+        scanned = 0
+        with transaction.atomic():
+            with connection.chunked_cursor() as cursor:
+                cursor.execute(RAW_SQL)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    scanned += len(rows)
+                    for created_at, region, stage, lead_status, users, leads in rows:
+                        rollup.add(day(created_at), region, stage, lead_status, users, leads)
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM stats_daily")
+                cursor.executemany(
+                    "INSERT INTO stats_daily (day, region, stage, lead_status, users, leads) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    rollup.rows(),
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Сводка пересчитана: {scanned} строк -> {len(rollup)} счетчиков "
+            f"за {time.perf_counter() - started:.1f} с"
+        ))
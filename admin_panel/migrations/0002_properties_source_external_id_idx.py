@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Индекс для сопоставления объектов фида по (source, external_id)"""
+
+    dependencies = [
+        ('admin_panel', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS properties_source_external_idx '
+            'ON properties (source, external_id)',
+            reverse_sql='DROP INDEX IF EXISTS properties_source_external_idx',
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Рассылки по сегментам пользователей и статусы доставки"""
+
+    dependencies = [
+        ('admin_panel', '0002_properties_source_external_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE TABLE IF NOT EXISTS campaigns ('
+            'id varchar(50) NOT NULL PRIMARY KEY, '
+            'text text NOT NULL, '
+            'segment text NOT NULL, '
+            'status varchar(20) NOT NULL, '
+            'last_user_id bigint NOT NULL DEFAULT 0, '
+            'sent integer NOT NULL DEFAULT 0, '
+            'failed integer NOT NULL DEFAULT 0, '
+            'created_at timestamp NOT NULL, '
+            'updated_at timestamp NOT NULL)',
+            reverse_sql='DROP TABLE IF EXISTS campaigns',
+        ),
+        migrations.RunSQL(
+            'CREATE TABLE IF NOT EXISTS campaign_deliveries ('
+            'campaign_id varchar(50) NOT NULL, '
+            'user_id bigint NOT NULL, '
+            'status varchar(20) NOT NULL, '
+            'message_id bigint NULL, '
+            "error varchar(200) NOT NULL DEFAULT '', "
+            'sent_at timestamp NOT NULL, '
+            'PRIMARY KEY (campaign_id, user_id))',
+            reverse_sql='DROP TABLE IF EXISTS campaign_deliveries',
+        ),
+        # Сегмент по региону читается по индексу сразу в порядке id (для продолжения с чекпоинта)
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS telegram_users_region_id_idx '
+            'ON telegram_users (region, id)',
+            reverse_sql='DROP INDEX IF EXISTS telegram_users_region_id_idx',
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Составные индексы под частые фильтры админки и бота"""
+
+    dependencies = [
+        ('admin_panel', '0003_campaigns'),
+    ]
+
+    operations = [
+        # Объекты региона сразу в порядке цены, без сортировки всей выборки
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS properties_region_active_price_idx '
+            'ON properties (region, is_active, price)',
+            reverse_sql='DROP INDEX IF EXISTS properties_region_active_price_idx',
+        ),
+        # Лиды пользователя по дате (и проверка недавних заявок в leads.py)
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS leads_user_created_idx '
+            'ON leads (user_id, created_at)',
+            reverse_sql='DROP INDEX IF EXISTS leads_user_created_idx',
+        ),
+        # Фото объектов страницы одним запросом, уже в порядке показа (images.py)
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS property_images_property_order_idx '
+            'ON property_images (property_id, is_primary DESC, "order")',
+            reverse_sql='DROP INDEX IF EXISTS property_images_property_order_idx',
+        ),
+    ]
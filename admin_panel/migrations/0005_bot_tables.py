@@ -0,0 +1,85 @@
+from django.db import migrations
+
+
+class RunVendorSQL(migrations.RunSQL):
+    """RunSQL с отдельным SQL для PostgreSQL (типы, которые там другие, чем в SQLite)"""
+
+    def __init__(self, sql, postgresql_sql, **kwargs):
+        super().__init__(sql, **kwargs)
+        self.postgresql_sql = postgresql_sql
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            self._run_sql(schema_editor, self.postgresql_sql)
+        else:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+    """Таблицы, которые ведет бот: сводка статистики, очередь AmoCRM, курсы валют, file_id фото и FSM"""
+
+    dependencies = [
+        ('admin_panel', '0004_admin_indexes'),
+    ]
+
+    operations = [
+        # Строки пользователей имеют lead_status = '', строки лидов - статус лида
+        migrations.RunSQL(
+            'CREATE TABLE IF NOT EXISTS stats_daily ('
+            'day varchar(10) NOT NULL, '
+            'region varchar(50) NOT NULL, '
+            'stage varchar(20) NOT NULL, '
+            'lead_status varchar(20) NOT NULL, '
+            'users integer NOT NULL, '
+            'leads integer NOT NULL, '
+            'PRIMARY KEY (day, region, stage, lead_status))',
+            reverse_sql='DROP TABLE IF EXISTS stats_daily',
+        ),
+        # next_attempt_at NULL - выгрузка больше не повторяется (ошибка, которую повтор не исправит).
+        # lead_id того же типа, что leads.id у Django: char(32) в SQLite, uuid в PostgreSQL
+        RunVendorSQL(
+            'CREATE TABLE IF NOT EXISTS amocrm_outbox ('
+            'lead_id char(32) NOT NULL PRIMARY KEY, '
+            'attempts integer NOT NULL DEFAULT 0, '
+            'next_attempt_at double precision NULL, '
+            "last_error text NOT NULL DEFAULT '', "
+            'created_at double precision NOT NULL)',
+            postgresql_sql='CREATE TABLE IF NOT EXISTS amocrm_outbox ('
+            'lead_id uuid NOT NULL PRIMARY KEY, '
+            'attempts integer NOT NULL DEFAULT 0, '
+            'next_attempt_at double precision NULL, '
+            "last_error text NOT NULL DEFAULT '', "
+            'created_at double precision NOT NULL)',
+            reverse_sql='DROP TABLE IF EXISTS amocrm_outbox',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS amocrm_outbox_next_idx ON amocrm_outbox (next_attempt_at)',
+            reverse_sql='DROP INDEX IF EXISTS amocrm_outbox_next_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE TABLE IF NOT EXISTS exchange_rates ('
+            'currency varchar(3) NOT NULL PRIMARY KEY, '
+            'usd_rate double precision NOT NULL, '
+            'updated_at timestamp NOT NULL)',
+            reverse_sql='DROP TABLE IF EXISTS exchange_rates',
+        ),
+        migrations.RunSQL(
+            'CREATE TABLE IF NOT EXISTS property_image_files ('
+            'image_id integer NOT NULL PRIMARY KEY, '
+            'file_id varchar(200) NOT NULL, '
+            'updated_at timestamp NOT NULL)',
+            reverse_sql='DROP TABLE IF EXISTS property_image_files',
+        ),
+        migrations.RunSQL(
+            'CREATE TABLE IF NOT EXISTS bot_fsm_states ('
+            'key text NOT NULL PRIMARY KEY, '
+            'state text NULL, '
+            'data text NOT NULL, '
+            'updated_at double precision NOT NULL)',
+            reverse_sql='DROP TABLE IF EXISTS bot_fsm_states',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS bot_fsm_states_updated_idx ON bot_fsm_states (updated_at)',
+            reverse_sql='DROP INDEX IF EXISTS bot_fsm_states_updated_idx',
+        ),
+    ]
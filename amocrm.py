@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Выгрузка лидов в AmoCRM
+Лиды ставятся в очередь amocrm_outbox в базе бота и отправляются в фоне
+пачками через POST /api/v4/leads/complex. Обработчики бота не ждут CRM:
+постановка в очередь - это одна запись в базу.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+import database
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+AMOCRM_DOMAIN = os.getenv('AMOCRM_DOMAIN', '')
+AMOCRM_ACCESS_TOKEN = os.getenv('AMOCRM_ACCESS_TOKEN', '')
+AMOCRM_PIPELINE_ID = os.getenv('AMOCRM_PIPELINE_ID')
+# Для тестов и бенчмарка можно направить выгрузку на локальный fake_amocrm.py
+AMOCRM_BASE_URL = os.getenv('AMOCRM_BASE_URL') or (f"https://{AMOCRM_DOMAIN}" if AMOCRM_DOMAIN else '')
+
+# AmoCRM допускает не больше 7 запросов в секунду и 50 сделок в одном запросе
+AMOCRM_RATE = float(os.getenv('AMOCRM_RATE', 7))
+AMOCRM_BATCH_SIZE = 50
+
+CLAIM_SQL = (
+    "SELECT o.lead_id, o.attempts, l.source, l.message, "
+    "u.telegram_id, u.username, u.first_name, u.last_name, "
+    "p.title, p.external_id "
+    "FROM amocrm_outbox o "
+    "JOIN leads l ON l.id = o.lead_id "
+    "JOIN telegram_users u ON u.id = l.user_id "
+    "LEFT JOIN properties p ON p.id = l.property_id "
+    "WHERE o.next_attempt_at <= ? "
+    "ORDER BY o.next_attempt_at LIMIT ?"
+)
+
+# Выборка и захват пачки идут под этой блокировкой (см. _claim)
+CLAIM_LOCK = 'amocrm_outbox'
+
+
+class RetryableError(Exception):
+    """Ошибка, после которой пачку стоит отправить повторно"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def backoff(attempts, base=1.0, cap=300.0):
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(cap, base * 2 ** attempts))
+
+
+def parse_retry_after(value):
+    """
+    Пауза из заголовка Retry-After в секундах: число или HTTP-дата (RFC 9110)
+
+    None, если заголовка нет или он некорректен (тогда - обычный backoff).
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+        if moment.tzinfo is None:
+            # Зона -0000: время в UTC
+            moment = moment.replace(tzinfo=timezone.utc)
+        return max(0.0, moment.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def lead_payload(row):
+    """Сделка с контактом для /api/v4/leads/complex"""
+    (lead_id, _, source, message, telegram_id, username, first_name, last_name,
+     property_title, property_external_id) = row
+    name = f"Telegram: {first_name or username or telegram_id}"
+    if property_title:
+        name += f" - {property_title}"
+    lead = {
+        "name": name[:255],
+        "request_id": lead_id,
+        "_embedded": {
+            "tags": [{"name": source or "telegram"}],
+            "contacts": [{
+                "first_name": first_name or '',
+                "last_name": last_name or '',
+                "name": " ".join(filter(None, [first_name, last_name])) or username or str(telegram_id),
+            }],
+        },
+    }
+    if AMOCRM_PIPELINE_ID:
+        lead["pipeline_id"] = int(AMOCRM_PIPELINE_ID)
+    return lead
+
+
+class LeadExporter:
+    """
+    Фоновая выгрузка очереди лидов в AmoCRM
+
+    Пачки до batch_size лидов, не чаще rate запросов в секунду,
+    до concurrency запросов одновременно через общий пул соединений.
+    Неудачные пачки повторяются с экспоненциальной задержкой и джиттером.
+    С export=False лиды только ставятся в очередь: при нескольких процессах
+    бота выгружает один (см. workers.py), иначе лимит rate умножился бы.
+    db - слой database.
+    """
+
+    def __init__(self, db, base_url=AMOCRM_BASE_URL, token=AMOCRM_ACCESS_TOKEN,
+                 batch_size=AMOCRM_BATCH_SIZE, rate=AMOCRM_RATE, concurrency=4,
+                 max_attempts=10, poll_interval=5.0, lease=120.0, export=True):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.db = db
+        self.batch_size = batch_size
+        self.bucket = TokenBucket(rate, capacity=1)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        # Сколько секунд пачка "занята" отправкой, прежде чем ее можно взять снова
+        self.lease = lease
+        self.export = export
+
+        self.exported = 0
+        self.failed = 0
+        self._wakeup = asyncio.Event()
+        self._session = None
+        self._task = None
+        self._inflight = set()
+
+    @property
+    def enabled(self):
+        return bool(self.base_url and self.token)
+
+    # Работа с очередью в базе
+
+    async def _enqueue(self, lead_ids):
+        now = time.time()
+        await self.db.executemany(
+            "INSERT INTO amocrm_outbox (lead_id, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?) ON CONFLICT(lead_id) DO NOTHING",
+            [(lead_id, now, now) for lead_id in lead_ids],
+        )
+
+    async def _enqueue_missing(self):
+        """Лиды без amo_crm_id, которых нет в очереди (например, созданные в админке)"""
+        now = time.time()
+        await self.db.execute(
+            "INSERT INTO amocrm_outbox (lead_id, next_attempt_at, created_at) "
+            "SELECT id, CAST(? AS double precision), CAST(? AS double precision) "
+            "FROM leads WHERE amo_crm_id = '' "
+            "ON CONFLICT(lead_id) DO NOTHING",
+            (now, now),
+        )
+
+    async def _claim(self):
+        now = time.time()
+        # Блокировка до выборки: два процесса не возьмут одни и те же лиды
+        async with self.db.transaction(lock=CLAIM_LOCK) as tx:
+            rows = await tx.fetch(CLAIM_SQL, (now, self.batch_size))
+            await tx.executemany(
+                "UPDATE amocrm_outbox SET next_attempt_at = ? WHERE lead_id = ?",
+                [(now + self.lease, row[0]) for row in rows],
+            )
+        return rows
+
+    async def _complete(self, results):
+        async with self.db.transaction() as tx:
+            await tx.executemany(
+                "UPDATE leads SET amo_crm_id = ?, amo_crm_url = ?, updated_at = ? WHERE id = ?",
+                results,
+            )
+            await tx.executemany(
+                "DELETE FROM amocrm_outbox WHERE lead_id = ?",
+                [(lead_id,) for _, _, _, lead_id in results],
+            )
+
+    async def _retry(self, rows, error, retry_after=None, permanent=False):
+        updates = []
+        for row in rows:
+            attempts = row[1] + 1
+            if permanent or (retry_after is None and attempts >= self.max_attempts):
+                next_attempt_at = None
+            else:
+                next_attempt_at = time.time() + (retry_after or backoff(attempts))
+            updates.append((attempts, next_attempt_at, str(error)[:500], row[0]))
+        await self.db.executemany(
+            "UPDATE amocrm_outbox SET attempts = ?, next_attempt_at = ?, last_error = ? "
+            "WHERE lead_id = ?",
+            updates,
+        )
+
+    # Отправка
+
+    async def enqueue(self, *lead_ids):
+        """Постановка лидов в очередь выгрузки"""
+        await self._enqueue(lead_ids)
+        self._wakeup.set()
+
+    async def _send(self, rows):
+        await self.bucket.acquire()
+        payload = [lead_payload(row) for row in rows]
+        async with self._session.post(
+            f"{self.base_url}/api/v4/leads/complex", json=payload
+        ) as response:
+            if response.status == 429 or response.status >= 500:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after:
+                    self.bucket.pause(retry_after)
+                raise RetryableError(f"HTTP {response.status}", retry_after)
+            if response.status >= 400:
+                raise ValueError(f"HTTP {response.status}: {(await response.text())[:200]}")
+            return await response.json()
+
+    async def _export(self, rows):
+        try:
+            created = await self._send(rows)
+        except (RetryableError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"AmoCRM недоступна ({e}), повторим {len(rows)} лидов позже")
+            await self._retry(rows, e, getattr(e, 'retry_after', None))
+            return
+        except Exception as e:
+            logger.error(f"AmoCRM отклонила пачку из {len(rows)} лидов: {e}")
+            self.failed += len(rows)
+            await self._retry(rows, e, None, True)
+            return
+
+        now = database.now()
+        results = []
+        for item in created if isinstance(created, list) else []:
+            if not isinstance(item, dict) or not item.get('id'):
+                continue
+            request_ids = item.get('request_id') or []
+            if isinstance(request_ids, str):
+                request_ids = [request_ids]
+            for lead_id in request_ids:
+                results.append((str(item['id']), f"{self.base_url}/leads/detail/{item['id']}", now, lead_id))
+        await self._complete(results)
+        self.exported += len(results)
+
+        # Лиды, для которых в ответе нет id сделки: повтор создал бы дубль в CRM
+        done = {lead_id for _, _, _, lead_id in results}
+        missing = [row for row in rows if row[0] not in done]
+        if missing:
+            logger.error(f"AmoCRM не вернула id сделки для {len(missing)} лидов из {len(rows)}")
+            self.failed += len(missing)
+            await self._retry(missing, ValueError("в ответе AmoCRM нет id сделки"), None, True)
+
+    async def _run(self):
+        await self._enqueue_missing()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            await semaphore.acquire()
+            try:
+                rows = await self._claim()
+            except Exception as e:
+                semaphore.release()
+                logger.error(f"Ошибка чтения очереди AmoCRM: {e}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if not rows:
+                semaphore.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._export(rows))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def start(self):
+        """Запуск фоновой выгрузки"""
+        if not self.enabled:
+            logger.warning("AmoCRM не настроена (AMOCRM_DOMAIN, AMOCRM_ACCESS_TOKEN), лиды копятся в очереди")
+        if not self.enabled or not self.export:
+            return
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            headers={"Authorization": f"Bearer {self.token}"},
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановка: дожидаемся отправленных пачек, остальное останется в очереди"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
@@ -0,0 +1,1437 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки ReloCompass
+Запуск: python bench.py [название]
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from database import SQLiteDatabase
+from tests.fixtures import CITIES, REGIONS, apply_migration, setup_django, synthetic_db
+
+
+def report(name, timings):
+    """Вывод задержек в микросекундах"""
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2] * 1e6
+    p99 = timings[int(len(timings) * 0.99)] * 1e6
+    print(f"   {name:<28} p50={p50:8.1f} мкс   p99={p99:8.1f} мкс")
+
+
+async def open_database(path):
+    """Запущенный слой database над тестовой базой"""
+    db = SQLiteDatabase(path)
+    await db.start()
+    return db
+
+
+async def bench_fsm(updates=5000, users=500):
+    """Задержка чтения/записи FSM-состояния на один апдейт"""
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from fsm_storage import DatabaseStorage, create_storage
+
+    print("🗄️ FSM-хранилища: get_state + update_data + set_state на апдейт")
+
+    tmp = tempfile.mkdtemp()
+
+    async def fsm_db(name):
+        # Таблица bot_fsm_states из миграции admin_panel 0005
+        path = os.path.join(tmp, name)
+        conn = sqlite3.connect(path)
+        with conn:
+            apply_migration(conn, '0005_bot_tables')
+        conn.close()
+        return await open_database(path)
+
+    async def memory():
+        return MemoryStorage()
+
+    async def in_database(name, **kwargs):
+        return DatabaseStorage(await fsm_db(name), **kwargs)
+
+    async def redis():
+        return create_storage('redis')
+
+    storages = [
+        ("memory", memory),
+        ("sqlite", lambda: in_database('fsm.sqlite3')),
+        ("sqlite (без кэша)", lambda: in_database('fsm_nc.sqlite3', cache_size=0)),
+        ("redis", redis),
+    ]
+
+    for name, factory in storages:
+        storage = await factory()
+        try:
+            timings = []
+            for i in range(updates):
+                key = StorageKey(bot_id=1, chat_id=i % users, user_id=i % users)
+                started = time.perf_counter()
+                await storage.get_state(key)
+                await storage.update_data(key, {"step": i})
+                await storage.set_state(key, "UserStates:waiting_for_family")
+                timings.append(time.perf_counter() - started)
+            report(name, timings)
+        except Exception as e:
+            print(f"   {name:<28} пропущено: {e}")
+        finally:
+            await storage.close()
+
+
+def fake_message_update(update_id, chat_id, text="/start"):
+    """Апдейт с сообщением, как его присылает Telegram"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+async def bench_webhook(updates=20000, chats=1000, concurrency=200, handler_delay=0.001):
+    """Пропускная способность webhook-режима на фейковых POST от Telegram"""
+    import aiohttp
+    from aiogram import Bot, Dispatcher
+    from aiohttp import web
+    from webhook import create_app
+
+    print(f"🌐 Webhook: {updates} апдейтов, {chats} чатов, обработчик {handler_delay * 1000:.0f} мс")
+
+    bot = Bot(token="123456:TEST-TOKEN-FOR-BENCHMARK")
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handler(message):
+        await asyncio.sleep(handler_delay)
+
+    app = create_app(dp, bot, workers=64, queue_size=5000)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/webhook"
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        counter = iter(range(updates))
+
+        async def sender():
+            for i in counter:
+                async with session.post(url, json=fake_message_update(i, i % chats)) as resp:
+                    await resp.read()
+
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+
+    queue = app['updates']
+    await asyncio.gather(*(q.join() for q in queue.queues))
+    elapsed = time.perf_counter() - started
+    metrics = queue.metrics()
+    await runner.cleanup()
+
+    print(f"   обработано: {metrics['processed']}, отказов: {metrics['rejected']}")
+    print(f"   {metrics['processed'] / elapsed:.0f} апдейтов/с, p99 обработки {metrics['p99_latency_ms']} мс")
+
+
+async def bench_keyboards(calls=20000):
+    """Стоимость клавиатуры на один callback: сборка заново против реестра"""
+    import tracemalloc
+    from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+    from keyboards import DEFAULT_REGIONS, registry
+
+    print(f"⌨️ Клавиатура регионов: {calls} вызовов")
+
+    def build_fresh():
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=title, callback_data=f"region_{code}")]
+            for code, title in DEFAULT_REGIONS
+        ])
+
+    registry.warm()
+    for name, func in [("сборка заново", build_fresh), ("реестр", lambda: registry.get("region"))]:
+        timings = []
+        for _ in range(calls):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        report(name, timings)
+
+        tracemalloc.start()
+        kept = [func() for _ in range(1000)]
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        print(f"   {'':<28} {allocated / 1000:.0f} байт на вызов")
+
+
+def fake_callback_update(update_id, chat_id, data):
+    """Апдейт с нажатием inline-кнопки"""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "1",
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "data": data,
+        },
+    }
+
+
+async def bench_callbacks(updates=1000):
+    """Стоимость маршрутизации callback'а при росте числа действий"""
+    from aiogram import Bot, Dispatcher
+    from callbacks import CallbackRouter
+
+    print("🔀 Маршрутизация callback_data (нажатие на последнее действие)")
+    bot = Bot(token="123456:TEST-TOKEN-FOR-BENCHMARK")
+
+    async def handler(callback, **kwargs):
+        pass
+
+    for actions in (10, 100, 500):
+        dp_lambdas = Dispatcher()
+        for i in range(actions):
+            dp_lambdas.callback_query.register(handler, lambda c, p=f"action{i}_": c.data.startswith(p))
+
+        dp_router = Dispatcher()
+        router = CallbackRouter()
+        for i in range(actions):
+            router.register(f"action{i}", handler, arity=1)
+        dp_router.callback_query.register(router.dispatch)
+
+        for name, dp, data in [
+            ("lambda-фильтры", dp_lambdas, f"action{actions - 1}_x"),
+            ("роутер", dp_router, f"action{actions - 1}:x"),
+        ]:
+            timings = []
+            for i in range(updates):
+                update = fake_callback_update(i, i, data)
+                started = time.perf_counter()
+                await dp.feed_raw_update(bot, update)
+                timings.append(time.perf_counter() - started)
+            report(f"{name}, {actions} действий", timings)
+
+    await bot.session.close()
+
+
+async def bench_catalog(properties=50000, queries=5000):
+    """Подбор объектов по региону, бюджету и спальням"""
+    from catalog import Catalog, Cursor
+    from profiles import BUDGET_RANGES
+
+    print(f"🏠 Каталог: {properties} объектов")
+    path = synthetic_db(properties)
+    catalog = Catalog(await open_database(path))
+
+    started = time.perf_counter()
+    await catalog.refresh()
+    print(f"   первая загрузка: {time.perf_counter() - started:.2f} с")
+
+    rng = random.Random(2)
+    budgets = list(BUDGET_RANGES.values())
+    timings = []
+    for _ in range(queries):
+        region, budget, bedrooms = rng.choice(REGIONS), rng.choice(budgets), rng.randint(1, 3)
+        started = time.perf_counter()
+        catalog.search(region, budget=budget, min_bedrooms=bedrooms, limit=10)
+        timings.append(time.perf_counter() - started)
+    report("search", timings)
+
+    timings = []
+    for _ in range(queries // 20):
+        region, budget = rng.choice(REGIONS), rng.choice(budgets)
+        cursor = None
+        for _ in range(20):
+            started = time.perf_counter()
+            listings, cursors, has_more = catalog.page(region, budget=budget, cursor=cursor, limit=5)
+            timings.append(time.perf_counter() - started)
+            if not has_more:
+                break
+            cursor = cursors[-1]
+    report("page (20 страниц подряд)", timings)
+
+    # Без кэша страниц: страница из "остальных" после RED и буста - бинарный
+    # поиск в массиве своего приоритета, а не проход по всему диапазону бюджета
+    timings = []
+    for _ in range(queries):
+        index = catalog.regions[rng.choice(REGIONS)]
+        min_price, max_price = rng.choice(budgets)
+        tier = index.tiers[2]
+        lo, hi = tier.bounds(min_price, max_price)
+        if lo >= hi:
+            continue
+        i = rng.randrange(lo, hi)
+        cursor = Cursor(2, tier.prices[i], tier.ids[i])
+        started = time.perf_counter()
+        index.page(min_price, max_price, cursor=cursor, limit=5)
+        timings.append(time.perf_counter() - started)
+    report("page без кэша (глубоко)", timings)
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(
+            "UPDATE properties SET price = price + 1000, updated_at = ? WHERE rowid % 100 = 0",
+            (str(datetime.now(timezone.utc).replace(tzinfo=None)),),
+        )
+    conn.close()
+    started = time.perf_counter()
+    await catalog.refresh()
+    print(f"   обновление 1% объектов: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+
+async def bench_boosts(properties=50000, boosts=5000, window=3.0):
+    """Окончание бустов по расписанию: точность снятия и сброс страниц только своего региона"""
+    from catalog import BoostSchedule, Catalog
+    from profiles import BUDGET_RANGES
+
+    print(f"🚀 Бусты: {properties} объектов, {boosts} бустов заканчиваются за {window:.0f} с")
+    path = synthetic_db(properties)
+    rng = random.Random(8)
+    conn = sqlite3.connect(path)
+    ids = [row[0] for row in conn.execute("SELECT id FROM properties")]
+    start = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=1)
+    with conn:
+        conn.execute("UPDATE properties SET boost_expiry = NULL")
+        conn.executemany(
+            "UPDATE properties SET boost_expiry = ? WHERE id = ?",
+            [(str(start + timedelta(seconds=rng.uniform(0, window))), pid) for pid in rng.sample(ids, boosts)],
+        )
+    conn.close()
+
+    schedule = BoostSchedule()
+    started = time.perf_counter()
+    for i, pid in enumerate(ids[:boosts]):
+        schedule.set(pid, 1e9 + rng.random() * 1e6)
+    for pid in ids[:boosts]:
+        # Продление буста: старая запись в куче остается и пропускается
+        schedule.set(pid, 1e9 + rng.random() * 1e6)
+    expired = schedule.pop_expired(2e9)
+    elapsed = time.perf_counter() - started
+    print(f"   {'расписание':<28} {boosts} постановок + {boosts} продлений + снятие всех: "
+          f"{elapsed / (3 * boosts) * 1e6:.2f} мкс на операцию, снято {len(expired)}")
+
+    catalog = Catalog(await open_database(path))
+    await catalog.start()
+    print(f"   {'восстановлено из базы':<28} {len(catalog.boosts)} бустов")
+    budgets = list(BUDGET_RANGES.values())
+
+    async def check():
+        """Флаги буста против сравнения boost_expiry со временем; число ошибок"""
+        # Сам бенчмарк занимает event loop на десятки мс: даем таймеру сработать
+        now, wrong = time.time(), 0
+        await asyncio.sleep(0.005)
+        for index in catalog.regions.values():
+            for pid, boosted in zip(index.ids, index.boosted):
+                expiry = catalog.listings[pid].boost_expiry
+                if bool(boosted) != (expiry > now) and not now < expiry <= time.time():
+                    wrong += 1
+        return wrong
+
+    hits = misses = wrong = checks = 0
+    versions = dict(catalog.versions)
+    invalidations = 0
+    timings = []
+    deadline = time.time() + window + 1.5
+    while time.time() < deadline:
+        for _ in range(50):
+            region, budget = rng.choice(REGIONS), rng.choice(budgets)
+            cached = budget in [key[0] for key in catalog.pages.get(region, {})]
+            started = time.perf_counter()
+            catalog.page(region, budget=budget, limit=5)
+            timings.append(time.perf_counter() - started)
+            hits += cached
+            misses += not cached
+        if checks % 10 == 0:
+            wrong += await check()
+        checks += 1
+        for region, version in catalog.versions.items():
+            invalidations += version != versions.get(region)
+        versions = dict(catalog.versions)
+        await asyncio.sleep(0.01)
+    await catalog.close()
+    report("страница каталога", timings)
+    print(f"   {'кэш страниц':<28} {hits / (hits + misses):.1%} попаданий, "
+          f"сбросов региона {invalidations}, осталось бустов {len(catalog.boosts)}")
+    print(f"   {'флаги буста':<28} {'совпадают со временем' if not wrong else f'НЕ совпадают у {wrong}'}")
+
+
+async def bench_search(properties=100000, queries=300):
+    """Поиск по свободному тексту: маски слов и удобств против LIKE по таблице"""
+    from catalog import Catalog
+    from search import parse_query, words
+
+    print(f"🔎 Поиск по тексту: {properties} объектов")
+    path = synthetic_db(properties)
+    rng = random.Random(9)
+    features = [
+        "pool", "garden", "sea view", "gym", "parking", "near the beach", "rice field view",
+        "coworking nearby", "quiet street", "new building", "pets allowed", "rooftop terrace",
+        "бассейн", "вид на море", "парковка", "рядом с пляжем", "новый дом", "тихий район",
+        "можно с животными", "терраса на крыше", "рядом школа", "кондиционер",
+    ]
+    conn = sqlite3.connect(path)
+    descriptions = {
+        pid: f"{title}. " + ", ".join(rng.sample(features, rng.randint(2, 5)))
+        for pid, title in conn.execute("SELECT id, title FROM properties")
+    }
+    with conn:
+        conn.executemany(
+            "UPDATE properties SET description = ? WHERE id = ?",
+            [(description, pid) for pid, description in descriptions.items()],
+        )
+    conn.close()
+
+    catalog = Catalog(await open_database(path))
+    started = time.perf_counter()
+    await catalog.refresh()
+    print(f"   {'загрузка с индексом':<28} {time.perf_counter() - started:.2f} с, "
+          f"слов в индексе {len(catalog.fulltext.postings)}")
+
+    texts = [
+        "2 bedroom Canggu with good internet",
+        "villa with pool and sea view",
+        "3 спальни вид на море с мебелью",
+        "Batumi new building parking",
+        "для релокантов рядом с пляжем",
+        "rooftop terrace gym Limassol 4 bedrooms",
+    ]
+    timings = []
+    for _ in range(queries):
+        text = rng.choice(texts)
+        started = time.perf_counter()
+        catalog.find(text, limit=10)
+        timings.append(time.perf_counter() - started)
+    report("индекс (10 лучших)", timings)
+
+    # То же через LIKE: каждое слово ищется подстрокой в заголовке, описании и городе
+    conn = sqlite3.connect(path)
+    timings = []
+    for _ in range(queries // 10):
+        query = parse_query(rng.choice(texts))
+        where, params = ["is_active = 1"], []
+        for term in query.terms:
+            where.append("(title LIKE ? OR description LIKE ? OR city LIKE ?)")
+            params += [f"%{term}%"] * 3
+        where += [f"{facet} = 1" for facet in query.facets]
+        if query.min_bedrooms is not None:
+            where.append("bedrooms >= ?")
+            params.append(query.min_bedrooms)
+        started = time.perf_counter()
+        conn.execute(
+            f"SELECT id FROM properties WHERE {' AND '.join(where)} ORDER BY price LIMIT 10", params
+        ).fetchall()
+        timings.append(time.perf_counter() - started)
+    conn.close()
+    report("LIKE '%...%' в SQLite", timings)
+
+    # Сверка числа найденных с проходом по всем объектам
+    mismatches = 0
+    for text in texts:
+        query = parse_query(text)
+        expected = 0
+        for pid, listing in catalog.listings.items():
+            terms = set(words(f"{listing.title} {descriptions[pid]} {listing.city} {listing.region}"))
+            known = [term for term in query.terms if term in catalog.fulltext.postings]
+            bedrooms = -1 if listing.bedrooms is None else listing.bedrooms
+            expected += (
+                all(term in terms for term in known)
+                and all(getattr(listing, facet) for facet in query.facets)
+                and (query.min_bedrooms is None or bedrooms >= query.min_bedrooms)
+            )
+        mismatches += catalog.find(text)[1] != expected
+    print(f"   {'сверка с полным проходом':<28} {'совпадает' if not mismatches else f'НЕ совпадает в {mismatches} запросах'}")
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(
+            "UPDATE properties SET description = description || ', sauna', updated_at = ? WHERE rowid % 100 = 0",
+            (str(datetime.now(timezone.utc).replace(tzinfo=None)),),
+        )
+    conn.close()
+    started = time.perf_counter()
+    await catalog.refresh()
+    elapsed = time.perf_counter() - started
+    print(f"   {'обновление 1% объектов':<28} {elapsed * 1000:.1f} мс, "
+          f"по слову sauna найдено {catalog.find('sauna')[1]}")
+
+
+async def bench_matching(properties=50000):
+    """Рекомендации под профиль: расчет с нуля и из запомненных сочетаний"""
+    from catalog import Catalog, min_bedrooms_for
+    from matching import Matcher, WEIGHTS
+    from profiles import BUDGET_RANGES, FAMILY_MEMBERS
+
+    print(f"🎯 Подбор под профиль: {properties} объектов, все сочетания ответов onboarding")
+    catalog = Catalog(await open_database(synthetic_db(properties)))
+    await catalog.refresh()
+    matcher = Matcher(catalog)
+    profiles = [
+        (region, budget, family, stage)
+        for region in REGIONS for budget in BUDGET_RANGES.values()
+        for family in FAMILY_MEMBERS.values() for stage in ("planning", "searching", "ready")
+    ]
+
+    def python_recommend(region, budget, family, stage, limit=3):
+        """Та же оценка построчно на Python - для сравнения"""
+        now, need = time.time(), min_bedrooms_for(family)
+        low, high = budget
+        scored = []
+        for pid in catalog.regions[region].ids:
+            listing = catalog.listings[pid]
+            fit = 1.0 if high is None else min(1.0, max(0.0, 1 - 2 * (listing.price - high) / high))
+            if low and listing.price < low:
+                fit = 0.7
+            value = WEIGHTS['budget'] * fit
+            bedrooms = -1 if listing.bedrooms is None else listing.bedrooms
+            value += WEIGHTS['bedrooms'] * (
+                1.0 if bedrooms >= need else 0.5 if bedrooms < 0 else max(0.0, 1 - 0.4 * (need - bedrooms))
+            )
+            value += WEIGHTS['relocants'] * listing.is_for_relocants + WEIGHTS['internet'] * listing.good_internet
+            value += WEIGHTS['furniture'] * (2.0 if stage == 'ready' else 1.0) * listing.has_furniture
+            value += WEIGHTS['red'] * (listing.source == 'red') + WEIGHTS['boost'] * (listing.boost_expiry > now)
+            scored.append((-value, listing.price, pid))
+        scored.sort()
+        return scored[:limit]
+
+    for name, run in [
+        ("Python построчно", lambda p: python_recommend(*p)),
+        ("NumPy, первый раз", lambda p: matcher.recommend(*p)),
+        ("NumPy, запомнено", lambda p: matcher.recommend(*p)),
+    ]:
+        timings = []
+        for profile in profiles:
+            started = time.perf_counter()
+            run(profile)
+            timings.append(time.perf_counter() - started)
+        report(name, timings)
+
+    expected = [pid for _, _, pid in python_recommend(*profiles[0])]
+    actual = [listing.id for listing, _ in matcher.recommend(*profiles[0])]
+    print(f"   {'совпадение с Python':<28} {'да' if expected == actual else 'нет'}")
+
+
+async def bench_pricing(properties=50000, queries=5000):
+    """Бюджет в USD по объектам в разных валютах и пересчет после смены курса"""
+    from decimal import ROUND_HALF_UP, Decimal
+
+    from catalog import Catalog
+    from pricing import CENT, DEFAULT_RATES
+    from profiles import BUDGET_RANGES
+
+    print(f"💱 Цены в USD: {properties} объектов в USD, EUR и THB")
+    path = synthetic_db(properties)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("UPDATE properties SET price_currency = 'EUR', price = price / 1.08 WHERE rowid % 10 < 3")
+        conn.execute("UPDATE properties SET price_currency = 'THB', price = price / 0.028 WHERE rowid % 10 >= 8")
+        # Валюта без курса (пустая из фида): такие объекты не должны попадать в бюджет
+        conn.execute("UPDATE properties SET price_currency = '' WHERE rowid % 100 = 50")
+        rows = conn.execute("SELECT region, price, price_currency FROM properties").fetchall()
+    catalog = Catalog(await open_database(path))
+    await catalog.refresh()
+
+    rng = random.Random(4)
+    budgets = list(BUDGET_RANGES.values())
+    by_region = {}
+    for region, price, currency in rows:
+        by_region.setdefault(region, []).append((str(price), currency))
+
+    def decimal_count(region, budget):
+        """Построчно через Decimal (цена в USD до цента), как при сравнении в ORM"""
+        low, high = budget
+        count = 0
+        for price, currency in by_region[region]:
+            if currency not in DEFAULT_RATES:
+                continue
+            usd = (Decimal(price) * Decimal(str(DEFAULT_RATES[currency]))).quantize(CENT, ROUND_HALF_UP)
+            if usd >= low and (high is None or usd <= high):
+                count += 1
+        return count
+
+    for name, run in [("Decimal построчно", decimal_count), ("бинарный поиск", catalog.count)]:
+        timings = []
+        for _ in range(queries // (100 if run is decimal_count else 1)):
+            region, budget = rng.choice(REGIONS), rng.choice(budgets)
+            started = time.perf_counter()
+            run(region, budget)
+            timings.append(time.perf_counter() - started)
+        report(name, timings)
+    # Цена в USD округлена до цента: на границах бюджета индекс совпадает с Decimal
+    mismatched = sum(
+        decimal_count(region, budget) != catalog.count(region, budget)
+        for region in REGIONS for budget in budgets
+    )
+    unpriced = sum(listing.price_usd is None for listing in catalog.listings.values())
+    print(f"   {'объектов: Decimal / индекс':<28} "
+          f"{'совпадает во всех регионах и бюджетах' if not mismatched else f'НЕ совпадает в {mismatched}'}, "
+          f"без курса вне выдачи: {unpriced}")
+
+    for currency, rate in [("EUR", 1.2), ("THB", 0.03)]:
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO exchange_rates VALUES (?, ?, ?)",
+                (currency, rate, str(datetime.now(timezone.utc).replace(tzinfo=None))),
+            )
+        conn.close()
+        currencies = await catalog.rates.refresh()
+        started = time.perf_counter()
+        repriced = catalog.reprice(currencies)
+        elapsed = time.perf_counter() - started
+        ordered = all(list(index.prices) == sorted(index.prices) for index in catalog.regions.values())
+        print(f"   {'новый курс ' + currency:<28} {repriced} объектов за {elapsed * 1000:.1f} мс, "
+              f"порядок цен {'верный' if ordered else 'НАРУШЕН'}")
+
+
+async def bench_feed(rows=1000000):
+    """Импорт синтетического CSV-фида: первый прогон и повторный без изменений"""
+    import csv
+
+    print(f"📥 Импорт фида: {rows} строк")
+    path = synthetic_db()
+    # Индекс из миграции admin_panel 0002
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE INDEX properties_source_external_idx ON properties (source, external_id)")
+    conn.close()
+    setup_django(path)
+
+    feed = os.path.join(os.path.dirname(path), 'feed.csv')
+    rng = random.Random(3)
+    with open(feed, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'title', 'description', 'region', 'city', 'price', 'currency',
+                         'bedrooms', 'has_furniture', 'good_internet'])
+        for i in range(rows):
+            region = rng.choice(REGIONS)
+            row = [f"ext-{i}", f"Listing {i}", "Synthetic listing", region,
+                   rng.choice(CITIES[region]), rng.randint(30, 1500) * 1000, "USD",
+                   rng.randint(0, 5), rng.randint(0, 1), rng.randint(0, 1)]
+            if i % 10000 == 9999:
+                # Битые строки партнера пропускаются, не обрывая пакет:
+                # пустая или нечисловая цена, слишком длинный заголовок, без региона
+                row[[5, 5, 1, 3][i // 10000 % 4]] = ['', 'по запросу', 'x' * 300, ''][i // 10000 % 4]
+            writer.writerow(row)
+
+    from django.core.management import call_command
+    from admin_panel.management.commands.import_feed import Command
+
+    for attempt in ("первый импорт", "повторный импорт"):
+        print(f"   {attempt}:")
+        # Django запрещает синхронную работу с базой внутри event loop
+        await asyncio.to_thread(call_command, Command(), feed, source='partner')
+
+
+async def bench_amocrm(leads=3000, failure_rate=0.05):
+    """Выгрузка лидов в локальную фейковую AmoCRM (7 запросов/с, 5% ошибок 500)"""
+    from aiohttp import web
+    import amocrm
+    import fake_amocrm
+
+    print(f"📤 AmoCRM: {leads} лидов, {failure_rate:.0%} ответов 500")
+    path = synthetic_db(100)
+    conn = sqlite3.connect(path)
+    now = str(datetime.now(timezone.utc).replace(tzinfo=None))
+    with conn:
+        conn.executemany(
+            "INSERT INTO telegram_users (telegram_id, username, first_name, last_name, stage, "
+            "region, is_active, created_at, updated_at) VALUES (?, '', ?, '', 'ready', 'bali', 1, ?, ?)",
+            [(i, f"User {i}", now, now) for i in range(leads)],
+        )
+        conn.executemany(
+            "INSERT INTO leads (id, source, message, status, amo_crm_id, amo_crm_url, created_at, "
+            "updated_at, user_id) VALUES (?, 'telegram', '', 'new', '', '', ?, ?, ?)",
+            [(uuid.uuid4().hex, now, now, i + 1) for i in range(leads)],
+        )
+    conn.close()
+
+    app = fake_amocrm.create_app(failure_rate=failure_rate)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    amocrm.backoff = lambda attempts, base=0.05, cap=1.0: random.uniform(0, min(cap, base * 2 ** attempts))
+    exporter = amocrm.LeadExporter(
+        await open_database(path), base_url=f"http://127.0.0.1:{port}", token="test", poll_interval=0.05,
+    )
+    started = time.perf_counter()
+    await exporter.start()
+    while exporter.exported < leads and time.perf_counter() - started < 120:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    await exporter.close()
+    await runner.cleanup()
+
+    conn = sqlite3.connect(path)
+    written = conn.execute("SELECT COUNT(*) FROM leads WHERE amo_crm_id != ''").fetchone()[0]
+    conn.close()
+    stats = app["stats"]
+    print(f"   выгружено: {written}/{leads} за {elapsed:.1f} с ({written / elapsed:.0f} лидов/с)")
+    print(f"   запросов: {stats['requests']}, 429: {stats['throttled']}, 500: {stats['failed']}")
+
+
+async def bench_throttle(updates=100000, users=100000):
+    """Накладные расходы ограничения частоты на один апдейт"""
+    from aiogram import types
+    from throttling import MemoryLimiter, ThrottlingMiddleware
+
+    print(f"🚦 Ограничение частоты: {updates} апдейтов от {users} пользователей")
+
+    async def handler(event, data):
+        pass
+
+    events = [
+        types.Update.model_validate(fake_message_update(i, i % users))
+        for i in range(updates)
+    ]
+    callbacks = [
+        types.Update.model_validate(fake_callback_update(i, i % users, f"page:n:{i}"))
+        for i in range(updates)
+    ]
+    middleware = ThrottlingMiddleware(MemoryLimiter(rate=1000, burst=1000))
+
+    def timed(call):
+        async def run(items):
+            timings = []
+            for event in items:
+                data = {"event_from_user": event.event.from_user}
+                started = time.perf_counter()
+                await call(handler, event, data)
+                timings.append(time.perf_counter() - started)
+            return timings
+        return run
+
+    baseline = await timed(lambda h, event, data: h(event, data))(events)
+    report("без middleware", baseline)
+    report("сообщение", await timed(middleware)(events))
+    report("нажатие кнопки", await timed(middleware)(callbacks))
+    print(f"   {'':<28} ведер в памяти: {len(middleware.limiter)}, нажатий: {len(middleware.pressed)}")
+
+    # Флуд одного пользователя: проходит только burst апдейтов
+    flood = ThrottlingMiddleware(MemoryLimiter(rate=2, burst=5))
+    passed = 0
+
+    async def counting(event, data):
+        nonlocal passed
+        passed += 1
+
+    for event in [events[0]] * 100:
+        await flood(counting, event, {"event_from_user": event.event.from_user})
+    print(f"   {'флуд 100 сообщений подряд':<28} обработано {passed}, отброшено {flood.dropped}")
+
+    limiter = middleware.limiter
+    started = time.perf_counter()
+    evicted = limiter.evict(limiter.shards[0], now=time.monotonic() + limiter.idle + 1)
+    print(f"   {'очистка одного шарда':<28} {evicted} ведер за {(time.perf_counter() - started) * 1e3:.2f} мс")
+
+
+async def start_fake_telegram(**kwargs):
+    """Локальный фейковый Bot API и бот, который к нему ходит"""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiohttp import web
+    import fake_telegram
+
+    app = fake_telegram.create_app(**kwargs)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"))
+    bot = Bot(token="123456:TEST-TOKEN-FOR-BENCHMARK", session=session)
+    return app, runner, bot
+
+
+async def bench_sender(messages=600, chats=200, interactive=20):
+    """Отправка сообщений на пределе лимитов Telegram (30/с на бота, 1/с в чат)"""
+    from aiogram.exceptions import TelegramRetryAfter
+    import sender
+
+    print(f"📨 Отправка {messages} сообщений в {chats} чатов через фейковый Bot API")
+
+    # Без очереди: все сразу
+    app, runner, bot = await start_fake_telegram()
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(bot.send_message(i % chats, f"Рассылка {i}") for i in range(messages)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+    throttled = sum(isinstance(r, TelegramRetryAfter) for r in results)
+    print(f"   {'без очереди':<28} доставлено {messages - throttled}, 429: {throttled} за {elapsed:.1f} с")
+    await bot.session.close()
+    await runner.cleanup()
+
+    # Через очередь: рассылка и ответы пользователям вперемешку
+    app, runner, bot = await start_fake_telegram()
+    scheduler = sender.SendScheduler()
+    bot.session.middleware(scheduler)
+    await scheduler.start()
+
+    async def broadcast():
+        with sender.priority(sender.BROADCAST):
+            await asyncio.gather(*(bot.send_message(i % chats, f"Рассылка {i}") for i in range(messages)))
+
+    async def reply(i):
+        await asyncio.sleep(i * 0.5)
+        started = time.perf_counter()
+        await bot.send_message(chats + i, "Ответ пользователю")
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(broadcast(), *(reply(i) for i in range(interactive)))
+    elapsed = time.perf_counter() - started
+    stats = app["stats"]
+    print(f"   {'через очередь':<28} доставлено {stats['sent']} за {elapsed:.1f} с "
+          f"({stats['sent'] / elapsed:.1f} сообщений/с), 429: {stats['throttled']}")
+    report("ответ во время рассылки", latencies[1:])
+
+    # Двадцать правок одного сообщения подряд
+    message = await bot.send_message(1, "Каталог")
+    requests = stats["requests"]
+    await asyncio.gather(*(
+        bot.edit_message_text(f"Страница {i}", chat_id=1, message_id=message.message_id)
+        for i in range(20)
+    ))
+    print(f"   {'20 правок одного сообщения':<28} запросов к API: {stats['requests'] - requests}")
+
+    await scheduler.close()
+    await bot.session.close()
+    await runner.cleanup()
+
+
+async def bench_campaign(users=3000, batch_size=200, blocked_share=0.02):
+    """Рассылка по сегменту с падением после первой пачки и продолжением с чекпоинта"""
+    import sender
+
+    print(f"📣 Рассылка по сегменту region=bali из {users} пользователей")
+    path = synthetic_db()
+    rng = random.Random(5)
+    now = str(datetime.now(timezone.utc).replace(tzinfo=None))
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO telegram_users (telegram_id, username, first_name, last_name, stage, "
+            "region, is_active, created_at, updated_at) VALUES (?, '', 'Test', '', ?, ?, 1, ?, ?)",
+            [(100000 + i, rng.choice(["planning", "searching", "ready"]), rng.choice(REGIONS), now, now)
+             for i in range(users)],
+        )
+        # Таблицы и индекс из миграции admin_panel 0003
+        apply_migration(conn, '0003_campaigns')
+        segment = [row[0] for row in conn.execute(
+            "SELECT telegram_id FROM telegram_users WHERE region = 'bali'"
+        )]
+    conn.close()
+    setup_django(path)
+
+    from django.core.management import call_command
+    from admin_panel.management.commands.campaign import CampaignSender, Command
+
+    await asyncio.to_thread(
+        call_command, Command(), 'create', 'bench', '--text', 'Новые виллы на Бали', '--region', 'bali',
+    )
+    blocked = set(rng.sample(segment, int(len(segment) * blocked_share)))
+    app, runner, bot = await start_fake_telegram(blocked=blocked)
+    scheduler = sender.SendScheduler()
+    bot.session.middleware(scheduler)
+    await scheduler.start()
+
+    # Первый запуск "падает" после первой пачки
+    task = asyncio.create_task(CampaignSender('bench', bot, batch_size).run())
+    conn = sqlite3.connect(path)
+    while conn.execute("SELECT last_user_id FROM campaigns").fetchall()[0][0] == 0:
+        await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    print(f"   прервана после {app['stats']['sent'] + app['stats']['blocked']} сообщений")
+
+    started = time.perf_counter()
+    sent, failed = await CampaignSender('bench', bot, batch_size).run()
+    elapsed = time.perf_counter() - started
+    stats = app["stats"]
+    deliveries = conn.execute("SELECT COUNT(*) FROM campaign_deliveries").fetchall()[0][0]
+    conn.close()
+    print(f"   продолжение: отправлено {sent}, ошибок {failed} за {elapsed:.1f} с "
+          f"({(sent + failed) / elapsed:.1f} в секунду)")
+    print(f"   сегмент {len(segment)}, статусов доставки {deliveries}, "
+          f"сообщений в API {stats['sent']} (повторов {stats['sent'] + stats['blocked'] - len(segment)}), "
+          f"заблокировали {stats['blocked']}, 429: {stats['throttled']}")
+
+    await scheduler.close()
+    await bot.session.close()
+    await runner.cleanup()
+
+
+async def bench_images(listings=30, photos=5, download_delay=0.05):
+    """Альбом фото объекта: по URL (Telegram скачивает) и по сохраненным file_id"""
+    from images import ImageStore
+
+    print(f"📷 Фото объектов: {listings} альбомов по {photos} фото, скачивание {download_delay * 1000:.0f} мс")
+    path = synthetic_db(listings * 2)
+    now = str(datetime.now(timezone.utc).replace(tzinfo=None))
+    conn = sqlite3.connect(path)
+    with conn:
+        ids = [row[0] for row in conn.execute("SELECT id FROM properties")]
+        conn.executemany(
+            'INSERT INTO property_images (image_url, is_primary, "order", created_at, property_id) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(f"https://cdn.example.com/{pid}/{i}.jpg", i == 0, i, now, pid)
+             for pid in ids for i in range(photos)],
+        )
+    conn.close()
+
+    app, runner, bot = await start_fake_telegram(
+        rate=1000, chat_rate=1000, chat_burst=1000, download_delay=download_delay,
+    )
+    store = ImageStore(await open_database(path), cache_chat_id=-100)
+
+    for name, batch in [("по URL", ids[:listings]), ("по file_id", ids[:listings])]:
+        downloads = app["stats"]["downloads"]
+        timings = []
+        for i, pid in enumerate(batch):
+            started = time.perf_counter()
+            await store.send(bot, 1000 + i, pid, caption="Вилла")
+            timings.append(time.perf_counter() - started)
+        report(name, timings)
+        print(f"   {'':<28} скачиваний: {app['stats']['downloads'] - downloads}")
+
+    # Страница каталога: фото загружаются в служебный чат заранее и параллельно
+    page = ids[listings:listings + 5]
+    started = time.perf_counter()
+    store.prefetch(bot, *page)
+    while store._tasks:
+        await asyncio.gather(*list(store._tasks))
+    print(f"   {'подготовка 5 объектов':<28} {(time.perf_counter() - started) * 1000:.0f} мс")
+    timings = []
+    for pid in page:
+        started = time.perf_counter()
+        await store.send(bot, 1, pid)
+        timings.append(time.perf_counter() - started)
+    report("после подготовки", timings)
+
+    await store.close()
+    await bot.session.close()
+    await runner.cleanup()
+
+
+async def bench_settings(lookups=20000, keys=50):
+    """Чтение настройки на апдейт: запрос к bot_settings против снимка в памяти"""
+    import database
+    from bot_settings import BotSettings
+
+    print(f"⚙️ Настройки: {lookups} чтений, {keys} ключей в bot_settings")
+    path = synthetic_db()
+    now = str(datetime.now(timezone.utc).replace(tzinfo=None))
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO bot_settings (key, value, description, created_at, updated_at) VALUES (?, ?, '', ?, ?)",
+            [(f"text_{i}", f"Текст {i}", now, now) for i in range(keys)],
+        )
+    conn.close()
+
+    db = database.connect(path)
+    settings = BotSettings(await open_database(path), refresh_interval=0.1)
+    await settings.start()
+    lookup_sql = "SELECT value FROM bot_settings WHERE key = ?"
+
+    def read_once(key):
+        conn = database.connect(path)
+        try:
+            return conn.execute(lookup_sql, (key,)).fetchall()
+        finally:
+            conn.close()
+
+    for name, func in [
+        ("запрос к базе", lambda i: db.execute(lookup_sql, (f"text_{i % keys}",)).fetchall()),
+        ("подключение + запрос", lambda i: read_once(f"text_{i % keys}")),
+        ("снимок в памяти", lambda i: settings.text(f"text_{i % keys}", "")),
+    ]:
+        timings = []
+        for i in range(lookups):
+            started = time.perf_counter()
+            func(i)
+            timings.append(time.perf_counter() - started)
+        report(name, timings)
+
+    timings = []
+    for _ in range(200):
+        started = time.perf_counter()
+        await settings.refresh()
+        timings.append(time.perf_counter() - started)
+    report("проверка версии", timings)
+
+    # Правка из админки: сколько ждать, пока бот увидит новое значение
+    changed = asyncio.Event()
+    settings.on_change(lambda keys: changed.set())
+    started = time.perf_counter()
+    with db:
+        db.execute(
+            "UPDATE bot_settings SET value = ?, updated_at = ? WHERE key = ?",
+            ("Новый текст", database.now(), "text_0"),
+        )
+    await changed.wait()
+    print(f"   {'правка видна через':<28} {(time.perf_counter() - started) * 1000:.0f} мс "
+          f"(проверка раз в {settings.refresh_interval * 1000:.0f} мс): {settings.text('text_0', '')!r}")
+
+    await settings.close()
+    db.close()
+
+
+async def bench_visa(lookups=20000):
+    """Виза-ассистент: ответ по таблице против перебора правил (совпадение - tests/test_visa.py)"""
+    import itertools
+    from visa import DEFAULT_RULES, DecisionTable, match_rules
+
+    print(f"🛂 Виза-ассистент: {lookups} ответов")
+    started = time.perf_counter()
+    rules = DecisionTable(DEFAULT_RULES)
+    print(f"   компиляция: {(time.perf_counter() - started) * 1000:.2f} мс, {len(rules.table)} сочетаний")
+
+    options = [[code for code, _ in q.options] for q in rules.questions]
+    combinations = [
+        (region, *answers) for region in rules.regions for answers in itertools.product(*options)
+    ]
+    rng = random.Random(3)
+    queries = [rng.choice(combinations) for _ in range(lookups)]
+    ids = [q.id for q in rules.questions]
+    for name, func in [
+        ("перебор правил", lambda key: match_rules(DEFAULT_RULES["regions"][key[0]], dict(zip(ids, key[1:])))),
+        ("таблица", lambda key: rules.lookup(key[0], dict(zip(ids, key[1:])))),
+    ]:
+        timings = []
+        for key in queries:
+            started = time.perf_counter()
+            func(key)
+            timings.append(time.perf_counter() - started)
+        report(name, timings)
+
+
+async def bench_stats(users=200000, leads=50000, onboarding=2000):
+    """Статистика: GROUP BY по сырым таблицам против сводки stats_daily"""
+    from types import SimpleNamespace
+    from profiles import ProfileWriter
+    from stats import SUMMARY_SQL, Stats, summarize, summary_params
+
+    print(f"📊 Статистика: {users} пользователей, {leads} лидов")
+    path = synthetic_db()
+    rng = random.Random(4)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    stages = ["planning", "searching", "ready"]
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO telegram_users (id, telegram_id, username, first_name, last_name, stage, "
+            "region, is_active, created_at, updated_at) VALUES (?, ?, '', 'Test', '', ?, ?, 1, ?, ?)",
+            [(i, 100000 + i, rng.choice(stages), rng.choice(REGIONS),
+              str(now - timedelta(days=rng.randint(0, 90), seconds=rng.randint(0, 86399))), str(now))
+             for i in range(1, users + 1)],
+        )
+        conn.executemany(
+            "INSERT INTO leads (id, source, message, status, amo_crm_id, amo_crm_url, created_at, "
+            "updated_at, user_id) VALUES (?, 'bot', '', ?, '', '', ?, ?, ?)",
+            [(uuid.uuid4().hex, rng.choice(["new", "in_progress", "won", "lost"]),
+              str(now - timedelta(days=rng.randint(0, 90))), str(now), rng.randint(1, users))
+             for _ in range(leads)],
+        )
+    conn.close()
+
+    setup_django(path)
+    from django.core.management import call_command
+    from admin_panel.management.commands.stats import Command
+    await asyncio.to_thread(call_command, Command(), '--backfill', stdout=open(os.devnull, 'w'))
+
+    # То, что пришлось бы считать на каждое нажатие без сводки
+    week_ago, today, _ = summary_params()
+    raw_queries = [
+        ("SELECT region, stage, COUNT(*), SUM(created_at >= ?), SUM(created_at >= ?) "
+         "FROM telegram_users GROUP BY region, stage", (week_ago, today)),
+        ("SELECT status, COUNT(*), SUM(created_at >= ?) FROM leads GROUP BY status", (week_ago,)),
+    ]
+    db = sqlite3.connect(path)
+    layer = await open_database(path)
+    stats = Stats(layer, ttl=60)
+    for name, func, runs in [
+        ("GROUP BY по таблицам", lambda: [db.execute(sql, params).fetchall() for sql, params in raw_queries], 20),
+        ("сводка stats_daily", lambda: summarize(db.execute(SUMMARY_SQL, summary_params()).fetchall()), 200),
+    ]:
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        report(name, timings)
+    timings = []
+    for _ in range(2000):
+        started = time.perf_counter()
+        await stats.summary()
+        timings.append(time.perf_counter() - started)
+    report("сводка из памяти", timings)
+
+    # Onboarding: половина - новые пользователи, половина меняет регион и стадию
+    writer = ProfileWriter(layer)
+    await writer.start()
+    started = time.perf_counter()
+    for i in range(onboarding):
+        telegram_id = 100000 + rng.randint(1, users) if i % 2 else 900000 + i
+        user = SimpleNamespace(id=telegram_id, username='', first_name='Test', last_name='')
+        writer.add(user, {"stage": rng.choice(stages), "region": rng.choice(REGIONS), "budget": "300k"})
+    await writer.close()
+    print(f"   {'запись профилей':<28} {onboarding} за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    incremental = summarize(await stats._fetch())
+    await asyncio.to_thread(call_command, Command(), '--backfill', stdout=open(os.devnull, 'w'))
+    rebuilt = summarize(await stats._fetch())
+    print(f"   {'сводка после записи':<28} пользователей {incremental['users']}, "
+          f"{'совпадает с пересчетом' if incremental == rebuilt else 'НЕ совпадает с пересчетом'}")
+    db.close()
+    await layer.close()
+
+
+async def bench_leads(requests=5000, users=2000):
+    """Заявки с повторными доставками и двойными нажатиями: ровно один лид на заявку"""
+    from types import SimpleNamespace
+    from amocrm import LeadExporter
+    from leads import LeadCapture
+
+    path = synthetic_db(300)
+    conn = sqlite3.connect(path)
+    properties = [row[0] for row in conn.execute("SELECT id FROM properties")]
+    conn.close()
+
+    # Поток апдейтов: у каждой заявки исходный апдейт, повторные доставки
+    # того же апдейта и нажатия той же кнопки новыми апдейтами
+    rng = random.Random(5)
+    pairs = set()
+    while len(pairs) < requests:
+        pairs.add((rng.randint(1, users), rng.choice(properties)))
+    stream, update_id = [], 0
+    for telegram_id, property_id in pairs:
+        update_id += 1
+        events = [(update_id, telegram_id, property_id)] * (1 + rng.choice([0, 0, 1, 3]))
+        for _ in range(rng.choice([0, 0, 1, 2])):
+            update_id += 1
+            events.append((update_id, telegram_id, property_id))
+        stream.append(events)
+    # Заявки перемешаны, повторы идут после исходного апдейта, но вперемешку с другими
+    events = []
+    for group in stream:
+        position = rng.randint(0, len(events))
+        events[position:position] = group[:1]
+        for event in group[1:]:
+            events.insert(rng.randint(position + 1, len(events)), event)
+    print(f"📨 Лиды: {requests} заявок, {len(events)} апдейтов с дублями")
+
+    def user(telegram_id):
+        return SimpleNamespace(id=telegram_id, username='', first_name=f"User {telegram_id}", last_name='')
+
+    async def replay(captures, events):
+        for capture in captures:
+            await capture.start()
+        started = time.perf_counter()
+        for i, (update_id, telegram_id, property_id) in enumerate(events):
+            # Апдейт попадает в один из процессов; повторная доставка - не обязательно в тот же
+            captures[(update_id + i) % len(captures)].capture(update_id, user(telegram_id), property_id)
+        for capture in captures:
+            await capture.close()
+        return time.perf_counter() - started
+
+    # У каждого "процесса" свои соединения с базой
+    exporter = LeadExporter(await open_database(path), base_url='')
+    await exporter.start()
+    captures = [LeadCapture(await open_database(path), exporter=exporter, batch_size=500) for _ in range(2)]
+    elapsed = await replay(captures, events)
+    print(f"   {'два процесса':<28} {len(events) / elapsed:,.0f} апдейтов/с, "
+          f"создано {sum(c.created for c in captures)}, дублей отсеяно {sum(c.duplicates for c in captures)}")
+
+    # Перезапуск без памяти о недавних заявках: Telegram присылает все заново
+    restarted = LeadCapture(await open_database(path), exporter=exporter, batch_size=500)
+    elapsed = await replay([restarted], events)
+    print(f"   {'повтор после перезапуска':<28} {len(events) / elapsed:,.0f} апдейтов/с, "
+          f"создано {restarted.created}, дублей отсеяно {restarted.duplicates}")
+    await exporter.close()
+
+    conn = sqlite3.connect(path)
+    leads = conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+    distinct = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT DISTINCT l.user_id, l.property_id FROM leads l)"
+    ).fetchone()[0]
+    counted = conn.execute("SELECT COALESCE(SUM(leads), 0) FROM stats_daily").fetchone()[0]
+    queued = conn.execute("SELECT COUNT(*) FROM amocrm_outbox").fetchone()[0]
+    conn.close()
+    print(f"   {'строк в leads':<28} {leads} (заявок {requests}, без отсева было бы {len(events)}), "
+          f"{'ровно по одной на заявку' if leads == distinct == requests else 'ЕСТЬ ДУБЛИ ИЛИ ПОТЕРИ'}")
+    print(f"   {'статистика и очередь AmoCRM':<28} лидов в сводке {counted}, в очереди {queued}")
+
+
+async def bench_admin(properties=200000, users=50000, leads=200000, images=3):
+    """Типовые выборки админки до и после индексов 0004 и массовые действия одним запросом"""
+    print(f"🗂️ Админка: {properties} объектов по {images} фото, {users} пользователей, {leads} лидов")
+    path = synthetic_db(properties)
+    rng = random.Random(6)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    conn = sqlite3.connect(path)
+    property_ids = [row[0] for row in conn.execute("SELECT id FROM properties")]
+    with conn:
+        conn.executemany(
+            'INSERT INTO property_images (image_url, is_primary, "order", created_at, property_id) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(f"https://example.com/{property_id}/{i}.jpg", i == 0, i, str(now), property_id)
+             for property_id in property_ids for i in range(images)],
+        )
+        conn.executemany(
+            "INSERT INTO telegram_users (id, telegram_id, username, first_name, last_name, stage, "
+            "region, is_active, created_at, updated_at) VALUES (?, ?, '', 'Test', '', 'ready', ?, 1, ?, ?)",
+            [(i, 100000 + i, rng.choice(REGIONS), str(now), str(now)) for i in range(1, users + 1)],
+        )
+        conn.executemany(
+            "INSERT INTO leads (id, source, message, status, amo_crm_id, amo_crm_url, created_at, "
+            "updated_at, property_id, user_id) VALUES (?, 'telegram', '', ?, '', '', ?, ?, ?, ?)",
+            [(uuid.uuid4().hex, rng.choice(["new", "in_progress", "won", "lost"]),
+              str(now - timedelta(days=rng.randint(0, 90), seconds=rng.randint(0, 86399))), str(now),
+              rng.choice(property_ids), rng.randint(1, users)) for _ in range(leads)],
+        )
+    conn.execute("ANALYZE")
+
+    # Страница объектов региона по цене, лиды пользователя по дате, фото страницы объектов
+    from images import SELECT_IMAGES_SQL
+    page = rng.sample(property_ids, 25)
+    queries = [
+        ("объекты региона по цене",
+         "SELECT id, title, price FROM properties WHERE region = ? AND is_active = 1 "
+         "ORDER BY price LIMIT 100 OFFSET 1000", lambda: (rng.choice(REGIONS),)),
+        ("лиды пользователя",
+         "SELECT id, status, created_at FROM leads WHERE user_id = ? ORDER BY created_at DESC LIMIT 100",
+         lambda: (rng.randint(1, users),)),
+        ("фото страницы объектов", SELECT_IMAGES_SQL.format(', '.join('?' * len(page))), lambda: page),
+    ]
+
+    def measure(label):
+        print(f"   {label}:")
+        for name, sql, params in queries:
+            plan = " / ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params()))
+            timings = []
+            for _ in range(200):
+                values = params()
+                started = time.perf_counter()
+                conn.execute(sql, values).fetchall()
+                timings.append(time.perf_counter() - started)
+            report(name, timings)
+            print(f"      {plan}")
+
+    measure("без индексов 0004")
+    apply_migration(conn, '0004_admin_indexes')
+    conn.execute("ANALYZE")
+    measure("с индексами 0004")
+    conn.close()
+
+    # Массовые действия (по одному запросу на действие - tests/test_bulk.py)
+    setup_django(path)
+    from django.core.management import call_command
+    from admin_panel.management.commands.bulk import Command
+
+    sqlite3.connect(path).executescript(
+        "INSERT INTO amocrm_outbox (lead_id, attempts, next_attempt_at, last_error, created_at) "
+        "SELECT id, 10, NULL, 'HTTP 400', 0 FROM leads WHERE status = 'lost';"
+    )
+
+    def run(*args):
+        call_command(Command(), *args, stdout=open(os.devnull, 'w'))
+
+    for name, args in [
+        ("boost региона", ["boost", "--region", "bali", "--days", "14"]),
+        ("deactivate источника", ["deactivate", "--source", "partner"]),
+        ("resend --status new", ["resend", "--status", "new"]),
+        ("resend --failed", ["resend", "--failed"]),
+    ]:
+        started = time.perf_counter()
+        await asyncio.to_thread(run, *args)
+        print(f"   {name:<28} {(time.perf_counter() - started) * 1000:6.0f} мс")
+
+
+async def bench_database(rows=100000, operations=20000, concurrency=50, write_share=0.1):
+    """Слой базы: конкурентные чтения и записи (совпадение SQLite и PostgreSQL - tests/test_database.py)"""
+    import database
+
+    print(f"🗄️ База: {operations} запросов ({write_share:.0%} записей), {concurrency} одновременно")
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    engines = [("SQLite (WAL, один писатель)", database.SQLiteDatabase(path))]
+    if os.getenv('DATABASE_URL') or database.DB_ENGINE == 'postgres':
+        engines.append(("PostgreSQL (пул asyncpg)", database.PostgresDatabase(os.getenv('DATABASE_URL'))))
+    else:
+        print("   PostgreSQL пропущен: задайте DATABASE_URL или DB_ENGINE=postgres")
+
+    def naive_query(sql, params):
+        # Соединение на запрос с журналом по умолчанию (как без слоя доступа)
+        conn = sqlite3.connect(naive_path, timeout=30)
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    naive_path = os.path.join(tempfile.mkdtemp(), 'naive.sqlite3')
+    conn = sqlite3.connect(naive_path)
+    with conn:
+        conn.execute("CREATE TABLE bench_rows (id integer PRIMARY KEY, value integer NOT NULL)")
+        conn.executemany("INSERT INTO bench_rows (id, value) VALUES (?, ?)", ((i, i) for i in range(rows)))
+    conn.close()
+
+    async def run(label, read, write):
+        rng = random.Random(7)
+        plan = [rng.random() < write_share for _ in range(operations)]
+        position = 0
+        latencies = []
+
+        async def client():
+            nonlocal position
+            while position < len(plan):
+                is_write = plan[position]
+                position += 1
+                key = rng.randrange(rows)
+                started = time.perf_counter()
+                if is_write:
+                    await write("UPDATE bench_rows SET value = value + 1 WHERE id = ?", (key,))
+                else:
+                    await read("SELECT value FROM bench_rows WHERE id = ?", (key,))
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        print(f"   {label:<28} {operations / elapsed:8,.0f} запросов/с, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс")
+
+    naive = lambda sql, params: asyncio.to_thread(naive_query, sql, params)
+    await run("SQLite без слоя", naive, naive)
+    for name, db in engines:
+        await db.start()
+        await db.execute("DROP TABLE IF EXISTS bench_rows")
+        await db.execute("CREATE TABLE bench_rows (id integer PRIMARY KEY, value integer NOT NULL)")
+        await db.executemany("INSERT INTO bench_rows (id, value) VALUES (?, ?)", [(i, i) for i in range(rows)])
+        await run(name, db.fetchone, db.execute)
+        await db.execute("DROP TABLE bench_rows")
+        await db.close()
+
+
+def worker_app():
+    """Процесс-обработчик для бенчмарка workers: ~1 мс CPU на апдейт, без Telegram"""
+    from aiogram import Bot, Dispatcher
+
+    dp = Dispatcher()
+    log = open(os.environ['BENCH_LOG'], 'a', buffering=1) if os.getenv('BENCH_LOG') else None
+
+    @dp.message()
+    async def handler(message):
+        deadline = time.perf_counter() + 0.001
+        while time.perf_counter() < deadline:
+            pass
+        if log is not None:
+            log.write(f"{message.chat.id} {message.message_id}\n")
+
+    return dp, Bot(token="123456:TEST-TOKEN-FOR-BENCHMARK")
+
+
+async def bench_workers(updates=4000, chats=500):
+    """Многопроцессный режим: апдейтов в секунду от числа процессов-обработчиков"""
+    import signal
+    import workers
+
+    cores = os.cpu_count() or 1
+    print(f"👷 Обработчики: {updates} апдейтов по ~1 мс CPU, {chats} чатов, ядер: {cores}")
+    counts = sorted({1, 2, cores, min(cores, 4)})
+    baseline = None
+    for count in counts:
+        ingestion = workers.Ingestion(workers=count, app='bench:worker_app')
+        await ingestion.start()
+        started = time.perf_counter()
+        for i in range(updates):
+            await ingestion.put(fake_message_update(i, i % chats))
+        await ingestion.join()
+        rate = updates / (time.perf_counter() - started)
+        baseline = baseline or rate
+        await ingestion.close()
+        print(f"   {str(count) + ' обработчик(ов)':<28} {rate:8.0f} апдейтов/с (x{rate / baseline:.2f})")
+    if cores < 2:
+        print("   на одном ядре процессы делят CPU: рост с числом ядер здесь не измерен")
+
+    # Обработчик убит посреди потока: его апдейты уходят другим, порядок в чатах сохраняется
+    log_path = os.path.join(tempfile.mkdtemp(), 'processed.log')
+    ingestion = workers.Ingestion(workers=3, app='bench:worker_app', env={'BENCH_LOG': log_path})
+    await ingestion.start()
+    for i in range(updates):
+        if i == updates // 2:
+            os.kill(ingestion.workers[0].process.pid, signal.SIGKILL)
+        await ingestion.put(fake_message_update(i, i % chats))
+    await ingestion.join()
+    await ingestion.close()
+    processed = {}
+    ordered = True
+    with open(log_path) as f:
+        for line in f:
+            chat_id, update_id = map(int, line.split())
+            seen = processed.setdefault(chat_id, [])
+            if update_id not in seen:
+                ordered = ordered and (not seen or update_id > seen[-1])
+                seen.append(update_id)
+    unique = sum(map(len, processed.values()))
+    print(f"   {'обработчик убит на середине':<28} обработано {unique}/{updates}, "
+          f"передано другим {ingestion.redelivered}, порядок в чатах {'сохранен' if ordered else 'НАРУШЕН'}")
+
+
+BENCHMARKS = {
+    "fsm": bench_fsm,
+    "webhook": bench_webhook,
+    "keyboards": bench_keyboards,
+    "callbacks": bench_callbacks,
+    "catalog": bench_catalog,
+    "matching": bench_matching,
+    "boosts": bench_boosts,
+    "search": bench_search,
+    "pricing": bench_pricing,
+    "feed": bench_feed,
+    "amocrm": bench_amocrm,
+    "throttle": bench_throttle,
+    "sender": bench_sender,
+    "campaign": bench_campaign,
+    "images": bench_images,
+    "settings": bench_settings,
+    "visa": bench_visa,
+    "stats": bench_stats,
+    "leads": bench_leads,
+    "admin": bench_admin,
+    "database": bench_database,
+    "workers": bench_workers,
+}
+
+
+def main():
+    """Запуск выбранных бенчмарков"""
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ Неизвестный бенчмарк: {name} (доступны: {', '.join(BENCHMARKS)})")
+            return False
+        asyncio.run(BENCHMARKS[name]())
+        print()
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Настройки бота из таблицы bot_settings (тексты, регионы, переключатели)
+Таблица целиком загружается в неизменяемый снимок в памяти, обработчики
+читают его без обращения к базе. Изменения из админки подхватываются дешевой
+проверкой версии (COUNT и MAX(updated_at)) раз в refresh_interval или сразу
+по сообщению в Redis (SETTINGS_NOTIFY=redis), после чего снимок заменяется
+целиком одним присваиванием.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import namedtuple
+from types import MappingProxyType
+
+from fsm_storage import get_redis_url
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять, изменились ли настройки (секунды)
+SETTINGS_REFRESH = float(os.getenv('SETTINGS_REFRESH', 10))
+# Уведомления об изменениях: none (только проверка версии) или redis
+SETTINGS_NOTIFY = os.getenv('SETTINGS_NOTIFY', 'none')
+# Канал Redis, в который админка публикует ключ измененной настройки
+SETTINGS_CHANNEL = 'bot_settings'
+
+# Снимок настроек: значения (только чтение) и версия таблицы, из которой он собран
+Snapshot = namedtuple('Snapshot', ['values', 'version'])
+
+EMPTY = Snapshot(MappingProxyType({}), None)
+
+
+def parse_value(value):
+    """Значение настройки: JSON, если разбирается, иначе строка как есть"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def publish_change(key=None):
+    """Уведомление ботов об изменении настройки (вызывается из админки)"""
+    if SETTINGS_NOTIFY != 'redis':
+        return
+    import redis
+
+    client = redis.Redis.from_url(get_redis_url())
+    try:
+        client.publish(SETTINGS_CHANNEL, key or '')
+    finally:
+        client.close()
+
+
+class BotSettings:
+    """
+    Снимок bot_settings в памяти
+
+    Снимок не меняется на месте: при изменениях собирается новый и
+    подменяет старый, поэтому обработчик всегда видит согласованные
+    настройки. Подписчики on_change получают множество изменившихся ключей.
+    db - слой database; общему снимку settings его задает create_dispatcher.
+    """
+
+    def __init__(self, db=None, refresh_interval=SETTINGS_REFRESH, notify=SETTINGS_NOTIFY):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.notify = notify
+        self.snapshot = EMPTY
+        self._listeners = []
+        self._lock = asyncio.Lock()
+        self._tasks = []
+
+    # Чтение (без обращения к базе)
+
+    def get(self, key, default=None):
+        return self.snapshot.values.get(key, default)
+
+    def text(self, key, default):
+        """Текст сообщения: из настроек, если задан, иначе текст по умолчанию"""
+        value = self.snapshot.values.get(key)
+        return default if value is None or value == '' else str(value)
+
+    def enabled(self, key, default=False):
+        """Переключатель функции ("1", true, "on" и т.п.)"""
+        value = self.snapshot.values.get(key)
+        if value is None:
+            return default
+        if isinstance(value, str):
+            return value.strip().lower() in ('1', 'true', 'yes', 'on')
+        return bool(value)
+
+    def on_change(self, callback):
+        """Подписка на изменения: callback(множество измененных ключей)"""
+        self._listeners.append(callback)
+
+    # Загрузка
+
+    async def _fetch(self, version):
+        """(версия, строки) или (версия, None), если таблица не менялась"""
+        current = tuple(await self.db.fetchone("SELECT COUNT(*), MAX(updated_at) FROM bot_settings"))
+        if current == version:
+            return current, None
+        return current, await self.db.fetch("SELECT key, value FROM bot_settings")
+
+    def apply(self, version, rows):
+        """Замена снимка; возвращает измененные ключи"""
+        values = {key: parse_value(value) for key, value in rows}
+        old = self.snapshot.values
+        changed = {key for key in old.keys() | values.keys() if old.get(key) != values.get(key)}
+        self.snapshot = Snapshot(MappingProxyType(values), version)
+        if changed:
+            for callback in self._listeners:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    logger.error(f"Ошибка обработчика изменения настроек: {e}")
+        return changed
+
+    async def refresh(self):
+        """Проверка версии и перезагрузка снимка, если таблица изменилась"""
+        async with self._lock:
+            version, rows = await self._fetch(self.snapshot.version)
+            if rows is None:
+                return set()
+            changed = self.apply(version, rows)
+        if changed:
+            logger.info(f"Настройки обновлены: {', '.join(sorted(changed))}")
+        return changed
+
+    async def _safe_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Ошибка обновления настроек: {e}")
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self._safe_refresh()
+
+    async def _listen(self):
+        """Перезагрузка по сообщениям админки в Redis (с переподключением)"""
+        from redis import asyncio as aioredis
+
+        while True:
+            redis = aioredis.from_url(get_redis_url())
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(SETTINGS_CHANNEL)
+                # Пока не было подписки, изменения могли пройти мимо
+                await self._safe_refresh()
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        await self._safe_refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Подписка на изменения настроек прервана: {e}")
+            finally:
+                await pubsub.aclose()
+                await redis.aclose()
+            await asyncio.sleep(self.refresh_interval)
+
+    async def start(self):
+        """Загрузка снимка и запуск отслеживания изменений"""
+        await self._safe_refresh()
+        self._tasks.append(asyncio.create_task(self._refresh_periodically()))
+        if self.notify == 'redis':
+            self._tasks.append(asyncio.create_task(self._listen()))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+# Общий снимок для всего процесса бота (клавиатуры, тексты, обработчики)
+settings = BotSettings()
@@ -8,6 +8,7 @@ import asyncio
 import logging
 import os
 import sys
+import time
 from pathlib import Path
 
 # Загружаем переменные окружения из .env файла
@@ -22,12 +23,29 @@ except ImportError:
 except Exception as e:
     print(f"⚠️ Ошибка загрузки .env: {e}")
 
-from aiogram import Bot, Dispatcher, types
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from amocrm import LeadExporter
+from bot_settings import settings
+from callbacks import CallbackRouter, pack
+from catalog import RED_EXPERTS_SOURCE, Catalog, decode_cursor, encode_cursor, min_bedrooms_for
+from database import create_database, missing_tables
+from fsm_storage import create_storage
+from images import ImageStore
+from keyboards import build_pager, load_regions, region_codes, registry as keyboards
+from leads import LeadCapture
+from matching import Matcher
+from profiles import BUDGET_RANGES, FAMILY_MEMBERS, ProfileWriter
+from sender import BOT_SEND_RATE, SendScheduler, create_budget
+from stats import Stats
+from throttling import ThrottlingMiddleware, create_limiter
+from visa import VisaQuiz
+from webhook import run_webhook
 
 # Настройка логирования
 logging.basicConfig(
@@ -45,6 +63,44 @@ if not BOT_TOKEN:
 
 logger.info(f"✅ BOT_TOKEN загружен: {BOT_TOKEN[:10]}...")
 
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+BOT_WEBHOOK_URL = os.getenv('BOT_WEBHOOK_URL')
+if BOT_MODE == "webhook" and not BOT_WEBHOOK_URL:
+    logger.error("BOT_MODE=webhook требует BOT_WEBHOOK_URL")
+    sys.exit(1)
+
+# Объектов на одной странице каталога
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 5))
+
+# Тексты по умолчанию; в bot_settings их можно заменить ключом text_<название>
+TEXTS = {
+    "welcome": (
+        "🏠 Добро пожаловать в ReloCompass!\n\n"
+        "Я помогу вам найти идеальную недвижимость для переезда.\n\n"
+        "Давайте начнем с небольшого опроса:"
+    ),
+    "help": (
+        "❓ Помощь\n\n"
+        "🤖 ReloCompass - бот для генерации лидов в сфере недвижимости\n\n"
+        "📱 Основные команды:\n"
+        "/start - Начать работу с ботом\n"
+        "/menu - Главное меню\n"
+        "/help - Эта справка\n\n"
+        "🔎 Или просто напишите, что ищете, например:\n"
+        "«2 bedroom Canggu with good internet»\n\n"
+        "Вернуться в главное меню:"
+    ),
+    "menu": (
+        "🏠 Главное меню\n\n"
+        "Выберите нужную функцию:"
+    ),
+}
+
+def get_text(name):
+    """Текст сообщения с учетом настроек (без обращения к базе)"""
+    return settings.text(f"text_{name}", TEXTS[name])
+
 # Состояния для FSM
 class UserStates(StatesGroup):
     waiting_for_stage = State()
@@ -52,69 +108,39 @@ class UserStates(StatesGroup):
     waiting_for_budget = State()
     waiting_for_region = State()
 
-# Клавиатуры
+# Клавиатуры (собираются один раз, см. keyboards.py)
 def get_main_menu():
     """Главное меню"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏠 Каталог недвижимости", callback_data="catalog")],
-        [InlineKeyboardButton(text="🛂 Виза-ассистент", callback_data="visa")],
-        [InlineKeyboardButton(text="📊 Статистика", callback_data="stats")],
-        [InlineKeyboardButton(text="❓ Помощь", callback_data="help")]
-    ])
-    return keyboard
+    return keyboards.get("main_menu")
 
 def get_stage_keyboard():
     """Клавиатура выбора стадии"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🤔 Планирую переезд", callback_data="stage_planning")],
-        [InlineKeyboardButton(text="🔍 Ищу недвижимость", callback_data="stage_searching")],
-        [InlineKeyboardButton(text="💰 Готов к покупке", callback_data="stage_ready")]
-    ])
-    return keyboard
+    return keyboards.get("stage")
 
 def get_family_keyboard():
     """Клавиатура выбора размера семьи"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="👤 Один", callback_data="family_1")],
-        [InlineKeyboardButton(text="👥 2-3 человека", callback_data="family_2_3")],
-        [InlineKeyboardButton(text="👨‍👩‍👧‍👦 4+ человека", callback_data="family_4_plus")]
-    ])
-    return keyboard
+    return keyboards.get("family")
 
 def get_budget_keyboard():
     """Клавиатура выбора бюджета"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💵 До $100K", callback_data="budget_100k")],
-        [InlineKeyboardButton(text="💰 $100K - $300K", callback_data="budget_300k")],
-        [InlineKeyboardButton(text="💎 $300K+", callback_data="budget_300k_plus")]
-    ])
-    return keyboard
+    return keyboards.get("budget")
 
 def get_region_keyboard():
     """Клавиатура выбора региона"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏝️ Пхукет", callback_data="region_phuket")],
-        [InlineKeyboardButton(text="🌴 Бали", callback_data="region_bali")],
-        [InlineKeyboardButton(text="🏔️ Грузия", callback_data="region_georgia")],
-        [InlineKeyboardButton(text="🏛️ Турция", callback_data="region_turkey")],
-        [InlineKeyboardButton(text="🏖️ Кипр", callback_data="region_cyprus")]
-    ])
-    return keyboard
+    return keyboards.get("region")
 
 # Обработчики команд
 async def start_command(message: types.Message, state: FSMContext):
     """Обработчик команды /start"""
     await message.answer(
-        "🏠 Добро пожаловать в ReloCompass!\n\n"
-        "Я помогу вам найти идеальную недвижимость для переезда.\n\n"
-        "Давайте начнем с небольшого опроса:",
+        get_text("welcome"),
         reply_markup=get_stage_keyboard()
     )
     await state.set_state(UserStates.waiting_for_stage)
 
-async def handle_stage_selection(callback: types.CallbackQuery, state: FSMContext):
+async def handle_stage_selection(callback: types.CallbackQuery, state: FSMContext, args: list):
     """Обработка выбора стадии"""
-    stage = callback.data.replace("stage_", "")
+    stage = args[0]
     await state.update_data(stage=stage)
     
     await callback.message.edit_text(
@@ -123,9 +149,9 @@ async def handle_stage_selection(callback: types.CallbackQuery, state: FSMContex
     )
     await state.set_state(UserStates.waiting_for_family)
 
-async def handle_family_selection(callback: types.CallbackQuery, state: FSMContext):
+async def handle_family_selection(callback: types.CallbackQuery, state: FSMContext, args: list):
     """Обработка выбора размера семьи"""
-    family = callback.data.replace("family_", "")
+    family = args[0]
     await state.update_data(family=family)
     
     await callback.message.edit_text(
@@ -134,9 +160,9 @@ async def handle_family_selection(callback: types.CallbackQuery, state: FSMConte
     )
     await state.set_state(UserStates.waiting_for_budget)
 
-async def handle_budget_selection(callback: types.CallbackQuery, state: FSMContext):
+async def handle_budget_selection(callback: types.CallbackQuery, state: FSMContext, args: list):
     """Обработка выбора бюджета"""
-    budget = callback.data.replace("budget_", "")
+    budget = args[0]
     await state.update_data(budget=budget)
     
     await callback.message.edit_text(
@@ -145,81 +171,293 @@ async def handle_budget_selection(callback: types.CallbackQuery, state: FSMConte
     )
     await state.set_state(UserStates.waiting_for_region)
 
-async def handle_region_selection(callback: types.CallbackQuery, state: FSMContext):
+async def handle_region_selection(callback: types.CallbackQuery, state: FSMContext, args: list,
+                                  profile_writer: ProfileWriter, matcher: Matcher):
     """Обработка выбора региона"""
-    region = callback.data.replace("region_", "")
+    region = args[0]
     await state.update_data(region=region)
     
     # Получаем все данные
     user_data = await state.get_data()
     
+    # Первые рекомендации по ответам onboarding (запомнены для этого сочетания)
+    recommendations = matcher.recommend(
+        region,
+        budget=BUDGET_RANGES.get(user_data.get('budget')),
+        family_members=FAMILY_MEMBERS.get(user_data.get('family')),
+        stage=user_data.get('stage'),
+    )
+    recommended = ""
+    if recommendations:
+        recommended = "🏠 Вам могут подойти:\n\n" + "\n\n".join(
+            format_listing(listing) for listing, _ in recommendations
+        ) + "\n\n"
+    
     await callback.message.edit_text(
         f"🎉 Отлично! Ваш профиль создан:\n\n"
         f"📋 Стадия: {user_data.get('stage', 'Не указано')}\n"
         f"👥 Семья: {user_data.get('family', 'Не указано')}\n"
         f"💰 Бюджет: {user_data.get('budget', 'Не указано')}\n"
         f"🌍 Регион: {user_data.get('region', 'Не указано')}\n\n"
+        f"{recommended}"
         f"Теперь вы можете использовать все функции бота!",
         reply_markup=get_main_menu()
     )
     
-    # Сбрасываем состояние
-    await state.clear()
+    # Сбрасываем состояние, ответы остаются профилем для каталога
+    await state.set_state(None)
     
-    # Логируем создание пользователя
+    # Сохраняем профиль (запись в базу идет пачками в фоне)
+    profile_writer.add(callback.from_user, user_data)
     logger.info(f"User {callback.from_user.id} completed onboarding: {user_data}")
 
-async def handle_catalog(callback: types.CallbackQuery):
+def format_listing(listing):
+    """Строка объекта в выдаче каталога"""
+    if listing.source == RED_EXPERTS_SOURCE:
+        badge = "⭐ "
+    elif listing.boost_expiry > time.time():
+        badge = "🚀 "
+    else:
+        badge = ""
+    bedrooms = f", спален: {listing.bedrooms}" if listing.bedrooms is not None else ""
+    usd = ""
+    if listing.currency != "USD" and listing.price_usd is not None:
+        usd = f" (≈ {listing.price_usd:,.0f} USD)"
+    return (
+        f"{badge}{listing.title}\n"
+        f"📍 {listing.city} · 💰 {listing.price:,.0f} {listing.currency}{usd}{bedrooms}"
+    )
+
+async def show_catalog_page(callback: types.CallbackQuery, state: FSMContext, catalog: Catalog,
+                            images: ImageStore, cursor=None, backward=False):
+    """Страница каталога по профилю пользователя"""
+    profile = await state.get_data()
+    if not profile.get('region'):
+        await callback.message.edit_text(
+            "🏠 Каталог недвижимости\n\n"
+            "Чтобы подобрать объекты, пройдите короткий опрос: /start\n\n"
+            "Вернуться в главное меню:",
+            reply_markup=get_main_menu()
+        )
+        return
+    
+    # Сначала RED Experts, затем буст-объекты, затем остальные
+    query = dict(
+        region=profile['region'],
+        budget=BUDGET_RANGES.get(profile.get('budget')),
+        min_bedrooms=min_bedrooms_for(FAMILY_MEMBERS.get(profile.get('family'))),
+        limit=CATALOG_PAGE_SIZE,
+    )
+    listings, cursors, has_more = catalog.page(cursor=cursor, backward=backward, **query)
+    if not listings:
+        await callback.message.edit_text(
+            "🏠 Каталог недвижимости\n\n"
+            "Подходящих объектов пока нет, загляните позже.\n\n"
+            "Вернуться в главное меню:",
+            reply_markup=get_main_menu()
+        )
+        return
+    
+    # Назад можно, если мы не на первой странице; вперед - если есть еще объекты
+    has_prev = has_more if backward else cursor is not None
+    has_next = cursor is not None if backward else has_more
+    prev_data = pack("page", "p", encode_cursor(cursors[0])) if has_prev else None
+    next_data = pack("page", "n", encode_cursor(cursors[-1])) if has_next else None
+    
+    text = "\n\n".join(f"{i}. {format_listing(listing)}" for i, listing in enumerate(listings, 1))
+    in_budget = catalog.count(query['region'], query['budget'])
+    await callback.message.edit_text(
+        f"🏠 Каталог недвижимости (в вашем бюджете: {in_budget})\n\n{text}",
+        reply_markup=build_pager(
+            prev_data, next_data,
+            photos=[pack("photos", listing.id) for listing in listings],
+            contacts=[pack("lead", listing.id) for listing in listings],
+        )
+    )
+    
+    # Фото объектов страницы готовим заранее, пока пользователь читает описание
+    images.prefetch(callback.bot, *(listing.id for listing in listings))
+    
+    # Пока пользователь читает страницу, готовим следующую
+    if has_next:
+        catalog.prefetch(cursor=cursors[-1], **query)
+
+async def handle_catalog(callback: types.CallbackQuery, state: FSMContext, catalog: Catalog,
+                         images: ImageStore):
     """Обработка каталога недвижимости"""
+    await show_catalog_page(callback, state, catalog, images)
+
+async def handle_catalog_page(callback: types.CallbackQuery, state: FSMContext, catalog: Catalog,
+                              images: ImageStore, args: list):
+    """Листание каталога"""
+    direction, cursor = args
+    await show_catalog_page(
+        callback, state, catalog, images,
+        cursor=decode_cursor(cursor), backward=direction == "p"
+    )
+
+async def handle_text_search(message: types.Message, state: FSMContext, catalog: Catalog,
+                             images: ImageStore):
+    """Поиск объектов по тексту сообщения (сначала в регионе из профиля)"""
+    region = (await state.get_data()).get('region')
+    listings, total = catalog.find(message.text, region=region, limit=CATALOG_PAGE_SIZE)
+    if not listings:
+        await message.answer(
+            "🔎 Ничего не нашлось\n\n"
+            "Попробуйте иначе: город, число спален, удобства, например\n"
+            "«2 bedroom Canggu with good internet» или «3 спальни с мебелью»",
+            reply_markup=get_main_menu()
+        )
+        return
+    
+    text = "\n\n".join(f"{i}. {format_listing(listing)}" for i, listing in enumerate(listings, 1))
+    await message.answer(
+        f"🔎 Найдено: {total}\n\n{text}",
+        reply_markup=build_pager(
+            photos=[pack("photos", listing.id) for listing in listings],
+            contacts=[pack("lead", listing.id) for listing in listings],
+        )
+    )
+    images.prefetch(message.bot, *(listing.id for listing in listings))
+
+async def handle_photos(callback: types.CallbackQuery, catalog: Catalog, images: ImageStore,
+                        args: list):
+    """Фото объекта альбомом"""
+    listing = catalog.listings.get(args[0])
+    if listing is None:
+        await callback.answer("Объект больше не доступен", show_alert=True)
+        return
+    try:
+        sent = await images.send(callback.bot, callback.message.chat.id, listing.id, caption=listing.title)
+    except Exception as e:
+        # Кнопка не должна "крутиться" до таймаута, даже если отправка не удалась
+        logger.warning(f"Не удалось отправить фото объекта {listing.id}: {e}")
+        await callback.answer("Не удалось отправить фото, попробуйте позже", show_alert=True)
+        return
+    await callback.answer(None if sent else "Фото пока нет")
+
+async def handle_contact(callback: types.CallbackQuery, catalog: Catalog, lead_capture: LeadCapture,
+                         event_update: types.Update, args: list):
+    """Заявка риелтору по объекту (повторное нажатие или доставка апдейта не создает лид)"""
+    listing = catalog.listings.get(args[0])
+    if listing is None:
+        await callback.answer("Объект больше не доступен", show_alert=True)
+        return
+    _, created = lead_capture.capture(event_update.update_id, callback.from_user, listing.id)
+    await callback.answer(
+        f"✅ Заявка по объекту «{listing.title}» отправлена, риелтор свяжется с вами"
+        if created else "Заявка по этому объекту уже отправлена, риелтор свяжется с вами",
+        show_alert=True
+    )
+
+async def ask_visa_question(callback: types.CallbackQuery, rules, progress):
+    """Следующий вопрос виза-ассистента (или выбор региона, если его нет в профиле)"""
+    if progress["region"] is None:
+        await callback.message.edit_text(
+            "🛂 Виза-ассистент\n\n"
+            "Для какой страны подобрать визу?",
+            reply_markup=rules.region_keyboard()
+        )
+        return
+    question = rules.next_question(progress["answers"])
+    step = len(progress["answers"]) + 1
     await callback.message.edit_text(
-        "🏠 Каталог недвижимости\n\n"
-        "В разработке...\n\n"
-        "Здесь будет отображаться каталог недвижимости с приоритетом:\n"
-        "1. RED Experts (собственные объекты)\n"
-        "2. Буст-объекты\n"
-        "3. Остальные объекты\n\n"
-        "Вернуться в главное меню:",
-        reply_markup=get_main_menu()
+        f"🛂 Виза-ассистент ({step}/{len(rules.questions)})\n\n{question.text}",
+        reply_markup=rules.keyboard(question)
     )
 
-async def handle_visa(callback: types.CallbackQuery):
-    """Обработка виза-ассистента"""
+async def handle_visa(callback: types.CallbackQuery, state: FSMContext, visa_quiz: VisaQuiz):
+    """Обработка виза-ассистента: начало квиза"""
+    rules = visa_quiz.rules
+    region = (await state.get_data()).get('region')
+    # Прогресс квиза хранится в FSM вместе с версией правил, по которой он начат
+    progress = {
+        "version": rules.version,
+        "region": region if region in rules.regions else None,
+        "answers": {},
+    }
+    await state.update_data(visa=progress)
+    await ask_visa_question(callback, rules, progress)
+
+async def handle_visa_answer(callback: types.CallbackQuery, state: FSMContext, visa_quiz: VisaQuiz,
+                             args: list):
+    """Ответ на вопрос виза-ассистента"""
+    question_id, answer = args
+    rules = visa_quiz.rules
+    progress = (await state.get_data()).get('visa')
+    if not progress or progress["version"] != rules.version:
+        # Квиз начат по прежней версии правил (или уже завершен): начинаем заново
+        await callback.answer("Начнем квиз сначала")
+        await handle_visa(callback, state, visa_quiz)
+        return
+    
+    if question_id == "region":
+        if progress["region"] is not None or answer not in rules.regions:
+            await callback.answer()
+            return
+        progress["region"] = answer
+    else:
+        expected = rules.next_question(progress["answers"])
+        if (progress["region"] is None or expected is None or expected.id != question_id
+                or answer not in dict(expected.options)):
+            # Кнопка из уже пройденного вопроса
+            await callback.answer()
+            return
+        progress["answers"][question_id] = answer
+    
+    # Ответ на квиз - один поиск в скомпилированной таблице правил
+    verdict = rules.lookup(progress["region"], progress["answers"])
+    if verdict is None:
+        await state.update_data(visa=progress)
+        await ask_visa_question(callback, rules, progress)
+        return
+    await state.update_data(visa=None)
     await callback.message.edit_text(
-        "🛂 Виза-ассистент\n\n"
-        "В разработке...\n\n"
-        "Здесь будет 3-вопросный квиз для определения подходящего типа визы.\n\n"
+        f"🛂 Рекомендуемая виза: {verdict.title}\n\n"
+        f"{verdict.details}\n\n"
+        "Условия меняются, актуальные требования уточняйте у консульства.\n\n"
         "Вернуться в главное меню:",
         reply_markup=get_main_menu()
     )
 
-async def handle_stats(callback: types.CallbackQuery):
-    """Обработка статистики"""
+STAGE_TITLES = {
+    "planning": "🤔 Планируют переезд",
+    "searching": "🔍 Ищут недвижимость",
+    "ready": "💰 Готовы к покупке",
+}
+
+async def handle_stats(callback: types.CallbackQuery, stats: Stats):
+    """Обработка статистики (из сводки, обновляется раз в STATS_TTL секунд)"""
+    summary = await stats.summary()
+    regions = dict(load_regions())
+    lines = [
+        "📊 Статистика\n",
+        f"👥 Пользователей: {summary['users']} "
+        f"(сегодня +{summary['users_today']}, за неделю +{summary['users_week']})",
+    ]
+    for region, count in sorted(summary['regions'].items(), key=lambda item: -item[1]):
+        lines.append(f"   {regions.get(region, region)}: {count}")
+    for stage, count in sorted(summary['stages'].items(), key=lambda item: -item[1]):
+        lines.append(f"   {STAGE_TITLES.get(stage, stage)}: {count}")
+    lines.append(f"\n📨 Лидов: {summary['leads']} (за неделю +{summary['leads_week']})")
+    for status, count in sorted(summary['lead_statuses'].items(), key=lambda item: -item[1]):
+        lines.append(f"   {status}: {count}")
     await callback.message.edit_text(
-        "📊 Статистика\n\n"
-        "В разработке...\n\n"
-        "Здесь будет отображаться статистика пользователей и лидов.\n\n"
-        "Вернуться в главное меню:",
+        "\n".join(lines) + "\n\nВернуться в главное меню:",
         reply_markup=get_main_menu()
     )
 
 async def handle_help(callback: types.CallbackQuery):
     """Обработка помощи"""
     await callback.message.edit_text(
-        "❓ Помощь\n\n"
-        "🤖 ReloCompass - бот для генерации лидов в сфере недвижимости\n\n"
-        "📱 Основные команды:\n"
-        "/start - Начать работу с ботом\n"
-        "/menu - Главное меню\n"
-        "/help - Эта справка\n\n"
-        "Вернуться в главное меню:",
+        get_text("help"),
         reply_markup=get_main_menu()
     )
 
 async def handle_menu(callback: types.CallbackQuery):
     """Обработка главного меню"""
     await callback.message.edit_text(
-        "🏠 Главное меню\n\n"
-        "Выберите нужную функцию:",
+        get_text("menu"),
         reply_markup=get_main_menu()
     )
 
@@ -227,32 +465,154 @@ async def handle_unknown(callback: types.CallbackQuery):
     """Обработка неизвестных callback'ов"""
     await callback.answer("Неизвестная команда", show_alert=True)
 
+async def notify_ready(bot: Bot):
+    """Сигнал супервизору (run_mvp.py), что бот запущен и токен рабочий"""
+    fd = os.getenv('READY_FD')
+    if not fd:
+        return
+    me = await bot.get_me()
+    try:
+        os.write(int(fd), f"@{me.username}\n".encode())
+        os.close(int(fd))
+    except OSError as e:
+        logger.warning(f"Не удалось сообщить о готовности: {e}")
+
 # Основная функция
-async def main():
-    """Основная функция запуска бота"""
-    logger.info("Запуск упрощенной версии бота...")
+def create_dispatcher(export_leads=True):
+    """Создание диспетчера с обработчиками (export_leads=False - лиды в AmoCRM выгружает другой процесс)"""
+    # Общий слой доступа к базе (SQLite или PostgreSQL по DB_ENGINE)
+    db = create_database()
     
-    # Инициализация бота и диспетчера
-    bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
+    # Хранилище FSM выбирается переменной FSM_STORAGE (таблица в базе бота по умолчанию)
+    storage = create_storage(db=db)
+    logger.info(f"FSM-хранилище: {type(storage).__name__}")
     dp = Dispatcher(storage=storage)
+    dp["db"] = db
+    dp.startup.register(db.start)
+    
+    # Ограничение частоты апдейтов и повторных нажатий от одного пользователя
+    throttling = ThrottlingMiddleware(create_limiter())
+    dp.update.outer_middleware(throttling)
+    dp.startup.register(throttling.start)
+    dp.shutdown.register(throttling.close)
+    
+    # Профили пользователей пишутся в telegram_users пачками
+    profile_writer = ProfileWriter(db)
+    dp["profile_writer"] = profile_writer
+    dp.startup.register(profile_writer.start)
+    dp.shutdown.register(profile_writer.close)
+    
+    # Настройки из bot_settings в памяти; клавиатуры собираются уже по ним
+    settings.db = db
+    dp["settings"] = settings
+    dp.startup.register(settings.start)
+    dp.shutdown.register(settings.close)
+    dp.startup.register(keyboards.warm)
+    
+    # Каталог недвижимости в памяти, обновляется по updated_at
+    catalog = Catalog(db)
+    dp["catalog"] = catalog
+    dp.startup.register(catalog.start)
+    dp.shutdown.register(catalog.close)
+    dp["matcher"] = Matcher(catalog)
+    
+    # Фото объектов отправляются по сохраненным file_id
+    images = ImageStore(db)
+    dp["images"] = images
+    dp.shutdown.register(images.close)
+    
+    # Лиды выгружаются в AmoCRM в фоне через очередь в базе
+    lead_exporter = LeadExporter(db, export=export_leads)
+    dp["lead_exporter"] = lead_exporter
+    
+    # Заявки пишутся пачками без дублей; останавливается раньше выгрузки,
+    # чтобы последние лиды попали в ее очередь
+    lead_capture = LeadCapture(db, exporter=lead_exporter, profiles=profile_writer)
+    dp["lead_capture"] = lead_capture
+    dp.startup.register(lead_capture.start)
+    dp.shutdown.register(lead_capture.close)
+    dp.startup.register(lead_exporter.start)
+    dp.shutdown.register(lead_exporter.close)
+    
+    # Статистика читается из сводки stats_daily
+    dp["stats"] = Stats(db)
+    
+    # Правила виза-ассистента (перезагружаются из bot_settings)
+    dp["visa_quiz"] = VisaQuiz(settings)
+    
+    # База закрывается после всех, кто в нее пишет
+    dp.shutdown.register(db.close)
     
     # Регистрация обработчиков
     dp.message.register(start_command, Command("start"))
-    dp.callback_query.register(handle_stage_selection, lambda c: c.data.startswith("stage_"))
-    dp.callback_query.register(handle_family_selection, lambda c: c.data.startswith("family_"))
-    dp.callback_query.register(handle_budget_selection, lambda c: c.data.startswith("budget_"))
-    dp.callback_query.register(handle_region_selection, lambda c: c.data.startswith("region_"))
-    dp.callback_query.register(handle_catalog, lambda c: c.data == "catalog")
-    dp.callback_query.register(handle_visa, lambda c: c.data == "visa")
-    dp.callback_query.register(handle_stats, lambda c: c.data == "stats")
-    dp.callback_query.register(handle_help, lambda c: c.data == "help")
-    dp.callback_query.register(handle_menu, lambda c: c.data == "menu")
-    dp.callback_query.register(handle_unknown)
+    # Остальной текст (не команды) - поиск по каталогу
+    dp.message.register(handle_text_search, F.text, ~F.text.startswith("/"))
+    
+    # Все callback'и разбираются одним роутером по префиксу callback_data
+    callbacks = CallbackRouter(unknown=handle_unknown)
+    callbacks.register("stage", handle_stage_selection, arity=1, choices=["planning", "searching", "ready"])
+    callbacks.register("family", handle_family_selection, arity=1, choices=FAMILY_MEMBERS)
+    callbacks.register("budget", handle_budget_selection, arity=1, choices=BUDGET_RANGES)
+    # Регионы меняются в bot_settings без перезапуска: список проверяется на каждом нажатии
+    callbacks.register("region", handle_region_selection, arity=1, choices=region_codes)
+    callbacks.register("catalog", handle_catalog)
+    callbacks.register("page", handle_catalog_page, arity=2, choices=["n", "p"])
+    callbacks.register("photos", handle_photos, arity=1)
+    callbacks.register("lead", handle_contact, arity=1)
+    callbacks.register("visa", handle_visa)
+    callbacks.register("quiz", handle_visa_answer, arity=2)
+    callbacks.register("stats", handle_stats)
+    callbacks.register("help", handle_help)
+    callbacks.register("menu", handle_menu)
+    dp.callback_query.register(callbacks.dispatch)
+    return dp
+
+def create_bot(dp, send_rate=None):
+    """Бот, все исходящие сообщения которого идут через очередь с лимитами Telegram"""
+    # Свой сервер Bot API (или фейковый для проверок), если задан TELEGRAM_API_URL
+    api_url = os.getenv('TELEGRAM_API_URL')
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+    bot = Bot(token=BOT_TOKEN, session=session)
+    
+    # Лимит бота из SEND_RATE: остаток после доли рассылок или общее ведро в Redis (SEND_BUDGET)
+    scheduler = SendScheduler(
+        rate=BOT_SEND_RATE if send_rate is None else send_rate, budget=create_budget(),
+    )
+    bot.session.middleware(scheduler)
+    dp["send_scheduler"] = scheduler
+    dp.startup.register(scheduler.start)
+    dp.shutdown.register(scheduler.close)
+    return bot
+
+async def check_schema():
+    """Выход с ошибкой, если в базе нет таблиц бота (не выполнен manage.py migrate)"""
+    db = create_database()
+    await db.start()
+    try:
+        missing = await missing_tables(db)
+    finally:
+        await db.close()
+    if missing:
+        logger.error(f"В базе нет таблиц {', '.join(missing)}: выполните python manage.py migrate")
+        sys.exit(1)
+
+async def main():
+    """Основная функция запуска бота"""
+    logger.info("Запуск упрощенной версии бота...")
+    await check_schema()
+    
+    # Инициализация бота и диспетчера
+    dp = create_dispatcher()
+    bot = create_bot(dp)
+    dp.startup.register(notify_ready)
     
     # Запуск бота
-    logger.info("Бот запущен в режиме polling...")
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        logger.info(f"Бот запущен в режиме webhook: {BOT_WEBHOOK_URL}")
+        await run_webhook(dp, bot, BOT_WEBHOOK_URL)
+    else:
+        logger.info("Бот запущен в режиме polling...")
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Маршрутизация callback_data бота ReloCompass
+Формат callback_data: "префикс:аргумент:аргумент" (например, "region:phuket").
+Обработчик находится одним поиском по словарю вместо перебора фильтров.
+"""
+
+import inspect
+import logging
+
+from aiogram import types
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ":"
+# Ограничение Telegram на размер callback_data
+MAX_CALLBACK_DATA = 64
+
+
+def pack(prefix, *args):
+    """Сборка callback_data из префикса и аргументов (ValueError, если их не разобрать обратно)"""
+    args = tuple(map(str, args))
+    if any(SEPARATOR in arg for arg in args):
+        raise ValueError(f"Аргумент callback_data не может содержать '{SEPARATOR}': {args}")
+    data = SEPARATOR.join((prefix, *args))
+    # Лимит Telegram - в байтах UTF-8, а не в символах
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {data}")
+    return data
+
+
+def unpack(data):
+    """Разбор callback_data на префикс и аргументы"""
+    prefix, *args = data.split(SEPARATOR)
+    return prefix, args
+
+
+class Route:
+    """
+    Обработчик префикса с проверкой аргументов
+
+    choices - допустимые значения первого аргумента или функция, которая
+    их возвращает (для списков, которые меняются без перезапуска бота).
+    """
+
+    def __init__(self, handler, arity=0, choices=None):
+        self.handler = handler
+        self.arity = arity
+        if choices is None or callable(choices):
+            self.choices = choices
+        else:
+            self.choices = frozenset(choices)
+        # Какие данные диспетчера нужны обработчику (state, profile_writer, ...)
+        params = inspect.signature(handler).parameters
+        self.kwargs = frozenset(list(params)[1:])
+
+    def validate(self, args):
+        if len(args) != self.arity:
+            return False
+        if self.choices is None:
+            return True
+        choices = self.choices() if callable(self.choices) else self.choices
+        return args[0] in choices
+
+
+class CallbackRouter:
+    """Словарь префикс -> обработчик, подключается к диспетчеру одним обработчиком"""
+
+    def __init__(self, unknown=None):
+        self.routes = {}
+        self.unknown = unknown
+
+    def register(self, prefix, handler, arity=0, choices=None):
+        """Регистрация обработчика для префикса"""
+        if SEPARATOR in prefix:
+            raise ValueError(f"Префикс не может содержать '{SEPARATOR}': {prefix}")
+        self.routes[prefix] = Route(handler, arity, choices)
+
+    def resolve(self, data):
+        """Поиск обработчика и аргументов; None, если callback_data некорректна"""
+        if not data or len(data.encode()) > MAX_CALLBACK_DATA:
+            return None
+        prefix, args = unpack(data)
+        route = self.routes.get(prefix)
+        if route is None and not args and "_" in prefix:
+            # Кнопки старого формата ("region_phuket") в уже отправленных сообщениях
+            prefix, _, arg = prefix.partition("_")
+            route, args = self.routes.get(prefix), [arg]
+        if route is None or not route.validate(args):
+            return None
+        return route, args
+
+    async def dispatch(self, callback: types.CallbackQuery, **kwargs):
+        """Единственный обработчик callback_query в диспетчере"""
+        resolved = self.resolve(callback.data)
+        if resolved is None:
+            if self.unknown is not None:
+                return await self.unknown(callback)
+            return await callback.answer()
+        route, args = resolved
+        if "args" in route.kwargs:
+            kwargs["args"] = args
+        return await route.handler(
+            callback, **{name: kwargs[name] for name in route.kwargs if name in kwargs}
+        )
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""
+Каталог недвижимости ReloCompass в памяти
+Активные объекты из properties хранятся по регионам в массивах, отсортированных
+по цене в USD (pricing.py). Запрос "регион + бюджет + спальни" - это бинарный поиск диапазона цен
+и один проход по нему с раскладкой по приоритету:
+1. RED Experts (собственные объекты)
+2. Буст-объекты (boost_expiry еще не наступил)
+3. Остальные объекты
+
+Приоритет буста хранится флагом, а не сравнивается с текущим временем на
+каждый запрос: окончания бустов лежат в куче (BoostSchedule), и фоновая
+задача снимает флаг точно в момент окончания, сбрасывая готовые страницы
+только этого региона. Поэтому выдача зависит лишь от данных и кэшируется
+без срока жизни.
+
+Вместе с регионами обновляется индекс поиска по тексту (search.py).
+Объект в валюте без курса (price_usd = None) в индексы регионов не
+попадает: его цену нельзя сравнить с бюджетом, пока курс не появится.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+from pricing import ExchangeRates
+from search import SearchIndex, parse_query
+
+logger = logging.getLogger(__name__)
+
+# Значение properties.source для собственных объектов RED Experts
+RED_EXPERTS_SOURCE = os.getenv('RED_EXPERTS_SOURCE', 'red')
+CATALOG_REFRESH = float(os.getenv('CATALOG_REFRESH', 30))
+
+Listing = namedtuple('Listing', [
+    'id', 'source', 'region', 'city', 'title', 'price', 'currency',
+    'bedrooms', 'boost_expiry', 'is_for_relocants', 'has_furniture', 'good_internet',
+    'price_usd',
+])
+
+# Позиция в выдаче: приоритет (0 - RED Experts, 1 - буст, 2 - остальные), цена в USD, id
+Cursor = namedtuple('Cursor', ['tier', 'price', 'id'])
+
+SELECT_SQL = (
+    "SELECT id, source, region, city, title, description, price, price_currency, bedrooms, "
+    "boost_expiry, is_for_relocants, has_furniture, good_internet, is_active, updated_at "
+    "FROM properties"
+)
+
+
+def parse_datetime(value):
+    """datetime из базы (UTC без зоны, см. database.now) в timestamp"""
+    if not value:
+        return 0.0
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+def encode_cursor(cursor):
+    """Компактная запись курсора для callback_data: приоритет.цена в центах (hex).id"""
+    return f"{cursor.tier}.{int(round(cursor.price * 100)):x}.{cursor.id}"
+
+
+def decode_cursor(value):
+    """Курсор из callback_data; None, если строка некорректна"""
+    try:
+        tier, price, pid = value.split('.')
+        return Cursor(int(tier), int(price, 16) / 100, pid)
+    except ValueError:
+        return None
+
+
+def min_bedrooms_for(family_members):
+    """Минимум спален для размера семьи"""
+    if not family_members:
+        return None
+    return max(1, family_members - 1)
+
+
+def tier_of(red, boosted):
+    """Приоритет в выдаче: 0 - RED Experts, 1 - буст, 2 - остальные"""
+    if red:
+        return 0
+    return 1 if boosted else 2
+
+
+class BoostSchedule:
+    """
+    Окончания бустов: куча (время, id) с ленивым удалением
+
+    Продление или снятие буста не ищет старую запись в куче: актуальное
+    время объекта хранится в словаре, а устаревшие записи пропускаются,
+    когда доходят до вершины. Все операции - O(log n).
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._expiry = {}
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def set(self, pid, expiry):
+        """Буст объекта до expiry (timestamp); 0 - без буста"""
+        if not expiry:
+            self.discard(pid)
+            return
+        if self._expiry.get(pid) == expiry:
+            return
+        self._expiry[pid] = expiry
+        heapq.heappush(self._heap, (expiry, pid))
+        if len(self._heap) > 2 * len(self._expiry) + 1000:
+            # Устаревших записей больше, чем живых: пересобираем кучу
+            self._heap = [(expiry, pid) for pid, expiry in self._expiry.items()]
+            heapq.heapify(self._heap)
+
+    def discard(self, pid):
+        self._expiry.pop(pid, None)
+
+    def next_expiry(self):
+        """Ближайшее окончание буста (None, если бустов нет)"""
+        heap = self._heap
+        while heap and self._expiry.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_expired(self, now):
+        """id объектов, буст которых закончился к now"""
+        expired = []
+        while (expiry := self.next_expiry()) is not None and expiry <= now:
+            _, pid = heapq.heappop(self._heap)
+            del self._expiry[pid]
+            expired.append(pid)
+        return expired
+
+
+class TierIndex:
+    """Объекты одного приоритета в параллельных массивах, упорядоченных по (цена в USD, id)"""
+
+    __slots__ = ('ids', 'prices', 'bedrooms')
+
+    def __init__(self):
+        self.ids = []
+        self.prices = array('d')
+        self.bedrooms = array('h')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, price, pid, bedrooms):
+        self.ids.append(pid)
+        self.prices.append(price)
+        self.bedrooms.append(bedrooms)
+
+    def position(self, price, pid):
+        i = bisect_left(self.prices, price)
+        while i < len(self.ids) and self.prices[i] == price and self.ids[i] < pid:
+            i += 1
+        return i
+
+    def insert(self, price, pid, bedrooms):
+        i = self.position(price, pid)
+        self.ids.insert(i, pid)
+        self.prices.insert(i, price)
+        self.bedrooms.insert(i, bedrooms)
+
+    def remove(self, price, pid):
+        i = self.position(price, pid)
+        del self.ids[i]
+        del self.prices[i]
+        del self.bedrooms[i]
+
+    def bounds(self, min_price=None, max_price=None):
+        lo = 0 if min_price is None else bisect_left(self.prices, min_price)
+        hi = len(self.prices) if max_price is None else bisect_right(self.prices, max_price)
+        return lo, hi
+
+
+class RegionIndex:
+    """
+    Объекты одного региона в параллельных массивах, упорядоченных по (цена в USD, id)
+
+    Для страниц каталога те же объекты дополнительно разложены по приоритетам
+    (tiers): страница - это бинарный поиск курсора в массиве своего приоритета
+    и limit шагов, без прохода по объектам других приоритетов.
+    """
+
+    __slots__ = ('ids', 'prices', 'bedrooms', 'red', 'boosted', 'tiers')
+
+    def __init__(self):
+        self.ids = []
+        self.prices = array('d')
+        self.bedrooms = array('h')
+        self.red = array('b')
+        # Буст действует (снимается BoostSchedule в момент окончания)
+        self.boosted = array('b')
+        # 0 - RED Experts, 1 - буст, 2 - остальные
+        self.tiers = (TierIndex(), TierIndex(), TierIndex())
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, listings, now=None):
+        """Индекс из объектов одной сортировкой (вместо вставки по одному)"""
+        now = now or time.time()
+        index = cls()
+        for listing in sorted(listings, key=lambda listing: (listing.price_usd, listing.id)):
+            bedrooms = -1 if listing.bedrooms is None else listing.bedrooms
+            red, boosted = listing.source == RED_EXPERTS_SOURCE, listing.boost_expiry > now
+            index.ids.append(listing.id)
+            index.prices.append(listing.price_usd)
+            index.bedrooms.append(bedrooms)
+            index.red.append(red)
+            index.boosted.append(boosted)
+            index.tiers[tier_of(red, boosted)].append(listing.price_usd, listing.id, bedrooms)
+        return index
+
+    def _position(self, price, pid):
+        i = bisect_left(self.prices, price)
+        while i < len(self.ids) and self.prices[i] == price and self.ids[i] < pid:
+            i += 1
+        return i
+
+    def insert(self, listing, now=None):
+        i = self._position(listing.price_usd, listing.id)
+        bedrooms = -1 if listing.bedrooms is None else listing.bedrooms
+        red = listing.source == RED_EXPERTS_SOURCE
+        boosted = listing.boost_expiry > (now or time.time())
+        self.ids.insert(i, listing.id)
+        self.prices.insert(i, listing.price_usd)
+        self.bedrooms.insert(i, bedrooms)
+        self.red.insert(i, red)
+        self.boosted.insert(i, boosted)
+        self.tiers[tier_of(red, boosted)].insert(listing.price_usd, listing.id, bedrooms)
+
+    def remove(self, listing):
+        i = self._position(listing.price_usd, listing.id)
+        self.tiers[tier_of(self.red[i], self.boosted[i])].remove(listing.price_usd, listing.id)
+        del self.ids[i]
+        del self.prices[i]
+        del self.bedrooms[i]
+        del self.red[i]
+        del self.boosted[i]
+
+    def unboost(self, listing):
+        """Снятие флага буста (бинарный поиск позиции объекта)"""
+        i = self._position(listing.price_usd, listing.id)
+        if self.boosted[i] and not self.red[i]:
+            self.tiers[1].remove(listing.price_usd, listing.id)
+            self.tiers[2].insert(listing.price_usd, listing.id, self.bedrooms[i])
+        self.boosted[i] = False
+
+    def count(self, min_price=None, max_price=None):
+        """Число объектов в диапазоне цен (два бинарных поиска)"""
+        lo = 0 if min_price is None else bisect_left(self.prices, min_price)
+        hi = len(self.prices) if max_price is None else bisect_right(self.prices, max_price)
+        return max(0, hi - lo)
+
+    def search(self, min_price=None, max_price=None, min_bedrooms=None, limit=10):
+        """id объектов по приоритету, внутри приоритета - по возрастанию цены"""
+        lo = 0 if min_price is None else bisect_left(self.prices, min_price)
+        hi = len(self.prices) if max_price is None else bisect_right(self.prices, max_price)
+
+        red, boosted_ids, rest = [], [], []
+        ids, bedrooms, is_red, boosted = self.ids, self.bedrooms, self.red, self.boosted
+        for i in range(lo, hi):
+            if min_bedrooms is not None and bedrooms[i] < min_bedrooms:
+                continue
+            if is_red[i]:
+                red.append(ids[i])
+                # RED Experts уже заполнили всю выдачу
+                if len(red) >= limit:
+                    break
+            elif boosted[i]:
+                boosted_ids.append(ids[i])
+            else:
+                rest.append(ids[i])
+        return (red + boosted_ids + rest)[:limit]
+
+    def page(self, min_price=None, max_price=None, min_bedrooms=None, cursor=None,
+             backward=False, limit=5):
+        """
+        Страница выдачи после курсора (или перед ним при backward)
+
+        Порядок тот же, что у search: приоритет, затем цена и id. В массиве
+        каждого приоритета позиция курсора находится бинарным поиском, дальше
+        берутся подряд до limit объектов (пропускаются только не подходящие
+        по спальням).
+        """
+        result = []
+        for tier in ((2, 1, 0) if backward else (0, 1, 2)):
+            if cursor is not None and (tier > cursor.tier if backward else tier < cursor.tier):
+                continue
+            index = self.tiers[tier]
+            lo, hi = index.bounds(min_price, max_price)
+            if backward:
+                end = hi
+                if cursor is not None and tier == cursor.tier:
+                    end = max(lo, min(hi, index.position(cursor.price, cursor.id)))
+                positions = range(end - 1, lo - 1, -1)
+            else:
+                start = lo
+                if cursor is not None and tier == cursor.tier:
+                    start = min(hi, max(lo, index.position(cursor.price, cursor.id)))
+                    if start < hi and index.ids[start] == cursor.id:
+                        start += 1
+                positions = range(start, hi)
+
+            for i in positions:
+                if min_bedrooms is not None and index.bedrooms[i] < min_bedrooms:
+                    continue
+                result.append(Cursor(tier, index.prices[i], index.ids[i]))
+                if len(result) == limit:
+                    break
+            if len(result) == limit:
+                break
+
+        if backward:
+            result.reverse()
+        return result
+
+
+class Catalog:
+    """
+    Индекс активных объектов по регионам
+
+    Первая загрузка читает всю таблицу (и восстанавливает расписание
+    окончания бустов), дальше раз в refresh_interval подтягиваются только
+    строки с updated_at новее уже загруженных. Готовые страницы хранятся
+    по регионам и сбрасываются только у региона, в котором что-то
+    изменилось; versions - номер версии данных каждого региона.
+    """
+
+    def __init__(self, db, refresh_interval=CATALOG_REFRESH, rates=None):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.rates = rates or ExchangeRates(db)
+        self.regions = {}
+        self.listings = {}
+        self.last_updated_at = ''
+        # id объектов с updated_at == last_updated_at (они придут повторно)
+        self._last_ids = set()
+        self._task = None
+        self._expiry_task = None
+        self.boosts = BoostSchedule()
+        self._boosts_changed = asyncio.Event()
+        # Готовые страницы по регионам (в том числе заранее подготовленные следующие)
+        self.pages = {}
+        self.pages_size = 2000
+        self.versions = {}
+        # Поиск по заголовку, описанию и городу (описания в памяти не хранятся)
+        self.fulltext = SearchIndex(RED_EXPERTS_SOURCE)
+
+    async def _fetch(self, since):
+        if since:
+            return await self.db.fetch(SELECT_SQL + " WHERE updated_at >= ?", (since,))
+        return await self.db.fetch(SELECT_SQL + " WHERE is_active = ?", (True,))
+
+    def apply(self, rows):
+        """Применение загруженных строк к индексу"""
+        # Первая загрузка: индексы регионов строятся одной сортировкой
+        initial = not self.listings
+        now = time.time()
+        next_expiry = self.boosts.next_expiry()
+        changed = set()
+        descriptions = {}
+        for (pid, source, region, city, title, description, price, currency, bedrooms, boost_expiry,
+             is_for_relocants, has_furniture, good_internet, is_active, updated_at) in rows:
+            old = self.listings.pop(pid, None)
+            if old is not None:
+                if old.price_usd is not None:
+                    self.regions[old.region].remove(old)
+                self.boosts.discard(pid)
+                self.fulltext.remove(pid)
+                changed.add(old.region)
+            if is_active:
+                listing = Listing(
+                    pid, source, region, city, title, float(price), currency,
+                    bedrooms, parse_datetime(boost_expiry),
+                    bool(is_for_relocants), bool(has_furniture), bool(good_internet),
+                    self.rates.to_usd(float(price), currency),
+                )
+                self.listings[pid] = listing
+                if listing.boost_expiry > now and listing.price_usd is not None:
+                    self.boosts.set(pid, listing.boost_expiry)
+                if initial:
+                    descriptions[pid] = description
+                else:
+                    if listing.price_usd is not None:
+                        self.regions.setdefault(region, RegionIndex()).insert(listing, now)
+                    self.fulltext.insert(listing, description)
+                changed.add(region)
+            if updated_at > self.last_updated_at:
+                self.last_updated_at = updated_at
+                self._last_ids = {pid}
+            elif updated_at == self.last_updated_at:
+                self._last_ids.add(pid)
+        if initial:
+            by_region = {}
+            for listing in self.listings.values():
+                if listing.price_usd is not None:
+                    by_region.setdefault(listing.region, []).append(listing)
+            self.regions = {region: RegionIndex.build(listings, now) for region, listings in by_region.items()}
+            self.fulltext = SearchIndex.build(
+                ((listing, descriptions[pid]) for pid, listing in self.listings.items()),
+                RED_EXPERTS_SOURCE,
+            )
+        self.invalidate(changed)
+        if self.boosts.next_expiry() != next_expiry:
+            # Ближайшее окончание буста сдвинулось: фоновая задача пересчитает ожидание
+            self._boosts_changed.set()
+
+    def invalidate(self, regions):
+        """Сброс готовых страниц регионов после изменения их данных"""
+        for region in regions:
+            self.versions[region] = self.versions.get(region, 0) + 1
+            self.pages.pop(region, None)
+
+    def expire_boosts(self, now=None):
+        """Снятие бустов, закончившихся к now; возвращает число объектов"""
+        changed = set()
+        expired = self.boosts.pop_expired(now or time.time())
+        for pid in expired:
+            listing = self.listings.get(pid)
+            if listing is not None:
+                self.regions[listing.region].unboost(listing)
+                changed.add(listing.region)
+        self.invalidate(changed)
+        return len(expired)
+
+    async def _expire_boosts_on_time(self):
+        """Ожидание ближайшего окончания буста (или изменения расписания)"""
+        while True:
+            next_expiry = self.boosts.next_expiry()
+            timeout = None if next_expiry is None else next_expiry - time.time()
+            self._boosts_changed.clear()
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._boosts_changed.wait(), timeout)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            expired = self.expire_boosts()
+            if expired:
+                logger.info(f"Закончился буст: {expired} объектов")
+
+    def reprice(self, currencies):
+        """Пересчет цен в USD для объектов в валютах с новым курсом"""
+        affected = {}
+        for listing in self.listings.values():
+            if listing.currency in currencies:
+                affected.setdefault(listing.region, []).append(listing)
+
+        now = time.time()
+        for region, listings in affected.items():
+            index = self.regions.setdefault(region, RegionIndex())
+            repriced = [
+                listing._replace(price_usd=self.rates.to_usd(listing.price, listing.currency))
+                for listing in listings
+            ]
+            for listing in repriced:
+                # Объект, у валюты которого появился курс, входит в выдачу
+                if listing.boost_expiry > now and listing.price_usd is not None:
+                    self.boosts.set(listing.id, listing.boost_expiry)
+            if len(listings) * 10 > len(index):
+                # Изменилась заметная часть региона: дешевле пересобрать индекс
+                ids = {listing.id for listing in listings}
+                kept = [self.listings[pid] for pid in index.ids if pid not in ids]
+                for listing in repriced:
+                    self.listings[listing.id] = listing
+                    self.fulltext.reprice(listing)
+                self.regions[region] = RegionIndex.build(
+                    kept + [listing for listing in repriced if listing.price_usd is not None], now
+                )
+            else:
+                for old, listing in zip(listings, repriced):
+                    if old.price_usd is not None:
+                        index.remove(old)
+                    if listing.price_usd is not None:
+                        index.insert(listing, now)
+                    self.listings[listing.id] = listing
+                    self.fulltext.reprice(listing)
+
+        self.invalidate(affected)
+        return sum(map(len, affected.values()))
+
+    async def refresh(self):
+        """Подгрузка изменившихся объектов и курсов валют"""
+        currencies = await self.rates.refresh()
+        if currencies and self.listings:
+            repriced = self.reprice(currencies)
+            logger.info(f"Цены в USD пересчитаны: {repriced} объектов")
+
+        rows = await self._fetch(self.last_updated_at)
+        rows = [
+            row for row in rows
+            if row[-1] != self.last_updated_at or row[0] not in self._last_ids
+        ]
+        if rows:
+            self.apply(rows)
+            logger.info(f"Каталог обновлен: {len(rows)} изменений, всего {len(self.listings)}")
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка обновления каталога: {e}")
+
+    async def start(self):
+        """Загрузка каталога и запуск фонового обновления"""
+        await self.refresh()
+        # Бусты, закончившиеся за время загрузки
+        self.expire_boosts()
+        self._task = asyncio.create_task(self._refresh_periodically())
+        self._expiry_task = asyncio.create_task(self._expire_boosts_on_time())
+
+    async def close(self):
+        for task in (self._task, self._expiry_task):
+            if task is not None:
+                task.cancel()
+
+    def count(self, region, budget=None):
+        """Сколько объектов региона попадает в бюджет (без учета спален)"""
+        index = self.regions.get(region)
+        if index is None:
+            return 0
+        return index.count(*(budget or (None, None)))
+
+    def search(self, region, budget=None, min_bedrooms=None, limit=10):
+        """Подбор объектов: регион, бюджет (от, до) и минимум спален"""
+        index = self.regions.get(region)
+        if index is None:
+            return []
+        min_price, max_price = budget or (None, None)
+        ids = index.search(min_price, max_price, min_bedrooms, limit)
+        return [self.listings[pid] for pid in ids]
+
+    def find(self, text, region=None, limit=10):
+        """
+        Поиск по свободному тексту: (объекты, всего найдено)
+
+        region сужает поиск; если в регионе ничего нет, ищем во всех.
+        """
+        query = parse_query(text)
+        if not (query.terms or query.facets or query.min_bedrooms is not None):
+            return [], 0
+        ids, total = self.fulltext.search(query, region, limit)
+        if not total and region is not None:
+            ids, total = self.fulltext.search(query, None, limit)
+        return [self.listings[pid] for pid in ids], total
+
+    def page(self, region, budget=None, min_bedrooms=None, cursor=None, backward=False, limit=5):
+        """
+        Страница каталога: (объекты, курсоры, есть ли еще страницы в этом направлении)
+
+        Каждая страница запрашивается с limit + 1, чтобы узнать, есть ли следующая.
+        """
+        pages = self.pages.get(region)
+        key = (budget, min_bedrooms, cursor, backward, limit)
+        if pages is not None:
+            cached = pages.get(key)
+            if cached is not None:
+                pages.move_to_end(key)
+                return cached
+
+        index = self.regions.get(region)
+        if index is None:
+            return [], [], False
+        min_price, max_price = budget or (None, None)
+        cursors = index.page(min_price, max_price, min_bedrooms, cursor, backward, limit + 1)
+        has_more = len(cursors) > limit
+        if has_more:
+            cursors = cursors[1:] if backward else cursors[:limit]
+        result = ([self.listings[c.id] for c in cursors], cursors, has_more)
+
+        # Страница актуальна, пока регион не изменился (см. invalidate)
+        pages = self.pages.setdefault(region, OrderedDict())
+        pages[key] = result
+        if len(pages) > self.pages_size:
+            pages.popitem(last=False)
+        return result
+
+    def prefetch(self, region, budget=None, min_bedrooms=None, cursor=None, backward=False, limit=5):
+        """Подготовка следующей страницы после ответа пользователю"""
+        asyncio.get_running_loop().call_soon(
+            self.page, region, budget, min_bedrooms, cursor, backward, limit
+        )
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Доступ к базе данных для бота ReloCompass
+Работает без Django ORM напрямую с db.sqlite3 (MVP) или с PostgreSQL
+(DB_ENGINE=postgres, продакшен). Django берет настройки отсюда же
+(django_databases), так что бот и админка работают с одной базой.
+
+SQLite: WAL и настроенные PRAGMA, чтения - через несколько соединений
+в потоках, записи - через одно соединение по очереди (писатель в SQLite
+всегда один, так процесс не ловит SQLITE_BUSY сам с собой).
+PostgreSQL: ограниченный пул соединений asyncpg; запросы готовятся один раз
+на соединение (кэш prepared statements asyncpg).
+
+SQL пишется с плейсхолдерами ?, для PostgreSQL они заменяются на $1, $2...
+Значения в обоих движках одинаковые: дата-время - строка в формате now()
+(как Django хранит его в SQLite), numeric - float, uuid - 32 hex-символа.
+Через слой работают все модули бота; connect() остался для бенчмарков,
+которые сравнивают слой с прямыми запросами к SQLite.
+"""
+
+import asyncio
+import os
+import sqlite3
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+# sqlite или postgres
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+# Путь к базе данных (та же db.sqlite3, что и у Django админки)
+DB_PATH = os.getenv('SQLITE_PATH', str(Path(__file__).parent / 'db.sqlite3'))
+# Соединений для чтения SQLite (писатель всегда один)
+SQLITE_READERS = int(os.getenv('SQLITE_READERS', 4))
+
+# PostgreSQL: параметры из env.example / docker-compose.yml
+DB_NAME = os.getenv('DB_NAME', 'relocompass')
+DB_USER = os.getenv('DB_USER', 'postgres')
+DB_PASSWORD = os.getenv('DB_PASSWORD', '')
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_PORT = int(os.getenv('DB_PORT', 5432))
+# Соединений в пуле бота и подготовленных запросов на соединение
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', 256))
+
+PRAGMAS = (
+    # WAL позволяет читать базу параллельно с записью из другого процесса
+    "PRAGMA journal_mode=WAL",
+    # В WAL после сбоя питания теряются только последние транзакции, файл не портится
+    "PRAGMA synchronous=NORMAL",
+    # Кэш страниц 32 МБ на соединение, временные таблицы сортировок в памяти
+    "PRAGMA cache_size=-32000",
+    "PRAGMA temp_store=MEMORY",
+    # Чтение через mmap без копирования страниц в буфер процесса
+    "PRAGMA mmap_size=268435456",
+)
+
+
+def connect(path=None):
+    """Подключение к SQLite в режиме WAL с настроенными PRAGMA"""
+    conn = sqlite3.connect(path or DB_PATH, timeout=30, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# Таблицы, без которых бот не работает; все создаются миграциями Django
+# (python manage.py migrate), сам бот схему не меняет
+BOT_TABLES = (
+    'properties', 'property_images', 'telegram_users', 'leads', 'bot_settings',
+    'stats_daily', 'amocrm_outbox', 'exchange_rates', 'property_image_files', 'bot_fsm_states',
+)
+
+
+async def missing_tables(db, tables=BOT_TABLES):
+    """Таблицы из tables, которых нет в базе (не применены миграции admin_panel)"""
+    existing = await db.tables()
+    return [table for table in tables if table not in existing]
+
+
+def now():
+    """Текущее время в формате, в котором Django хранит datetime в SQLite"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def from_postgres_datetime(value):
+    """timestamptz из текстового вида PostgreSQL -> строка в формате now() (UTC)"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def django_databases(engine=DB_ENGINE, path=None):
+    """DATABASES для Django с теми же базой и настройками, что у бота"""
+    if engine == 'postgres':
+        return {'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': DB_NAME, 'USER': DB_USER, 'PASSWORD': DB_PASSWORD,
+            'HOST': DB_HOST, 'PORT': DB_PORT,
+            # Соединение переиспользуется между запросами админки
+            'CONN_MAX_AGE': 60,
+            'CONN_HEALTH_CHECKS': True,
+        }}
+    return {'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path or DB_PATH,
+        'OPTIONS': {
+            # Django 5.1+: PRAGMA на каждое соединение; транзакции сразу берут
+            # блокировку записи, а не падают с "database is locked" на середине
+            'init_command': ';'.join(PRAGMAS),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 30,
+        },
+    }}
+
+
+def to_postgres(sql):
+    """Плейсхолдеры ? -> $1, $2... (вопросительные знаки в строковых литералах не трогаются)"""
+    parts, number, quote = [], 0, None
+    for char in sql:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == '?':
+            number += 1
+            char = f"${number}"
+        parts.append(char)
+    return ''.join(parts)
+
+
+class SQLiteDatabase:
+    """
+    SQLite для асинхронного кода
+
+    Чтения идут через readers соединений в потоках параллельно, записи и
+    транзакции - через одно соединение по очереди.
+    """
+
+    engine = 'sqlite'
+
+    def __init__(self, path=None, readers=SQLITE_READERS):
+        self.path = path
+        self.readers = readers
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._pool = None
+        self._connections = []
+
+    async def start(self):
+        self._writer = await asyncio.to_thread(connect, self.path)
+        self._pool = asyncio.Queue()
+        for _ in range(self.readers):
+            conn = await asyncio.to_thread(connect, self.path)
+            self._connections.append(conn)
+            self._pool.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def fetch(self, sql, params=()):
+        """Все строки запроса (списком кортежей)"""
+        conn = await self._pool.get()
+        try:
+            return await asyncio.to_thread(lambda: conn.execute(sql, params).fetchall())
+        finally:
+            self._pool.put_nowait(conn)
+
+    async def fetchone(self, sql, params=()):
+        conn = await self._pool.get()
+        try:
+            return await asyncio.to_thread(lambda: conn.execute(sql, params).fetchone())
+        finally:
+            self._pool.put_nowait(conn)
+
+    async def execute(self, sql, params=()):
+        """Запрос на запись отдельной транзакцией; возвращает число строк"""
+        async with self.transaction() as tx:
+            return await tx.execute(sql, params)
+
+    async def executemany(self, sql, rows):
+        async with self.transaction() as tx:
+            await tx.executemany(sql, rows)
+
+    async def tables(self):
+        """Имена таблиц в базе"""
+        return {row[0] for row in await self.fetch("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    @asynccontextmanager
+    async def transaction(self, lock=None):
+        """
+        Транзакция на соединении писателя (откатывается при исключении)
+
+        lock - имя блокировки для транзакций "прочитать, проверить, записать";
+        в SQLite BEGIN IMMEDIATE и так исключает других писателей.
+        """
+        async with self._write_lock:
+            conn = self._writer
+            await asyncio.to_thread(conn.execute, "BEGIN IMMEDIATE")
+            try:
+                yield SQLiteTransaction(conn)
+            except BaseException:
+                await asyncio.to_thread(conn.rollback)
+                raise
+            await asyncio.to_thread(conn.commit)
+
+
+class SQLiteTransaction:
+    """Запросы внутри транзакции SQLiteDatabase"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def execute(self, sql, params=()):
+        return (await asyncio.to_thread(self.conn.execute, sql, params)).rowcount
+
+    async def executemany(self, sql, rows):
+        await asyncio.to_thread(self.conn.executemany, sql, rows)
+
+    async def fetch(self, sql, params=()):
+        return await asyncio.to_thread(lambda: self.conn.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql, params=()):
+        return await asyncio.to_thread(lambda: self.conn.execute(sql, params).fetchone())
+
+
+def status_rowcount(status):
+    """Число строк из статуса asyncpg ("UPDATE 3", "INSERT 0 1")"""
+    last = status.rsplit(' ', 1)[-1]
+    return int(last) if last.isdigit() else -1
+
+
+class PostgresTransaction:
+    """Запросы на соединении asyncpg с тем же интерфейсом, что у SQLiteTransaction"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def execute(self, sql, params=()):
+        return status_rowcount(await self.conn.execute(to_postgres(sql), *params))
+
+    async def executemany(self, sql, rows):
+        await self.conn.executemany(to_postgres(sql), rows)
+
+    async def fetch(self, sql, params=()):
+        return [tuple(row) for row in await self.conn.fetch(to_postgres(sql), *params)]
+
+    async def fetchone(self, sql, params=()):
+        row = await self.conn.fetchrow(to_postgres(sql), *params)
+        return tuple(row) if row is not None else None
+
+
+class PostgresDatabase:
+    """PostgreSQL через пул asyncpg не больше pool_size соединений"""
+
+    engine = 'postgres'
+
+    def __init__(self, dsn=None, pool_size=DB_POOL_SIZE, statement_cache=DB_STATEMENT_CACHE):
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.statement_cache = statement_cache
+        self._pool = None
+
+    async def start(self):
+        import asyncpg
+
+        params = {} if self.dsn else dict(
+            database=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
+        )
+        self._pool = await asyncpg.create_pool(
+            self.dsn, min_size=1, max_size=self.pool_size,
+            statement_cache_size=self.statement_cache, init=self._init_connection,
+            server_settings={'timezone': 'UTC'}, **params,
+        )
+
+    @staticmethod
+    async def _init_connection(conn):
+        """Кодеки типов: значения те же, что отдает SQLite"""
+        for name in ('timestamp', 'timestamptz'):
+            await conn.set_type_codec(
+                name, schema='pg_catalog', format='text', encoder=str, decoder=from_postgres_datetime,
+            )
+        await conn.set_type_codec('numeric', schema='pg_catalog', format='text', encoder=str, decoder=float)
+        await conn.set_type_codec(
+            'uuid', schema='pg_catalog', format='text', encoder=str, decoder=lambda value: value.replace('-', ''),
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def fetch(self, sql, params=()):
+        async with self._pool.acquire() as conn:
+            return await PostgresTransaction(conn).fetch(sql, params)
+
+    async def fetchone(self, sql, params=()):
+        async with self._pool.acquire() as conn:
+            return await PostgresTransaction(conn).fetchone(sql, params)
+
+    async def execute(self, sql, params=()):
+        async with self._pool.acquire() as conn:
+            return await PostgresTransaction(conn).execute(sql, params)
+
+    async def executemany(self, sql, rows):
+        async with self._pool.acquire() as conn:
+            await PostgresTransaction(conn).executemany(sql, rows)
+
+    async def tables(self):
+        return {row[0] for row in await self.fetch(
+            "SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()"
+        )}
+
+    @asynccontextmanager
+    async def transaction(self, lock=None):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                if lock is not None:
+                    # Транзакции с одним lock идут по очереди (до COMMIT/ROLLBACK)
+                    await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", lock)
+                yield PostgresTransaction(conn)
+
+
+def create_database(engine=DB_ENGINE, path=None, dsn=None):
+    """База по DB_ENGINE: SQLiteDatabase (по умолчанию) или PostgresDatabase"""
+    if engine == 'postgres':
+        return PostgresDatabase(dsn or os.getenv('DATABASE_URL'))
+    if engine != 'sqlite':
+        raise ValueError(f"Неизвестный DB_ENGINE: {engine} (sqlite или postgres)")
+    return SQLiteDatabase(path)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Локальная имитация AmoCRM для тестов и бенчмарка выгрузки лидов
+Запуск: python fake_amocrm.py [порт], затем AMOCRM_BASE_URL=http://localhost:порт
+"""
+
+import itertools
+import random
+import sys
+
+from aiohttp import web
+
+from ratelimit import TokenBucket
+
+
+def create_app(rate=7, failure_rate=0.0, max_batch=50, faults=()):
+    """
+    POST /api/v4/leads/complex как у AmoCRM: не больше rate запросов в секунду
+    (иначе 429), случайные 500 с вероятностью failure_rate
+
+    faults - ответы на первые запросы по порядку: (статус, заголовки).
+    """
+    ids = itertools.count(1000000)
+    bucket = TokenBucket(rate)
+    faults = list(faults)
+    stats = {"requests": 0, "leads": 0, "throttled": 0, "failed": 0, "batches": []}
+
+    async def leads_complex(request):
+        stats["requests"] += 1
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return web.json_response({"title": "Unauthorized"}, status=401)
+        if faults:
+            status, headers = faults.pop(0)
+            stats["throttled" if status == 429 else "failed"] += 1
+            return web.json_response({"title": "Fault"}, status=status, headers=headers)
+        if not bucket.try_acquire():
+            stats["throttled"] += 1
+            return web.json_response({"title": "Too Many Requests"}, status=429,
+                                     headers={"Retry-After": "1"})
+        if random.random() < failure_rate:
+            stats["failed"] += 1
+            return web.json_response({"title": "Internal Server Error"}, status=500)
+
+        leads = await request.json()
+        if not isinstance(leads, list) or len(leads) > max_batch:
+            return web.json_response({"title": "Bad Request"}, status=400)
+        stats["leads"] += len(leads)
+        stats["batches"].append(len(leads))
+        return web.json_response([
+            {
+                "id": next(ids),
+                "contact_id": next(ids),
+                "company_id": None,
+                "request_id": [lead.get("request_id")],
+                "merged": False,
+            }
+            for lead in leads
+        ])
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/api/v4/leads/complex", leads_complex)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    print(f"🧪 Фейковая AmoCRM на http://localhost:{port}")
+    web.run_app(create_app(), port=port)
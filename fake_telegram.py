@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Локальная имитация Telegram Bot API для тестов и бенчмарка отправки
+Запуск: python fake_telegram.py [порт]; Bot(session=AiohttpSession(
+api=TelegramAPIServer.from_base("http://localhost:порт")))
+"""
+
+import asyncio
+import itertools
+import json
+import sys
+import time
+
+from aiohttp import web
+
+from ratelimit import TokenBucket
+
+
+def create_app(rate=30, chat_rate=1, chat_burst=3, retry_after=1, blocked=(), download_delay=0.0):
+    """
+    POST /bot<token>/<метод>: не больше rate сообщений в секунду на бота
+    и chat_rate в один чат, иначе 429 с retry_after; чаты из blocked получают 403.
+    Фото по URL "скачиваются" download_delay секунд и получают file_id.
+    """
+    message_ids = itertools.count(1)
+    file_ids = itertools.count(1)
+    bucket = TokenBucket(rate)
+    chats = {}
+    stats = {"requests": 0, "sent": 0, "edited": 0, "throttled": 0, "blocked": 0, "downloads": 0,
+             "methods": {}}
+
+    def error(code, description, **parameters):
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    async def photo(media):
+        """file_id для фото: по URL - после скачивания, иначе уже готовый"""
+        if not media.startswith(("http://", "https://")):
+            return media
+        stats["downloads"] += 1
+        await asyncio.sleep(download_delay)
+        return f"AgACAgIAAx{next(file_ids)}"
+
+    def message(chat_id, message_id=None, **fields):
+        return {
+            "message_id": message_id or next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **fields,
+        }
+
+    def photo_sizes(file_id):
+        return [{"file_id": file_id, "file_unique_id": file_id[-8:], "width": 1280, "height": 960}]
+
+    async def api(request):
+        method = request.match_info["method"]
+        stats["requests"] += 1
+        stats["methods"][method] = stats["methods"].get(method, 0) + 1
+        params = dict(await request.post())
+
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+            }})
+        if method == "answerCallbackQuery":
+            return web.json_response({"ok": True, "result": True})
+        if "chat_id" not in params:
+            return error(400, "Bad Request: chat_id is empty")
+
+        chat_id = int(params["chat_id"])
+        if chat_id in blocked:
+            stats["blocked"] += 1
+            return error(403, "Forbidden: bot was blocked by the user")
+        chat = chats.get(chat_id)
+        if chat is None:
+            chat = chats[chat_id] = TokenBucket(chat_rate, chat_burst)
+        if not chat.try_acquire() or not bucket.try_acquire():
+            stats["throttled"] += 1
+            return error(429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after)
+
+        if method == "sendPhoto":
+            file_id = await photo(params["photo"])
+            stats["sent"] += 1
+            return web.json_response({"ok": True, "result": message(
+                chat_id, photo=photo_sizes(file_id), caption=params.get("caption", ""),
+            )})
+        if method == "sendMediaGroup":
+            group = json.loads(params["media"])
+            if not 2 <= len(group) <= 10:
+                return error(400, "Bad Request: wrong number of media in the group")
+            result = []
+            for item in group:
+                file_id = await photo(item["media"])
+                stats["sent"] += 1
+                result.append(message(
+                    chat_id, photo=photo_sizes(file_id), caption=item.get("caption", ""),
+                    media_group_id="1",
+                ))
+            return web.json_response({"ok": True, "result": result})
+
+        fields = {"text": params.get("text", "")}
+        if "reply_markup" in params:
+            fields["reply_markup"] = json.loads(params["reply_markup"])
+        if method.startswith("edit"):
+            stats["edited"] += 1
+            return web.json_response({"ok": True, "result": message(
+                chat_id, int(params["message_id"]), **fields
+            )})
+        stats["sent"] += 1
+        return web.json_response({"ok": True, "result": message(chat_id, **fields)})
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/bot{token}/{method}", api)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8082
+    print(f"🧪 Фейковый Telegram Bot API на http://localhost:{port}")
+    web.run_app(create_app(), port=port)
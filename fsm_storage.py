@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+FSM-хранилища для бота ReloCompass
+Незавершенный onboarding переживает перезапуск и доступен нескольким процессам бота
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+# Брошенные сессии onboarding удаляются через неделю
+FSM_TTL = int(os.getenv('FSM_TTL', 7 * 24 * 3600))
+# Сколько состояний хранилище в базе держит в памяти (0 - читать из базы)
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10000))
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    FSM-хранилище в таблице bot_fsm_states (db - слой database)
+
+    Горячие состояния лежат в памяти (LRU), изменения пишутся в базу
+    пачками в фоне, записи старше ttl считаются брошенными и удаляются.
+    С cache_size=0 сохраненные записи всегда читаются из базы (состояния
+    пишут несколько процессов, см. workers.py).
+    """
+
+    def __init__(self, db, ttl=FSM_TTL, cache_size=FSM_CACHE_SIZE,
+                 batch_size=100, flush_interval=0.5):
+        self.db = db
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        # key -> [state, data, touched_at]
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._flush_task = None
+        # Пачки пишутся по очереди: более старая не перезапишет более новую
+        self._flush_lock = asyncio.Lock()
+        self._last_purge = 0.0
+
+    # Работа с кэшем
+
+    def _expired(self, touched_at):
+        return self.ttl and time.time() - touched_at > self.ttl
+
+    async def _load_row(self, key):
+        return await self.db.fetchone(
+            "SELECT state, data, updated_at FROM bot_fsm_states WHERE key = ?", (key,)
+        )
+
+    async def _entry(self, key: StorageKey):
+        """Запись из кэша, при промахе - из базы"""
+        db_key = self.key_builder.build(key)
+        entry = self._cache.get(db_key)
+        if entry is not None and not self.cache_size and db_key not in self._dirty:
+            # Без кэша: запись могла измениться в другом процессе
+            del self._cache[db_key]
+            entry = None
+        if entry is None:
+            row = await self._load_row(db_key)
+            # Пока читали базу, запись мог создать другой обработчик
+            entry = self._cache.get(db_key)
+        if entry is None:
+            if row is not None and not self._expired(row[2]):
+                entry = [row[0], json.loads(row[1]), row[2]]
+            else:
+                entry = [None, {}, time.time()]
+            self._cache[db_key] = entry
+            self._evict(keep=db_key)
+        elif self._expired(entry[2]):
+            entry[0], entry[1] = None, {}
+        self._cache.move_to_end(db_key)
+        return db_key, entry
+
+    def _evict(self, keep):
+        """Вытеснение давно не использованных записей (несохраненные не трогаем)"""
+        if len(self._cache) <= self.cache_size:
+            return
+        for db_key in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if db_key != keep and db_key not in self._dirty:
+                del self._cache[db_key]
+
+    async def _touch(self, db_key, entry):
+        entry[2] = time.time()
+        self._dirty.add(db_key)
+        if len(self._dirty) >= self.batch_size:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    # Запись в базу
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def _write_batch(self, upserts, deletes, purge_before):
+        async with self.db.transaction() as tx:
+            if upserts:
+                await tx.executemany(
+                    "INSERT INTO bot_fsm_states (key, state, data, updated_at) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                    "state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    upserts,
+                )
+            if deletes:
+                await tx.executemany(
+                    "DELETE FROM bot_fsm_states WHERE key = ?", deletes
+                )
+            if purge_before:
+                await tx.execute(
+                    "DELETE FROM bot_fsm_states WHERE updated_at < ?", (purge_before,)
+                )
+
+    async def flush(self):
+        """Сохранение накопленных изменений одной транзакцией"""
+        if not self._dirty and time.time() - self._last_purge < 60:
+            return
+        upserts, deletes = [], []
+        for db_key in self._dirty:
+            entry = self._cache.get(db_key)
+            if entry is None:
+                continue
+            state, data, touched_at = entry
+            if state is None and not data:
+                deletes.append((db_key,))
+            else:
+                upserts.append((db_key, state, json.dumps(data, ensure_ascii=False), touched_at))
+        self._dirty.clear()
+
+        purge_before = None
+        if self.ttl and time.time() - self._last_purge >= 60:
+            purge_before = time.time() - self.ttl
+            self._last_purge = time.time()
+
+        async with self._flush_lock:
+            await self._write_batch(upserts, deletes, purge_before)
+
+    # Интерфейс BaseStorage
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        db_key, entry = await self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        await self._touch(db_key, entry)
+
+    async def get_state(self, key: StorageKey):
+        _, entry = await self._entry(key)
+        return entry[0]
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        db_key, entry = await self._entry(key)
+        entry[1] = dict(data)
+        await self._touch(db_key, entry)
+
+    async def get_data(self, key: StorageKey):
+        _, entry = await self._entry(key)
+        return dict(entry[1])
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+
+def get_redis_url():
+    """URL Redis из переменных окружения"""
+    url = os.getenv('REDIS_URL')
+    if url:
+        return url
+    return "redis://{}:{}/{}".format(
+        os.getenv('REDIS_HOST', 'localhost'),
+        os.getenv('REDIS_PORT', '6379'),
+        os.getenv('REDIS_DB', '0'),
+    )
+
+
+def create_storage(backend=None, db=None):
+    """
+    Создание FSM-хранилища по переменной FSM_STORAGE (database, redis, memory)
+
+    database - таблица bot_fsm_states в базе бота db (прежнее значение sqlite
+    означает то же самое).
+    """
+    backend = backend or os.getenv('FSM_STORAGE', 'database')
+
+    if backend == 'redis':
+        from aiogram.fsm.storage.redis import RedisStorage
+        # Redis сам хранит состояния в памяти и удаляет их по TTL
+        return RedisStorage.from_url(
+            get_redis_url(),
+            key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True),
+            state_ttl=FSM_TTL,
+            data_ttl=FSM_TTL,
+        )
+    if backend in ('database', 'sqlite'):
+        return DatabaseStorage(db)
+    if backend == 'memory':
+        return MemoryStorage()
+
+    raise ValueError(f"Неизвестное FSM-хранилище: {backend}")
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Фотографии объектов в Telegram
+По URL Telegram заново скачивает картинку при каждой отправке. Поэтому каждая
+картинка отправляется по URL один раз, а полученный file_id сохраняется в
+property_image_files (и в LRU в памяти) - дальше фото уходят по file_id
+альбомом (media group) без скачивания.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from aiogram.types import InputMediaPhoto
+
+import database
+import sender
+
+logger = logging.getLogger(__name__)
+
+# Служебный чат, куда заранее загружаются фото без file_id (необязательно)
+IMAGE_CACHE_CHAT_ID = os.getenv('IMAGE_CACHE_CHAT_ID')
+# Сколько секунд список фото объекта живет в памяти (в админке могли добавить фото)
+IMAGES_TTL = 600
+# Telegram принимает в альбоме от 2 до 10 фото
+MEDIA_GROUP_LIMIT = 10
+
+# Фото объектов: главное первым, дальше по order
+SELECT_IMAGES_SQL = (
+    'SELECT i.property_id, i.id, i.image_url, f.file_id '
+    'FROM property_images i '
+    'LEFT JOIN property_image_files f ON f.image_id = i.id '
+    'WHERE i.property_id IN ({}) '
+    'ORDER BY i.property_id, i.is_primary DESC, i."order", i.id'
+)
+
+
+class Image:
+    """Фото объекта: id в property_images, URL и file_id, если уже загружено"""
+
+    __slots__ = ('id', 'url', 'file_id')
+
+    def __init__(self, image_id, url, file_id=None):
+        self.id = image_id
+        self.url = url
+        self.file_id = file_id
+
+    @property
+    def media(self):
+        return self.file_id or self.url
+
+
+class ImageStore:
+    """
+    Фото объектов с кэшем file_id
+
+    Список фото объекта читается из базы (db - слой database) одним запросом
+    сразу для всей страницы каталога и держится в LRU на cache_size объектов.
+    """
+
+    def __init__(self, db, cache_size=10000, ttl=IMAGES_TTL, cache_chat_id=IMAGE_CACHE_CHAT_ID,
+                 concurrency=4):
+        self.db = db
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.cache_chat_id = cache_chat_id
+        self.cache = OrderedDict()
+        self._uploads = asyncio.Semaphore(concurrency)
+        self._uploading = set()
+        self._tasks = set()
+
+    # Работа с базой
+
+    async def _load(self, property_ids):
+        found = {pid: [] for pid in property_ids}
+        rows = await self.db.fetch(
+            SELECT_IMAGES_SQL.format(', '.join('?' * len(property_ids))), property_ids
+        )
+        for property_id, image_id, url, file_id in rows:
+            found[property_id].append(Image(image_id, url, file_id))
+        return found
+
+    async def _save(self, files):
+        now = database.now()
+        await self.db.executemany(
+            "INSERT INTO property_image_files (image_id, file_id, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(image_id) DO UPDATE SET file_id = excluded.file_id, "
+            "updated_at = excluded.updated_at",
+            [(image_id, file_id, now) for image_id, file_id in files],
+        )
+
+    # Кэш
+
+    async def images(self, *property_ids):
+        """Фото объектов {id объекта: [Image, ...]}; недостающие - одним запросом"""
+        now = time.monotonic()
+        result, missing = {}, []
+        for pid in property_ids:
+            cached = self.cache.get(pid)
+            if cached is None or cached[1] < now:
+                missing.append(pid)
+            else:
+                self.cache.move_to_end(pid)
+                result[pid] = cached[0]
+        if missing:
+            loaded = await self._load(missing)
+            for pid, images in loaded.items():
+                self.cache[pid] = (images, now + self.ttl)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            result.update(loaded)
+        return result
+
+    async def remember(self, images, messages):
+        """file_id из ответа Telegram на отправку фото (в том же порядке)"""
+        files = []
+        for image, message in zip(images, messages):
+            if message.photo and image.file_id is None:
+                image.file_id = message.photo[-1].file_id
+                files.append((image.id, image.file_id))
+        if files:
+            await self._save(files)
+
+    # Отправка
+
+    async def send(self, bot, chat_id, property_id, caption=None):
+        """
+        Фото объекта одним альбомом (или одно фото); False, если фото нет
+
+        Фото без file_id идут по URL, их file_id запоминается из ответа.
+        """
+        images = (await self.images(property_id))[property_id][:MEDIA_GROUP_LIMIT]
+        if not images:
+            return False
+        if len(images) == 1:
+            messages = [await bot.send_photo(chat_id, images[0].media, caption=caption)]
+        else:
+            messages = await bot.send_media_group(chat_id, [
+                InputMediaPhoto(media=image.media, caption=caption if i == 0 else None)
+                for i, image in enumerate(images)
+            ])
+        await self.remember(images, messages)
+        return True
+
+    async def _upload(self, bot, image):
+        async with self._uploads:
+            if image.file_id is not None:
+                return
+            try:
+                with sender.priority(sender.BROADCAST):
+                    message = await bot.send_photo(self.cache_chat_id, image.url, disable_notification=True)
+                await self.remember([image], [message])
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить фото {image.url}: {e}")
+            finally:
+                self._uploading.discard(image.id)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def prefetch(self, bot, *property_ids):
+        """
+        Подготовка фото для страницы каталога в фоне: список фото - в память,
+        а фото без file_id (если задан IMAGE_CACHE_CHAT_ID) - параллельно
+        в служебный чат
+        """
+        self._spawn(self._prefetch(bot, property_ids))
+
+    async def _prefetch(self, bot, property_ids):
+        try:
+            found = await self.images(*property_ids)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать фото объектов: {e}")
+            return
+        if not self.cache_chat_id:
+            return
+        for images in found.values():
+            for image in images[:MEDIA_GROUP_LIMIT]:
+                if image.file_id is None and image.id not in self._uploading:
+                    self._uploading.add(image.id)
+                    self._spawn(self._upload(bot, image))
+
+    async def close(self):
+        await asyncio.gather(*self._tasks, return_exceptions=True)
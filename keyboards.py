@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Клавиатуры бота ReloCompass
+Статические клавиатуры собираются один раз и переиспользуются всеми обработчиками,
+клавиатуры из данных (регионы из bot_settings) пересобираются после invalidate(),
+который вызывается при изменении настроек.
+"""
+
+import logging
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from pydantic import ConfigDict
+
+from bot_settings import settings
+from callbacks import pack
+
+logger = logging.getLogger(__name__)
+
+
+class FrozenButton(InlineKeyboardButton):
+    """Кнопка, которую нельзя изменить (экземпляр общий для всех апдейтов)"""
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenKeyboard(InlineKeyboardMarkup):
+    """Клавиатура, которую нельзя изменить (экземпляр общий для всех апдейтов)"""
+    model_config = ConfigDict(frozen=True)
+
+
+def build_keyboard(rows):
+    """Клавиатура из списка строк [(текст, callback_data), ...]"""
+    return FrozenKeyboard(inline_keyboard=[
+        [FrozenButton(text=text, callback_data=data) for text, data in row]
+        for row in rows
+    ])
+
+
+# Регионы по умолчанию, если в bot_settings нет ключа "regions"
+DEFAULT_REGIONS = [
+    ("phuket", "🏝️ Пхукет"),
+    ("bali", "🌴 Бали"),
+    ("georgia", "🏔️ Грузия"),
+    ("turkey", "🏛️ Турция"),
+    ("cyprus", "🏖️ Кипр"),
+]
+
+
+def load_regions():
+    """Список регионов из bot_settings (JSON [[код, название], ...])"""
+    regions = settings.get("regions")
+    if regions:
+        try:
+            parsed = []
+            for code, title in regions:
+                # Код уходит в callback_data, название - в текст кнопки
+                if not (isinstance(code, str) and code and isinstance(title, str) and title):
+                    raise ValueError(f"ожидалась пара строк, получено {code!r}, {title!r}")
+                # Код без ':' и не длиннее лимита callback_data (иначе ValueError)
+                pack("region", code)
+                parsed.append((code, title))
+            return parsed
+        except (TypeError, ValueError) as e:
+            logger.error(f"Некорректный список регионов в bot_settings: {regions!r} ({e})")
+    return DEFAULT_REGIONS
+
+
+def region_codes():
+    """Коды регионов: допустимые аргументы кнопок region"""
+    return {code for code, _ in load_regions()}
+
+
+# Построители клавиатур
+def build_main_menu():
+    return build_keyboard([
+        [("🏠 Каталог недвижимости", "catalog")],
+        [("🛂 Виза-ассистент", "visa")],
+        [("📊 Статистика", "stats")],
+        [("❓ Помощь", "help")],
+    ])
+
+
+def build_stage_keyboard():
+    return build_keyboard([
+        [("🤔 Планирую переезд", "stage:planning")],
+        [("🔍 Ищу недвижимость", "stage:searching")],
+        [("💰 Готов к покупке", "stage:ready")],
+    ])
+
+
+def build_family_keyboard():
+    return build_keyboard([
+        [("👤 Один", "family:1")],
+        [("👥 2-3 человека", "family:2_3")],
+        [("👨‍👩‍👧‍👦 4+ человека", "family:4_plus")],
+    ])
+
+
+def build_budget_keyboard():
+    return build_keyboard([
+        [("💵 До $100K", "budget:100k")],
+        [("💰 $100K - $300K", "budget:300k")],
+        [("💎 $300K+", "budget:300k_plus")],
+    ])
+
+
+def build_region_keyboard():
+    return build_keyboard([
+        [(title, pack("region", code))] for code, title in load_regions()
+    ])
+
+
+def build_pager(prev_data=None, next_data=None, photos=(), contacts=()):
+    """
+    Листание каталога (собирается на каждую страницу, т.к. зависит от курсора)
+
+    photos, contacts - callback_data кнопок "фото" и "связаться с риелтором"
+    для объектов страницы по порядку.
+    """
+    nav = []
+    if prev_data:
+        nav.append(("◀️ Назад", prev_data))
+    if next_data:
+        nav.append(("Далее ▶️", next_data))
+    photo_row = [(f"📷 {i}", data) for i, data in enumerate(photos, 1)]
+    contact_row = [(f"✉️ {i}", data) for i, data in enumerate(contacts, 1)]
+    return build_keyboard(
+        [row for row in (photo_row, contact_row, nav, [("🏠 Главное меню", "menu")]) if row]
+    )
+
+
+class KeyboardRegistry:
+    """Реестр клавиатур: каждая собирается при первом запросе и кэшируется"""
+
+    def __init__(self):
+        self._builders = {}
+        self._cache = {}
+
+    def register(self, name, builder):
+        """Регистрация построителя клавиатуры"""
+        self._builders[name] = builder
+        self._cache.pop(name, None)
+
+    def get(self, name):
+        """Общий экземпляр клавиатуры"""
+        keyboard = self._cache.get(name)
+        if keyboard is None:
+            keyboard = self._cache[name] = self._builders[name]()
+        return keyboard
+
+    def invalidate(self, name=None):
+        """Сброс кэша клавиатуры (или всех), когда изменились ее данные"""
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(name, None)
+
+    def warm(self):
+        """Сборка всех клавиатур заранее (при старте бота)"""
+        for name in self._builders:
+            self.get(name)
+
+
+registry = KeyboardRegistry()
+registry.register("main_menu", build_main_menu)
+registry.register("stage", build_stage_keyboard)
+registry.register("family", build_family_keyboard)
+registry.register("budget", build_budget_keyboard)
+registry.register("region", build_region_keyboard)
+
+
+def _settings_changed(keys):
+    if "regions" in keys:
+        registry.invalidate("region")
+
+
+settings.on_change(_settings_changed)
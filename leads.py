@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Заявки пользователей ("связаться с риелтором") в таблицу leads
+Повторная доставка апдейта и двойное нажатие кнопки не должны давать
+второй лид: id лида выводится из update_id, пользователя и объекта (повтор
+того же апдейта дает тот же id), а недавние заявки пользователя на объект
+проверяются сначала в памяти, затем в базе за окно LEAD_DEDUP_WINDOW.
+Лиды пишутся пачками в фоне одной транзакцией вместе со счетчиками
+статистики и ставятся в очередь выгрузки в AmoCRM.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import database
+import stats
+from profiles import USERS_LOCK
+
+logger = logging.getLogger(__name__)
+
+# Повторная заявка того же пользователя на тот же объект в этом окне - дубль (секунды)
+LEAD_DEDUP_WINDOW = float(os.getenv('LEAD_DEDUP_WINDOW', 86400))
+LEAD_SOURCE = "telegram"
+LEAD_STATUS = "new"
+
+# Пространство имен для id лидов из ключа идемпотентности
+LEAD_NAMESPACE = uuid.UUID('6f2d6c1e-5b8a-4c1e-9d3f-2a7e8b4c0d15')
+
+INSERT_LEAD_SQL = (
+    "INSERT INTO leads (id, source, message, status, amo_crm_id, amo_crm_url, "
+    "created_at, updated_at, property_id, user_id) "
+    "VALUES (?, ?, ?, ?, '', '', ?, ?, ?, ?) ON CONFLICT(id) DO NOTHING"
+)
+
+# Недавний лид пользователя на объект; по индексу leads.user_id, не больше одной строки.
+# Заявка без объекта ищется через IS NULL (PostgreSQL не сравнивает через IS параметр)
+RECENT_LEAD_SQL = (
+    "SELECT id FROM leads WHERE user_id = ? AND property_id = ? AND source = ? "
+    "AND created_at >= ? LIMIT 1"
+)
+RECENT_LEAD_NO_PROPERTY_SQL = (
+    "SELECT id FROM leads WHERE user_id = ? AND property_id IS NULL AND source = ? "
+    "AND created_at >= ? LIMIT 1"
+)
+
+# Пользователь без профиля (заявка раньше onboarding)
+INSERT_USER_SQL = (
+    "INSERT INTO telegram_users (telegram_id, username, first_name, last_name, "
+    "stage, region, is_active, created_at, updated_at) VALUES (?, ?, ?, ?, '', '', TRUE, ?, ?) "
+    "ON CONFLICT(telegram_id) DO NOTHING RETURNING id"
+)
+
+
+def lead_id(update_id, telegram_id, property_id):
+    """id лида из ключа идемпотентности: один апдейт - один лид"""
+    return uuid.uuid5(LEAD_NAMESPACE, f"{update_id}:{telegram_id}:{property_id or ''}").hex
+
+
+class LeadCapture:
+    """
+    Прием заявок с отсевом дублей и пакетной записью (write-behind)
+
+    capture() не ждет базу: дубль отсеивается по недавним заявкам в памяти,
+    новая заявка попадает в буфер. Запись идет пачками раз в flush_interval
+    секунд или по batch_size заявок; в транзакции записи каждая заявка
+    еще раз проверяется по базе (заявки из других процессов и до перезапуска).
+    db - слой database.
+    """
+
+    def __init__(self, db, exporter=None, profiles=None, window=LEAD_DEDUP_WINDOW,
+                 batch_size=200, flush_interval=0.5, recent_size=100000):
+        self.db = db
+        self.exporter = exporter
+        # Профиль пользователя пишется раньше его лида (см. flush)
+        self.profiles = profiles
+        self.window = window
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.recent_size = recent_size
+
+        self.created = 0
+        self.duplicates = 0
+        # (telegram_id, property_id) -> (id лида, время заявки), старые вытесняются первыми
+        self._recent = OrderedDict()
+        # id лида -> строка для записи
+        self._buffer = {}
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._pending = set()
+
+    async def start(self):
+        """Запуск периодической записи"""
+        self._timer = asyncio.create_task(self._flush_periodically())
+
+    def _recent_lead(self, key, now):
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        if now - entry[1] > self.window:
+            del self._recent[key]
+            return None
+        return entry[0]
+
+    def capture(self, update_id, user, property_id=None, message=''):
+        """
+        Заявка пользователя Telegram на объект (без ожидания записи)
+
+        Возвращает (id лида, True), если заявка новая, или (id прежнего лида,
+        False), если это дубль.
+        """
+        now = time.time()
+        key = (user.id, property_id)
+        existing = self._recent_lead(key, now)
+        if existing is not None:
+            self.duplicates += 1
+            return existing, False
+        new_id = lead_id(update_id, user.id, property_id)
+        self._recent[key] = (new_id, now)
+        self._recent.move_to_end(key)
+        if len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+
+        timestamp = database.now()
+        self._buffer[new_id] = (
+            new_id, user.id, user.username or '', user.first_name or '', user.last_name or '',
+            property_id, message, timestamp,
+        )
+        if len(self._buffer) >= self.batch_size:
+            task = asyncio.create_task(self.flush())
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+        return new_id, True
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи лидов: {e}")
+
+    async def _select_users(self, tx, ids):
+        users = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            users.update((telegram_id, tuple(rest)) for telegram_id, *rest in await tx.fetch(
+                "SELECT telegram_id, id, region, stage FROM telegram_users "
+                f"WHERE telegram_id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ))
+        return users
+
+    async def _users(self, tx, rows, rollup):
+        """telegram_id -> (id, регион, стадия); пользователи без профиля создаются"""
+        users = await self._select_users(tx, list({row[1] for row in rows}))
+        for _, telegram_id, username, first_name, last_name, _, _, timestamp in rows:
+            if telegram_id in users:
+                continue
+            row = await tx.fetchone(
+                INSERT_USER_SQL, (telegram_id, username, first_name, last_name, timestamp, timestamp),
+            )
+            if row is None:
+                # Пользователя только что создала админка
+                users.update(await self._select_users(tx, [telegram_id]))
+                continue
+            users[telegram_id] = (row[0], '', '')
+            rollup.add(stats.day(timestamp), '', '', users=1)
+        return users
+
+    async def _write(self, rows):
+        """Запись лидов, которых еще нет в базе; возвращает id записанных"""
+        since = (datetime.now(timezone.utc) - timedelta(seconds=self.window)).strftime('%Y-%m-%d %H:%M:%S.%f')
+        created = []
+        # Блокировка до проверок: другой процесс не вставит тот же лид между ними
+        async with self.db.transaction(lock=USERS_LOCK) as tx:
+            rollup = stats.Rollup()
+            users = await self._users(tx, rows, rollup)
+            for new_id, telegram_id, _, _, _, property_id, message, timestamp in rows:
+                user_id, region, stage = users[telegram_id]
+                if property_id is None:
+                    recent = await tx.fetchone(RECENT_LEAD_NO_PROPERTY_SQL, (user_id, LEAD_SOURCE, since))
+                else:
+                    recent = await tx.fetchone(RECENT_LEAD_SQL, (user_id, property_id, LEAD_SOURCE, since))
+                if recent:
+                    continue
+                inserted = await tx.execute(INSERT_LEAD_SQL, (
+                    new_id, LEAD_SOURCE, message, LEAD_STATUS, timestamp, timestamp, property_id, user_id,
+                ))
+                if inserted:
+                    created.append(new_id)
+                    rollup.add(stats.day(timestamp), region, stage, LEAD_STATUS, leads=1)
+            await rollup.apply(tx)
+        return created
+
+    async def flush(self):
+        """Запись накопленных заявок одной транзакцией и постановка в очередь AmoCRM"""
+        async with self._lock:
+            if not self._buffer:
+                return
+            if self.profiles is not None:
+                await self.profiles.flush()
+            rows = list(self._buffer.values())
+            self._buffer.clear()
+            try:
+                created = await self._write(rows)
+            except Exception:
+                for row in rows:
+                    self._buffer.setdefault(row[0], row)
+                raise
+            self.created += len(created)
+            self.duplicates += len(rows) - len(created)
+            if created:
+                logger.info(f"Сохранено лидов: {len(created)}")
+                if self.exporter is not None:
+                    await self.exporter.enqueue(*created)
+
+    async def close(self):
+        """Остановка: дописываем заявки из буфера"""
+        if self._timer is not None:
+            self._timer.cancel()
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Подбор объектов под профиль пользователя
+Все активные объекты региона оцениваются разом векторными операциями NumPy:
+попадание в бюджет, спальни под размер семьи, релокантам, мебель, интернет,
+RED Experts и буст. Ответов onboarding немного (регион x стадия x семья x
+бюджет - несколько десятков сочетаний), поэтому лучшие объекты запоминаются
+по сочетанию и пересчитываются только после изменения региона в каталоге
+(в том числе окончания буста, см. Catalog.versions).
+"""
+
+import logging
+from collections import OrderedDict, namedtuple
+
+from catalog import min_bedrooms_for
+
+try:
+    import numpy as np
+except ImportError:
+    # Без NumPy рекомендации - это первые объекты каталога по приоритету
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Вклад каждого признака в оценку объекта
+WEIGHTS = {
+    'budget': 3.0,
+    'bedrooms': 2.0,
+    'relocants': 1.0,
+    'furniture': 0.5,
+    'internet': 0.5,
+    'red': 1.5,
+    'boost': 0.75,
+}
+
+# Стадия "готов к переезду": мебель важнее
+FURNITURE_BY_STAGE = {'ready': 2.0}
+
+Candidates = namedtuple('Candidates', [
+    'ids', 'prices', 'bedrooms', 'red', 'boosted', 'relocants', 'furniture', 'internet',
+])
+
+
+def score(candidates, budget=None, family_members=None, stage=None):
+    """Оценки объектов региона под профиль (массив той же длины, что candidates.ids)"""
+    prices = candidates.prices
+    scores = np.zeros(len(prices))
+
+    if budget is not None:
+        low, high = budget
+        fit = np.ones(len(prices))
+        if high is not None:
+            # Дороже бюджета на 50% и больше - не подходит совсем
+            fit = np.clip(1 - 2 * (prices - high) / high, 0, 1)
+        if low:
+            # Дешевле ожидаемого - подходит, но хуже
+            fit = np.where(prices < low, 0.7, fit)
+        scores += WEIGHTS['budget'] * fit
+
+    need = min_bedrooms_for(family_members)
+    if need is not None:
+        bedrooms = candidates.bedrooms
+        fit = np.where(
+            bedrooms >= need, 1.0,
+            np.where(bedrooms < 0, 0.5, np.clip(1 - 0.4 * (need - bedrooms), 0, 1)),
+        )
+        scores += WEIGHTS['bedrooms'] * fit
+
+    scores += WEIGHTS['relocants'] * candidates.relocants
+    scores += WEIGHTS['furniture'] * FURNITURE_BY_STAGE.get(stage, 1.0) * candidates.furniture
+    scores += WEIGHTS['internet'] * candidates.internet
+    scores += WEIGHTS['red'] * candidates.red
+    scores += WEIGHTS['boost'] * candidates.boosted
+    return scores
+
+
+class Matcher:
+    """
+    Рекомендации по каталогу с запоминанием по сочетанию ответов
+
+    Массивы региона строятся один раз на версию региона в каталоге
+    (Catalog.versions меняется при изменении объектов региона и окончании
+    буста); запомненные рекомендации привязаны к той же версии.
+    """
+
+    def __init__(self, catalog, cache_size=1000):
+        self.catalog = catalog
+        self.cache_size = cache_size
+        # регион -> (версия региона, Candidates)
+        self.candidates = {}
+        self.recommendations = OrderedDict()
+
+    def _candidates(self, region, version):
+        cached = self.candidates.get(region)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        index = self.catalog.regions.get(region)
+        if index is None or not len(index):
+            return None
+        listings = [self.catalog.listings[pid] for pid in index.ids]
+        candidates = Candidates(
+            ids=index.ids[:],
+            prices=np.array(index.prices, dtype=np.float64),
+            bedrooms=np.array(index.bedrooms, dtype=np.int16),
+            red=np.array(index.red, dtype=bool),
+            boosted=np.array(index.boosted, dtype=bool),
+            relocants=np.fromiter((listing.is_for_relocants for listing in listings), bool, len(listings)),
+            furniture=np.fromiter((listing.has_furniture for listing in listings), bool, len(listings)),
+            internet=np.fromiter((listing.good_internet for listing in listings), bool, len(listings)),
+        )
+        self.candidates[region] = (version, candidates)
+        return candidates
+
+    def recommend(self, region, budget=None, family_members=None, stage=None, limit=3):
+        """Лучшие объекты под профиль: список (объект, оценка)"""
+        if np is None:
+            min_bedrooms = min_bedrooms_for(family_members)
+            return [(listing, None) for listing in self.catalog.search(region, budget, min_bedrooms, limit)]
+
+        version = self.catalog.versions.get(region)
+        key = (region, budget, family_members, stage, limit, version)
+        cached = self.recommendations.get(key)
+        if cached is not None:
+            self.recommendations.move_to_end(key)
+            return cached
+
+        candidates = self._candidates(region, version)
+        if candidates is None:
+            return []
+        scores = score(candidates, budget, family_members, stage)
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(len(scores))
+        # Лучшая оценка первой, при равной - дешевле
+        top = top[np.lexsort((candidates.prices[top], -scores[top]))]
+        result = [(self.catalog.listings[candidates.ids[i]], float(scores[i])) for i in top]
+
+        self.recommendations[key] = result
+        if len(self.recommendations) > self.cache_size:
+            self.recommendations.popitem(last=False)
+        return result
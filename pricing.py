@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Курсы валют для сравнения цен объектов с бюджетом в USD
+Курсы хранятся в таблице exchange_rates (обновляет админ командой
+python manage.py exchange_rates) и держатся в памяти. Каталог переводит
+цену каждого объекта в USD один раз при загрузке и пересчитывает только
+объекты в валютах, курс которых изменился. Цена в USD округляется до
+цента, чтобы сравнение с границей бюджета не зависело от погрешности float.
+"""
+
+import logging
+from decimal import ROUND_HALF_UP, Decimal
+
+logger = logging.getLogger(__name__)
+
+BASE_CURRENCY = 'USD'
+CENT = Decimal('0.01')
+
+# USD за единицу валюты, пока в exchange_rates нет своего курса
+DEFAULT_RATES = {
+    'USD': 1.0,
+    'EUR': 1.08,
+    'THB': 0.028,
+    'IDR': 0.000063,
+    'GEL': 0.37,
+    'TRY': 0.03,
+    'RUB': 0.011,
+}
+
+
+SELECT_RATES_SQL = "SELECT currency, usd_rate, updated_at FROM exchange_rates"
+
+
+class ExchangeRates:
+    """Курсы в памяти с подгрузкой изменений из exchange_rates (db - слой database)"""
+
+    def __init__(self, db):
+        self.db = db
+        self.rates = dict(DEFAULT_RATES)
+        self.updated_at = ''
+        self._unknown = set()
+
+    async def _fetch(self, since):
+        if not since:
+            return await self.db.fetch(SELECT_RATES_SQL)
+        return await self.db.fetch(SELECT_RATES_SQL + " WHERE updated_at > ?", (since,))
+
+    def apply(self, rows):
+        """Применение строк exchange_rates; возвращает валюты, курс которых изменился"""
+        changed = set()
+        for currency, usd_rate, updated_at in rows:
+            if self.rates.get(currency) != usd_rate:
+                self.rates[currency] = usd_rate
+                changed.add(currency)
+            self.updated_at = max(self.updated_at, updated_at)
+        return changed
+
+    async def refresh(self):
+        """Подгрузка новых курсов; возвращает валюты, курс которых изменился"""
+        changed = self.apply(await self._fetch(self.updated_at))
+        if changed:
+            logger.info(f"Курсы валют обновлены: {', '.join(sorted(changed))}")
+        return changed
+
+    def to_usd(self, price, currency):
+        """
+        Цена в USD с точностью до цента; None, если курса валюты нет
+
+        Объекты без цены в USD не попадают в подбор по бюджету, пока курс
+        не появится в exchange_rates (в том числе с пустой валютой из фида).
+        """
+        rate = self.rates.get(currency)
+        if rate is None:
+            if currency not in self._unknown:
+                self._unknown.add(currency)
+                logger.warning(f"Нет курса для {currency!r}, объекты в этой валюте не попадают в выдачу")
+            return None
+        usd = Decimal(str(price)) * Decimal(str(rate))
+        return float(usd.quantize(CENT, rounding=ROUND_HALF_UP))
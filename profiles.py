@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Сохранение профилей пользователей в telegram_users
+Профили копятся в буфере и пишутся в базу пачками в фоне,
+так что обработчики бота не ждут записи.
+"""
+
+import asyncio
+import logging
+
+import database
+import stats
+
+logger = logging.getLogger(__name__)
+
+# Размер семьи из ответа onboarding
+FAMILY_MEMBERS = {
+    "1": 1,
+    "2_3": 3,
+    "4_plus": 4,
+}
+
+# Бюджет из ответа onboarding: (от, до) в USD, None - без ограничения.
+# В telegram_users.budget хранится нижняя граница диапазона.
+BUDGET_RANGES = {
+    "100k": (0, 100000),
+    "300k": (100000, 300000),
+    "300k_plus": (300000, None),
+}
+
+UPSERT_SQL = (
+    "INSERT INTO telegram_users (telegram_id, username, first_name, last_name, "
+    "stage, family_members, budget, region, is_active, created_at, updated_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, TRUE, ?, ?) "
+    "ON CONFLICT(telegram_id) DO UPDATE SET "
+    "username = excluded.username, first_name = excluded.first_name, "
+    "last_name = excluded.last_name, stage = excluded.stage, "
+    "family_members = excluded.family_members, budget = excluded.budget, "
+    "region = excluded.region, is_active = TRUE, updated_at = excluded.updated_at"
+)
+
+# Общая блокировка транзакций, которые читают и пишут telegram_users
+# (профили и лиды): счетчики статистики считаются от прочитанных значений
+USERS_LOCK = 'telegram_users'
+
+
+def profile_row(user, user_data):
+    """Строка telegram_users из пользователя Telegram и ответов onboarding"""
+    budget = BUDGET_RANGES.get(user_data.get('budget'))
+    timestamp = database.now()
+    return (
+        user.id,
+        user.username or '',
+        user.first_name or '',
+        user.last_name or '',
+        user_data.get('stage', ''),
+        FAMILY_MEMBERS.get(user_data.get('family')),
+        budget[0] if budget else None,
+        user_data.get('region', ''),
+        timestamp,
+        timestamp,
+    )
+
+
+class ProfileWriter:
+    """
+    Буфер профилей с пакетной записью (write-behind)
+
+    Запись запускается, когда в буфере набралось batch_size профилей
+    или прошло flush_interval секунд. При остановке бота буфер сбрасывается.
+    db - слой database.
+    """
+
+    def __init__(self, db, batch_size=500, flush_interval=1.0):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # telegram_id -> строка; повторный onboarding заменяет профиль в буфере
+        self._buffer = {}
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._pending = set()
+
+    async def start(self):
+        """Запуск периодической записи"""
+        self._timer = asyncio.create_task(self._flush_periodically())
+
+    def add(self, user, user_data):
+        """Добавление профиля в буфер (без ожидания записи)"""
+        row = profile_row(user, user_data)
+        self._buffer[row[0]] = row
+        if len(self._buffer) >= self.batch_size:
+            task = asyncio.create_task(self.flush())
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи профилей: {e}")
+
+    async def _rollup(self, tx, rows):
+        """
+        Изменения статистики: новые пользователи и смена региона или стадии
+
+        Лиды пользователя, сменившего регион или стадию, переносятся вместе
+        с ним: так же их считает stats --backfill.
+        """
+        rollup = stats.Rollup()
+        ids = [row[0] for row in rows]
+        existing = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            existing.update((telegram_id, rest) for telegram_id, *rest in await tx.fetch(
+                "SELECT telegram_id, region, stage, created_at FROM telegram_users "
+                f"WHERE telegram_id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ))
+        moved = {}
+        for row in rows:
+            region, stage = row[7], row[4]
+            old = existing.get(row[0])
+            if old is None:
+                rollup.add(stats.day(row[-2]), region, stage, users=1)
+            elif (old[0], old[1]) != (region, stage):
+                rollup.move_user(stats.day(old[2]), (old[0], old[1]), (region, stage))
+                moved[row[0]] = ((old[0], old[1]), (region, stage))
+        ids = list(moved)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for telegram_id, created_at, lead_status in await tx.fetch(
+                "SELECT u.telegram_id, l.created_at, l.status FROM leads l "
+                "JOIN telegram_users u ON u.id = l.user_id "
+                f"WHERE u.telegram_id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ):
+                rollup.move_lead(stats.day(created_at), lead_status, *moved[telegram_id])
+        return rollup
+
+    async def _write(self, rows):
+        # Профили и счетчики статистики - одной транзакцией; прежние значения
+        # профилей читаются уже под блокировкой записи
+        async with self.db.transaction(lock=USERS_LOCK) as tx:
+            rollup = await self._rollup(tx, rows)
+            await tx.executemany(UPSERT_SQL, rows)
+            await rollup.apply(tx)
+
+    async def flush(self):
+        """Запись накопленных профилей одной транзакцией"""
+        async with self._lock:
+            if not self._buffer:
+                return
+            rows = list(self._buffer.values())
+            self._buffer.clear()
+            try:
+                await self._write(rows)
+            except Exception:
+                # Возвращаем профили в буфер, если их не обновили заново
+                for row in rows:
+                    self._buffer.setdefault(row[0], row)
+                raise
+            logger.info(f"Сохранено профилей: {len(rows)}")
+
+    async def close(self):
+        """Остановка: дописываем все, что осталось в буфере"""
+        if self._timer is not None:
+            self._timer.cancel()
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        await self.flush()
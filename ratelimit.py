@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Ограничение частоты запросов (token bucket)
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше capacity за раз
+
+    try_acquire() не ждет и подходит для горячего пути,
+    acquire() ждет, пока токен появится.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1, now=None):
+        """Взять токены, если они есть"""
+        self._refill(now or time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens=1):
+        """Через сколько секунд появятся токены"""
+        self._refill(time.monotonic())
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Опустошить ведро на seconds секунд (например, после 429 с retry_after)"""
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    async def acquire(self, tokens=1):
+        """Дождаться и взять токены"""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
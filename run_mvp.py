@@ -1,13 +1,34 @@
 #!/usr/bin/env python3
 """
 Скрипт запуска ReloCompass MVP
-Запускает Django админку и Telegram бота
+Запускает Django админку и Telegram бота под супервизором на asyncio:
+вывод процессов читается построчно и печатается с префиксом (дочерний
+процесс не блокируется на переполненном pipe), готовность проверяется
+пробами (HTTP-запрос к Django, сигнал бота через READY_FD после getMe),
+упавший процесс перезапускается с нарастающей паузой, по Ctrl+C / SIGTERM
+процессы останавливаются корректно.
 """
 
-import subprocess
-import time
-import sys
+import asyncio
 import os
+import signal
+import sys
+import time
+
+DJANGO_HOST = '127.0.0.1'
+DJANGO_PORT = int(os.getenv('DJANGO_PORT', 8000))
+# Процессов-обработчиков бота (см. workers.py); 1 - один процесс bot_simple.py
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 1))
+# Сколько ждать готовности сервиса при запуске (секунды)
+READY_TIMEOUT = float(os.getenv('READY_TIMEOUT', 60))
+# Пауза перед перезапуском упавшего процесса: от MIN до MAX, удваивается
+RESTART_BACKOFF_MIN = 1.0
+RESTART_BACKOFF_MAX = 30.0
+# Процесс, проработавший дольше, считается стабильным: пауза сбрасывается
+STABLE_AFTER = 60.0
+# Сколько ждать завершения процесса после SIGTERM
+STOP_TIMEOUT = 10.0
+
 
 def print_banner():
     """Вывод баннера"""
@@ -17,129 +38,262 @@ def print_banner():
 🚀 Быстрый запуск без Docker
 """)
 
-def start_django():
-    """Запуск Django сервера"""
-    print("🌐 Запуск Django админки...")
-    try:
-        process = subprocess.Popen([
-            sys.executable, "manage.py", "runserver", "8000"
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
-        # Ждем немного для запуска
-        time.sleep(3)
-        
-        if process.poll() is None:
-            print("✅ Django админка запущена на http://localhost:8000")
-            print("   Логин: admin")
-            print("   Пароль: admin123")
-            return process
-        else:
-            print("❌ Django не удалось запустить")
-            return None
-            
-    except Exception as e:
-        print(f"❌ Ошибка запуска Django: {e}")
-        return None
 
-def start_bot():
-    """Запуск Telegram бота"""
-    print("🤖 Запуск Telegram бота...")
-    try:
-        process = subprocess.Popen([
-            sys.executable, "bot_simple.py"
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
-        # Ждем немного для запуска
-        time.sleep(2)
-        
-        if process.poll() is None:
-            print("✅ Telegram бот запущен")
-            return process
-        else:
-            print("❌ Бот не удалось запустить")
-            return None
-            
-    except Exception as e:
-        print(f"❌ Ошибка запуска бота: {e}")
-        return None
+async def http_probe(host, port, path='/', interval=0.1):
+    """Ждет, пока сервер ответит на HTTP-запрос (любой статус)"""
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            await asyncio.sleep(interval)
+            continue
+        try:
+            writer.write(f"GET {path} HTTP/1.0\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            status = await reader.readline()
+            if status.startswith(b"HTTP/"):
+                return status.decode().strip()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+        await asyncio.sleep(interval)
+
+
+class Service:
+    """
+    Дочерний процесс под супервизором
+
+    probe - 'http' (ждать ответа Django) или 'ready_fd' (процесс пишет
+    строку в дескриптор из переменной READY_FD, когда готов).
+    """
+
+    def __init__(self, name, args, probe=None, env=None):
+        self.name = name
+        self.args = args
+        self.probe = probe
+        self.env = env or {}
+        self.process = None
+        self.ready = asyncio.Event()
+        self.restarts = 0
+        self._stopping = False
+
+    async def _stream(self, stream):
+        """
+        Печать вывода процесса с префиксом, пока процесс не закроет pipe
+
+        Строка длиннее лимита StreamReader (64 КиБ) печатается частями:
+        readline() на ней падает, вывод перестал бы читаться, и процесс
+        встал бы на переполненном pipe.
+        """
+        prefix = f"[{self.name}]"
+        while True:
+            try:
+                line = await stream.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                # Последняя строка без перевода строки
+                line = e.partial
+            except asyncio.LimitOverrunError as e:
+                line = await stream.read(e.consumed)
+            if not line:
+                return
+            print(prefix, line.decode(errors='replace').rstrip(), flush=True)
+
+    async def _wait_ready_fd(self, read_fd):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, 'rb')
+        )
+        try:
+            line = await reader.readline()
+            if not line:
+                raise RuntimeError("процесс завершился, не сообщив о готовности")
+            return line.decode().strip()
+        finally:
+            transport.close()
+
+    async def _spawn(self):
+        env = {**os.environ, 'PYTHONUNBUFFERED': '1', **self.env}
+        pass_fds = ()
+        read_fd = None
+        if self.probe == 'ready_fd':
+            read_fd, write_fd = os.pipe()
+            env['READY_FD'] = str(write_fd)
+            pass_fds = (write_fd,)
+        self.process = await asyncio.create_subprocess_exec(
+            *self.args, env=env, pass_fds=pass_fds,
+            # Свой сеанс: Ctrl+C в терминале получает только супервизор и сам останавливает процессы
+            start_new_session=os.name != 'nt',
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        )
+        if read_fd is not None:
+            # Свой конец pipe закрываем, чтобы увидеть EOF, если процесс упадет
+            os.close(write_fd)
+        return read_fd
+
+    async def _probe(self, read_fd):
+        if self.probe == 'http':
+            return await http_probe(DJANGO_HOST, DJANGO_PORT, '/admin/login/')
+        if self.probe == 'ready_fd':
+            return await self._wait_ready_fd(read_fd)
+        return ''
+
+    async def run(self):
+        """Запуск и перезапуск процесса, пока не вызван stop()"""
+        backoff = RESTART_BACKOFF_MIN
+        while not self._stopping:
+            started = time.monotonic()
+            read_fd = await self._spawn()
+            if self._stopping:
+                # stop() пришел, пока процесс запускался
+                self.process.terminate()
+            output = asyncio.create_task(self._stream(self.process.stdout))
+            probe = asyncio.create_task(self._probe(read_fd))
+            exited = asyncio.create_task(self.process.wait())
+            done, _ = await asyncio.wait({probe, exited}, timeout=READY_TIMEOUT,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                print(f"⚠️ {self.name} не готов за {READY_TIMEOUT:.0f} с, продолжаем ждать")
+                done, _ = await asyncio.wait({probe, exited}, return_when=asyncio.FIRST_COMPLETED)
+            if probe in done and not probe.exception():
+                self.ready.set()
+                print(f"✅ {self.name} готов за {time.monotonic() - started:.1f} с {probe.result()}".rstrip())
+            probe.cancel()
+
+            code = await exited
+            await output
+            if self._stopping:
+                return
+            if time.monotonic() - started > STABLE_AFTER:
+                backoff = RESTART_BACKOFF_MIN
+            self.restarts += 1
+            print(f"❌ {self.name} завершился с кодом {code}, перезапуск через {backoff:g} с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+
+    async def stop(self):
+        """SIGTERM и ожидание завершения; по таймауту - SIGKILL"""
+        self._stopping = True
+        process = self.process
+        if process is None or process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"⚠️ {self.name} не остановился за {STOP_TIMEOUT:.0f} с, завершаем принудительно")
+            process.kill()
+            await process.wait()
+        print(f"✅ {self.name} остановлен")
+
+
+class Supervisor:
+    """Запуск сервисов по порядку (следующий - после готовности предыдущего)"""
+
+    def __init__(self, services):
+        self.services = services
+        self._stop = asyncio.Event()
+
+    def request_stop(self):
+        self._stop.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows: Ctrl+C прервет asyncio.run, остановка - в finally
+                pass
+
+        tasks = []
+        try:
+            for service in self.services:
+                tasks.append(asyncio.create_task(service.run()))
+                ready = asyncio.create_task(service.ready.wait())
+                stop = asyncio.create_task(self._stop.wait())
+                await asyncio.wait({ready, stop}, return_when=asyncio.FIRST_COMPLETED)
+                ready.cancel()
+                stop.cancel()
+                if self._stop.is_set():
+                    break
+            else:
+                print_ready()
+            await self._stop.wait()
+        finally:
+            print("\n🛑 Остановка сервисов...")
+            # Останавливаем в обратном порядке: сначала бот, потом админку
+            for service in reversed(self.services):
+                await service.stop()
+            if tasks:
+                # Дочитываем вывод; сервисы в паузе перед перезапуском просто отменяем
+                _, pending = await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            print("👋 Все сервисы остановлены")
+
+
+def print_ready():
+    print("\n🎉 Все сервисы запущены!")
+    print("\n📱 Доступные сервисы:")
+    print(f"   🌐 Django админка: http://localhost:{DJANGO_PORT}/admin")
+    print("   🤖 Telegram бот: активен")
+    print("\n📋 Инструкции:")
+    print("   1. Откройте админку в браузере")
+    print("   2. Войдите с логином admin/admin123")
+    print("   3. Протестируйте бота командой /start")
+    print("\n🛑 Для остановки нажмите Ctrl+C")
+
+
+def create_services():
+    """Django админка и бот"""
+    return [
+        Service(
+            "django",
+            # Без автоперезагрузки: иначе runserver - это два процесса, и SIGTERM не доходит до сервера
+            [sys.executable, "manage.py", "runserver", "--noreload", f"{DJANGO_HOST}:{DJANGO_PORT}"],
+            probe='http',
+        ),
+        # Сигнал готовности через унаследованный дескриптор (на Windows недоступно);
+        # BOT_WORKERS > 1 - прием апдейтов и несколько процессов-обработчиков
+        Service(
+            "bot",
+            [sys.executable, "workers.py" if BOT_WORKERS > 1 else "bot_simple.py"],
+            probe='ready_fd' if os.name != 'nt' else None,
+        ),
+    ]
+
 
 def main():
     """Основная функция"""
     print_banner()
-    
+
     print("🔍 Проверка готовности...")
-    
+
     # Проверяем наличие файлов
     required_files = [
         "manage.py",
-        "bot_simple.py", 
+        "bot_simple.py",
         ".env",
         "requirements.txt"
     ]
-    
+
     for file in required_files:
         if os.path.exists(file):
             print(f"✅ {file}")
         else:
             print(f"❌ {file} не найден")
             return False
-    
+
     print("\n🚀 Запуск сервисов...")
-    
-    # Запускаем Django
-    django_process = start_django()
-    if not django_process:
-        return False
-    
-    # Запускаем бота
-    bot_process = start_bot()
-    if not bot_process:
-        django_process.terminate()
-        return False
-    
-    print("\n🎉 Все сервисы запущены!")
-    print("\n📱 Доступные сервисы:")
-    print("   🌐 Django админка: http://localhost:8000/admin")
-    print("   🤖 Telegram бот: активен")
-    print("\n📋 Инструкции:")
-    print("   1. Откройте админку в браузере")
-    print("   2. Войдите с логином admin/admin123")
-    print("   3. Протестируйте бота командой /start")
-    print("\n🛑 Для остановки нажмите Ctrl+C")
-    
     try:
-        # Ждем завершения процессов
-        while True:
-            time.sleep(1)
-            
-            # Проверяем статус процессов
-            if django_process.poll() is not None:
-                print("❌ Django остановлен")
-                break
-                
-            if bot_process.poll() is not None:
-                print("❌ Бот остановлен")
-                break
-                
+        asyncio.run(Supervisor(create_services()).run())
     except KeyboardInterrupt:
-        print("\n\n🛑 Остановка сервисов...")
-        
-        # Останавливаем Django
-        if django_process:
-            django_process.terminate()
-            django_process.wait(timeout=5)
-            print("✅ Django остановлен")
-        
-        # Останавливаем бота
-        if bot_process:
-            bot_process.terminate()
-            bot_process.wait(timeout=5)
-            print("✅ Бот остановлен")
-        
-        print("👋 Все сервисы остановлены")
-        return True
-    
-    return False
+        pass
+    return True
+
 
 if __name__ == "__main__":
     try:
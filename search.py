@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Поиск объектов по свободному тексту ("2 bedroom Canggu with good internet")
+Заголовок, описание, город и регион объекта разбиваются на слова с
+нормализацией (регистр, ё, простое отсечение окончаний русских и
+английских слов). Для каждого слова хранится множество объектов битовой
+маской (int, бит - слот объекта), такие же маски - у удобств (мебель,
+интернет, для релокантов), числа спален и региона. Запрос - это AND масок
+слов и условий, без прохода по всем объектам. Индекс обновляется вместе с
+каталогом (Catalog.apply), выдача упорядочена как в каталоге: RED Experts,
+буст, затем по цене.
+"""
+
+import re
+import time
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    # Без NumPy слоты результата извлекаются из маски на Python
+    np = None
+
+WORD_RE = re.compile(r"[0-9a-zа-я]+")
+# "2 bedroom", "3-bed", "2br", "2 спальни", "3 комнаты"
+BEDROOMS_RE = re.compile(r"\b(\d)\s*-?\s*(?:bed\w*|br\b|спал\w*|комн\w*)")
+
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых', 'их',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ом', 'ем', 'ах', 'ях', 'ов', 'ев', 'ью',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+EN_ENDINGS = ('ing', 'ed', 'es', 's')
+
+
+# Словарь объявлений невелик: основа каждого слова считается один раз
+@lru_cache(maxsize=200000)
+def stem(word):
+    """Основа слова: отсечение окончания, основа не короче трех букв"""
+    if word.isdigit():
+        return word
+    endings = RU_ENDINGS if 'а' <= word[0] <= 'я' else EN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            if ending == 's' and word.endswith('ss'):
+                break
+            return word[:-len(ending)]
+    return word
+
+
+def words(text):
+    """Нормализованные основы слов текста по порядку"""
+    return [stem(word) for word in WORD_RE.findall((text or '').lower().replace('ё', 'е'))]
+
+
+STOPWORDS = {stem(word) for word in (
+    "a an the and or with in at on of for to near by good fast great nice "
+    "с со и или в во на для у около рядом возле хороший хорошим быстрый быстрым"
+).split()}
+
+# Удобство (поле Listing) -> слова, которыми его называют
+FACETS = {
+    'good_internet': "internet wifi wi fi интернет интернетом вайфай",
+    'has_furniture': "furniture furnished мебель мебелью меблированная меблированный",
+    'is_for_relocants': "relocant relocants релокант релокантов релокантам",
+}
+FACET_WORDS = {stem(word): facet for facet, text in FACETS.items() for word in text.split()}
+
+Query = namedtuple('Query', ['terms', 'facets', 'min_bedrooms'])
+
+
+def parse_query(text):
+    """Слова для поиска, удобства и минимум спален из текста пользователя"""
+    text = (text or '').lower().replace('ё', 'е')
+    min_bedrooms = None
+    match = BEDROOMS_RE.search(text)
+    if match:
+        min_bedrooms = int(match.group(1))
+        text = text[:match.start()] + ' ' + text[match.end():]
+    terms, facets = [], set()
+    for term in words(text):
+        if term in FACET_WORDS:
+            facets.add(FACET_WORDS[term])
+        elif term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    return Query(terms, sorted(facets), min_bedrooms)
+
+
+def usd_price(listing):
+    """Цена для упорядочивания; объекты в валюте без курса - в конце"""
+    return float('inf') if listing.price_usd is None else listing.price_usd
+
+
+def bits_from_slots(slots, size):
+    """Маска из номеров слотов одним проходом (вместо OR по одному биту)"""
+    buffer = bytearray((size + 7) // 8)
+    for slot in slots:
+        buffer[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс объектов с масками удобств
+
+    Каждому объекту выдается слот (освободившиеся переиспользуются); цена
+    в USD, окончание буста и признак RED Experts лежат в массивах по слотам,
+    чтобы упорядочить результат без обращения к самим объектам.
+    """
+
+    def __init__(self, red_source='red'):
+        self.red_source = red_source
+        self.postings = {}
+        self.facets = {facet: 0 for facet in FACETS}
+        # Число спален -> маска (-1 - не указано)
+        self.bedrooms = {}
+        self.regions = {}
+        self.alive = 0
+        self.ids = []
+        self.prices = array('d')
+        self.boost_expiry = array('d')
+        self.red = array('b')
+        self._slots = {}
+        self._keys = []
+        self._free = []
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _keys_for(self, listing, description):
+        """Маски, в которые входит объект: слова, удобства, спальни, регион"""
+        text = f"{listing.title} {description} {listing.city} {listing.region}".lower().replace('ё', 'е')
+        terms = {stem(word) for word in set(WORD_RE.findall(text))}
+        terms.difference_update(STOPWORDS)
+        facets = [facet for facet in FACETS if getattr(listing, facet)]
+        bedrooms = -1 if listing.bedrooms is None else listing.bedrooms
+        return tuple(terms), facets, bedrooms, listing.region
+
+    def _take_slot(self, listing):
+        if self._free:
+            slot = self._free.pop()
+            self.ids[slot] = listing.id
+            self.prices[slot] = usd_price(listing)
+            self.boost_expiry[slot] = listing.boost_expiry
+            self.red[slot] = listing.source == self.red_source
+        else:
+            slot = len(self.ids)
+            self.ids.append(listing.id)
+            self.prices.append(usd_price(listing))
+            self.boost_expiry.append(listing.boost_expiry)
+            self.red.append(listing.source == self.red_source)
+            self._keys.append(None)
+        self._slots[listing.id] = slot
+        return slot
+
+    @classmethod
+    def build(cls, entries, red_source='red'):
+        """Индекс из пар (объект, описание): маски собираются по спискам слотов"""
+        index = cls(red_source)
+        # Для каждой маски сначала собирается список слотов
+        members = [{}, {}, {}, {}]
+        for listing, description in entries:
+            slot = index._take_slot(listing)
+            terms, facets, bedrooms, region = index._keys[slot] = index._keys_for(listing, description)
+            for term in terms:
+                members[0].setdefault(term, []).append(slot)
+            for facet in facets:
+                members[1].setdefault(facet, []).append(slot)
+            members[2].setdefault(bedrooms, []).append(slot)
+            members[3].setdefault(region, []).append(slot)
+        size = len(index.ids)
+        for masks, slots in zip((index.postings, index.facets, index.bedrooms, index.regions), members):
+            for key, values in slots.items():
+                masks[key] = bits_from_slots(values, size)
+        index.alive = (1 << size) - 1
+        return index
+
+    def insert(self, listing, description):
+        slot = self._take_slot(listing)
+        keys = self._keys[slot] = self._keys_for(listing, description)
+        terms, facets, bedrooms, region = keys
+        bit = 1 << slot
+        for term in terms:
+            self.postings[term] = self.postings.get(term, 0) | bit
+        for facet in facets:
+            self.facets[facet] |= bit
+        self.bedrooms[bedrooms] = self.bedrooms.get(bedrooms, 0) | bit
+        self.regions[region] = self.regions.get(region, 0) | bit
+        self.alive |= bit
+
+    def remove(self, pid):
+        slot = self._slots.pop(pid, None)
+        if slot is None:
+            return
+        terms, facets, bedrooms, region = self._keys[slot]
+        mask = ~(1 << slot)
+        for term in terms:
+            bits = self.postings[term] & mask
+            if bits:
+                self.postings[term] = bits
+            else:
+                del self.postings[term]
+        for facet in facets:
+            self.facets[facet] &= mask
+        self.bedrooms[bedrooms] &= mask
+        self.regions[region] &= mask
+        self.alive &= mask
+        self.ids[slot] = None
+        self._keys[slot] = None
+        self._free.append(slot)
+
+    def reprice(self, listing):
+        """Новая цена в USD объекта (слова и маски не меняются)"""
+        slot = self._slots.get(listing.id)
+        if slot is not None:
+            self.prices[slot] = usd_price(listing)
+
+    def match(self, query, region=None):
+        """Маска объектов, подходящих под запрос"""
+        masks = []
+        for term in query.terms:
+            bits = self.postings.get(term)
+            if bits is not None:
+                masks.append(bits)
+        if query.terms and not masks:
+            # Ни одно слово запроса не встречается в объектах
+            return 0
+        masks.extend(self.facets[facet] for facet in query.facets)
+        if query.min_bedrooms is not None:
+            bedrooms = 0
+            for count, bits in self.bedrooms.items():
+                if count >= query.min_bedrooms:
+                    bedrooms |= bits
+            masks.append(bedrooms)
+        if region is not None:
+            masks.append(self.regions.get(region, 0))
+        # Сначала короткие маски: результат AND не длиннее самой короткой
+        result = self.alive
+        for bits in sorted(masks, key=int.bit_length):
+            result &= bits
+            if not result:
+                break
+        return result
+
+    def _slots_of(self, bits):
+        if np is not None:
+            buffer = np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'), np.uint8)
+            return np.flatnonzero(np.unpackbits(buffer, bitorder='little'))
+        slots = []
+        while bits:
+            low = bits & -bits
+            slots.append(low.bit_length() - 1)
+            bits ^= low
+        return slots
+
+    def search(self, query, region=None, limit=10):
+        """
+        (id объектов, всего найдено) в порядке каталога
+
+        Неизвестные индексу слова не сужают поиск, если в запросе есть другие.
+        """
+        bits = self.match(query, region)
+        if not bits:
+            return [], 0
+        slots = self._slots_of(bits)
+        now = time.time()
+        if np is not None:
+            prices = np.frombuffer(self.prices)[slots]
+            tier = np.where(np.frombuffer(self.red, np.int8)[slots] == 1, 0,
+                            np.where(np.frombuffer(self.boost_expiry)[slots] > now, 1, 2))
+            # Цены меньше 1e12: ключ "приоритет, затем цена" одним числом
+            key = tier * 1e12 + prices
+            if len(slots) > limit:
+                top = np.argpartition(key, limit)[:limit]
+                top = top[np.argsort(key[top], kind='stable')]
+            else:
+                top = np.argsort(key, kind='stable')
+            return [self.ids[slots[i]] for i in top], len(slots)
+
+        def order(slot):
+            tier = 0 if self.red[slot] else 1 if self.boost_expiry[slot] > now else 2
+            return tier, self.prices[slot]
+
+        return [self.ids[slot] for slot in sorted(slots, key=order)[:limit]], len(slots)
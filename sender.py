@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Планировщик исходящих запросов к Telegram Bot API
+Подключается middleware к сессии Bot, поэтому message.answer, edit_text и
+рассылки проходят через одну очередь с лимитами Telegram: около 30 сообщений
+в секунду на бота и около 1 сообщения в секунду в один чат.
+
+- ответы пользователям идут раньше рассылок (приоритеты);
+- сообщения в один чат уходят по очереди и в порядке отправки;
+- при 429 очередь выдерживает retry_after и повторяет запрос;
+- несколько правок одного сообщения, ждущих в очереди, сливаются в одну.
+
+Бот и рассылки (manage.py campaign send) шлют с одним токеном из разных
+процессов и делят SEND_RATE: постоянными долями (SEND_BUDGET=split) или
+через общее ведро в Redis (SEND_BUDGET=redis), из которого рассылка берет
+только то, что бот сейчас не тратит.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from fsm_storage import get_redis_url
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на токен: общий для бота и рассылок (manage.py campaign send),
+# которые идут из отдельного процесса со своей очередью
+SEND_RATE = float(os.getenv('SEND_RATE', 30))
+# Как бот и рассылки делят SEND_RATE:
+# split - постоянные доли: рассылкам CAMPAIGN_SEND_RATE, боту остаток;
+# redis - общее ведро SEND_RATE в Redis: рассылка берет токен, только пока в
+# ведре остается больше SEND_RESERVE, поэтому без рассылки бот получает весь
+# SEND_RATE, а во время рассылки - столько, сколько ему нужно
+SEND_BUDGET = os.getenv('SEND_BUDGET', 'split')
+SEND_RESERVE = float(os.getenv('SEND_RESERVE', 5))
+# Скорость рассылки (не больше); при split бот получает остаток
+CAMPAIGN_SEND_RATE = float(os.getenv('CAMPAIGN_SEND_RATE', SEND_RATE * 2 / 3))
+BOT_SEND_RATE = SEND_RATE if SEND_BUDGET == 'redis' else SEND_RATE - CAMPAIGN_SEND_RATE
+# Без лимита бот не смог бы отправить ни одного сообщения: останавливаемся сразу
+if BOT_SEND_RATE <= 0:
+    raise ValueError(
+        f"CAMPAIGN_SEND_RATE={CAMPAIGN_SEND_RATE:g} не оставляет боту лимита из SEND_RATE={SEND_RATE:g}: "
+        "уменьшите CAMPAIGN_SEND_RATE или задайте SEND_BUDGET=redis"
+    )
+if SEND_BUDGET == 'redis' and not 0 <= SEND_RESERVE < SEND_RATE:
+    raise ValueError(f"SEND_RESERVE={SEND_RESERVE:g} должен быть от 0 до SEND_RATE={SEND_RATE:g}")
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))
+# Сколько сообщений подряд можно отправить в чат (ответ + правка клавиатуры)
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', 3))
+
+# Приоритеты: меньше - раньше
+INTERACTIVE = 0
+NOTIFICATION = 1
+BROADCAST = 2
+
+send_priority = contextvars.ContextVar('send_priority', default=INTERACTIVE)
+
+# Методы, которые Telegram ограничивает по частоте
+LIMITED_METHODS = ('send', 'edit', 'copy', 'forward')
+EDIT_METHODS = frozenset({
+    'editMessageText', 'editMessageCaption', 'editMessageMedia', 'editMessageReplyMarkup',
+})
+
+
+# Общее ведро отправки: взять токен (pause = 0) или опустошить ведро на pause секунд
+# после 429; возвращает, через сколько секунд повторить (0 - токен взят)
+BUDGET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local pause = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or rate
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(rate, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if pause > 0 then
+    tokens = math.min(tokens, 0) - pause * rate
+elseif tokens - 1 >= reserve then
+    tokens = tokens - 1
+else
+    wait = (reserve + 1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 60)
+return tostring(wait)
+"""
+
+
+@contextmanager
+def priority(level):
+    """Приоритет всех запросов внутри блока (и созданных в нем задач)"""
+    token = send_priority.set(level)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class Job:
+    """Запрос в очереди и все, кто ждет его результата"""
+
+    __slots__ = ('make_request', 'bot', 'method', 'chat_id', 'priority', 'seq',
+                 'waiters', 'edit_key', 'attempts')
+
+    def __init__(self, make_request, bot, method, chat_id, priority, seq, edit_key):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.waiters = [asyncio.get_running_loop().create_future()]
+        self.edit_key = edit_key
+        self.attempts = 0
+
+    def resolve(self, result=None, error=None):
+        for waiter in self.waiters:
+            if waiter.done():
+                continue
+            if error is not None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(result)
+
+    def cancel(self):
+        for waiter in self.waiters:
+            waiter.cancel()
+
+
+class RedisBudget:
+    """
+    Общий лимит SEND_RATE в Redis для всех процессов с одним токеном бота
+
+    reserve - сколько токенов должно остаться в ведре после взятия: у бота 0,
+    у рассылки SEND_RESERVE. Токены, которые тратит бот, рассылке не достаются,
+    пока ведро снова не наполнится выше reserve.
+    """
+
+    def __init__(self, reserve=0.0, rate=SEND_RATE, url=None, key=None):
+        from redis import asyncio as aioredis
+
+        self.reserve = reserve
+        self.rate = rate
+        self.key = key or f"send_budget:{os.getenv('BOT_TOKEN', '').split(':')[0]}"
+        self.redis = aioredis.from_url(url or get_redis_url())
+        self.script = self.redis.register_script(BUDGET_SCRIPT)
+
+    async def _call(self, pause=0.0):
+        return float(await self.script(keys=[self.key], args=[self.rate, time.time(), self.reserve, pause]))
+
+    async def acquire(self):
+        """Дождаться токена (при недоступном Redis - не ждать, остается лимит процесса)"""
+        while True:
+            try:
+                wait = await self._call()
+            except Exception as e:
+                logger.warning(f"Redis недоступен для общего лимита отправки: {e}")
+                return
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def pause(self, seconds):
+        """429 от Telegram относится к токену: притормаживаем все процессы"""
+        try:
+            await self._call(seconds)
+        except Exception as e:
+            logger.warning(f"Redis недоступен для общего лимита отправки: {e}")
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_budget(reserve=0.0):
+    """Общий лимит по SEND_BUDGET: RedisBudget или None (split - только ведро процесса)"""
+    if SEND_BUDGET == 'redis':
+        return RedisBudget(reserve)
+    if SEND_BUDGET == 'split':
+        return None
+    raise ValueError(f"Неизвестный SEND_BUDGET: {SEND_BUDGET} (split или redis)")
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Очередь исходящих запросов бота
+
+    bot.session.middleware(scheduler); start/close - в startup/shutdown
+    диспетчера. Пока очередь не запущена, запросы уходят напрямую.
+    budget - общий с другими процессами лимит (create_budget), берется
+    после ведра процесса rate.
+    """
+
+    def __init__(self, rate=SEND_RATE, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 concurrency=32, max_attempts=5, budget=None):
+        self.bucket = TokenBucket(rate)
+        self.budget = budget
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.chats = {}
+        self._ready = []
+        self._delayed = []
+        # Чаты, в которые сейчас идет запрос, и запросы, ждущие его завершения
+        self._busy = {}
+        self._edits = {}
+        self._seq = itertools.count()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._inflight = set()
+        self._cleanup_at = 0.0
+        self.stats = {'sent': 0, 'coalesced': 0, 'retried': 0, 'failed': 0}
+
+    def __len__(self):
+        return len(self._ready) + len(self._delayed) + sum(map(len, self._busy.values()))
+
+    async def __call__(self, make_request, bot, method):
+        api_method = getattr(method, '__api_method__', '')
+        chat_id = getattr(method, 'chat_id', None)
+        if self._task is None or chat_id is None or not api_method.startswith(LIMITED_METHODS):
+            return await make_request(bot, method)
+
+        edit_key = None
+        if api_method in EDIT_METHODS:
+            edit_key = (chat_id, method.message_id)
+            job = self._edits.get(edit_key)
+            if job is not None:
+                # Правка еще не ушла: отправим только последнюю версию
+                job.method = method
+                job.waiters.append(asyncio.get_running_loop().create_future())
+                self.stats['coalesced'] += 1
+                return await job.waiters[-1]
+
+        job = Job(make_request, bot, method, chat_id, send_priority.get(), next(self._seq), edit_key)
+        if edit_key is not None:
+            self._edits[edit_key] = job
+        heapq.heappush(self._ready, (job.priority, job.seq, job))
+        self._wakeup.set()
+        return await job.waiters[0]
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _cleanup(self, now, idle=60.0):
+        """Ведра чатов, молчавших дольше idle секунд, уже полные - их можно забыть"""
+        self._cleanup_at = now + idle
+        for chat_id in [chat_id for chat_id, bucket in self.chats.items() if bucket.updated < now - idle]:
+            del self.chats[chat_id]
+
+    def _promote(self, now):
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, job = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (job.priority, job.seq, job))
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._promote(now)
+            if now > self._cleanup_at:
+                self._cleanup(now)
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, job = heapq.heappop(self._ready)
+            if all(waiter.done() for waiter in job.waiters):
+                # Все, кто ждал запрос, отменены (например, остановлена рассылка)
+                if job.edit_key is not None:
+                    self._edits.pop(job.edit_key, None)
+                continue
+            blocked = self._busy.get(job.chat_id)
+            if blocked is not None:
+                blocked.append(job)
+                continue
+            bucket = self._chat_bucket(job.chat_id)
+            if not bucket.try_acquire(now=now):
+                heapq.heappush(self._delayed, (now + bucket.delay(), job.seq, job))
+                continue
+
+            await self.bucket.acquire()
+            if self.budget is not None:
+                await self.budget.acquire()
+            await self._slots.acquire()
+            self._busy[job.chat_id] = []
+            if job.edit_key is not None:
+                self._edits.pop(job.edit_key, None)
+            task = asyncio.create_task(self._send(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, job):
+        try:
+            response = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            job.attempts += 1
+            self.stats['retried'] += 1
+            logger.warning(f"Telegram просит подождать {e.retry_after} с (чат {job.chat_id})")
+            # 429 относится ко всему боту: притормаживаем всю очередь
+            self.bucket.pause(e.retry_after)
+            if self.budget is not None:
+                await self.budget.pause(e.retry_after)
+            self._chat_bucket(job.chat_id).pause(e.retry_after)
+            if job.attempts < self.max_attempts:
+                heapq.heappush(self._delayed, (time.monotonic() + e.retry_after, job.seq, job))
+            else:
+                self.stats['failed'] += 1
+                job.resolve(error=e)
+        except Exception as e:
+            self.stats['failed'] += 1
+            job.resolve(error=e)
+        else:
+            self.stats['sent'] += 1
+            job.resolve(response)
+        finally:
+            self._slots.release()
+            for blocked in self._busy.pop(job.chat_id, ()):
+                heapq.heappush(self._ready, (blocked.priority, blocked.seq, blocked))
+            self._wakeup.set()
+
+    async def start(self):
+        """Запуск очереди"""
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout=10.0):
+        """Остановка: ждем отправки оставшихся запросов не дольше timeout секунд"""
+        deadline = time.monotonic() + timeout
+        while (len(self) or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        jobs = [job for _, _, job in self._ready + self._delayed]
+        for blocked in self._busy.values():
+            jobs.extend(blocked)
+        for job in jobs:
+            job.cancel()
+        if jobs:
+            logger.warning(f"Очередь отправки остановлена, не отправлено запросов: {len(jobs)}")
+        if self.budget is not None:
+            await self.budget.close()
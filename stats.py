@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Статистика пользователей и лидов по сводной таблице stats_daily
+Счетчики по дню x региону x стадии x статусу лида обновляются в той же
+транзакции, что и запись пользователей и лидов (см. ProfileWriter), поэтому
+статистика читает несколько сотен строк сводки, а не всю telegram_users и
+leads. Лиды считаются по текущим региону и стадии пользователя.
+Смену статуса лида (админка) и правки в обход бота сводка не видит:
+пересчитать ее с нуля - python manage.py stats --backfill
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд бот показывает статистику из памяти
+STATS_TTL = float(os.getenv('STATS_TTL', 60))
+
+# Таблица stats_daily создается миграцией admin_panel 0005; строки
+# пользователей имеют lead_status = '', строки лидов - статус лида
+UPSERT_STATS_SQL = (
+    "INSERT INTO stats_daily (day, region, stage, lead_status, users, leads) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (day, region, stage, lead_status) DO UPDATE SET "
+    "users = stats_daily.users + excluded.users, leads = stats_daily.leads + excluded.leads"
+)
+
+# Сводка за все время, за 7 дней и за сегодня; параметры - (неделя, сегодня, неделя)
+SUMMARY_SQL = (
+    "SELECT region, stage, lead_status, SUM(users), SUM(leads), "
+    "SUM(CASE WHEN day >= ? THEN users ELSE 0 END), "
+    "SUM(CASE WHEN day = ? THEN users ELSE 0 END), "
+    "SUM(CASE WHEN day >= ? THEN leads ELSE 0 END) "
+    "FROM stats_daily GROUP BY region, stage, lead_status"
+)
+
+
+def day(value):
+    """День (YYYY-MM-DD) из datetime или строки datetime Django"""
+    return str(value)[:10]
+
+
+def summary_params(now=None):
+    now = now or datetime.now(timezone.utc)
+    today = now.strftime('%Y-%m-%d')
+    week_ago = (now - timedelta(days=6)).strftime('%Y-%m-%d')
+    return week_ago, today, week_ago
+
+
+class Rollup:
+    """Изменения счетчиков сводки, накопленные для одной транзакции"""
+
+    def __init__(self):
+        self.deltas = {}
+
+    def add(self, day, region, stage, lead_status='', users=0, leads=0):
+        key = (day, region or '', stage or '', lead_status or '')
+        old_users, old_leads = self.deltas.get(key, (0, 0))
+        self.deltas[key] = (old_users + users, old_leads + leads)
+
+    def move_user(self, day, old, new):
+        """Пользователь сменил регион или стадию: (регион, стадия) до и после"""
+        if old != new:
+            self.add(day, *old, users=-1)
+            self.add(day, *new, users=1)
+
+    def move_lead(self, day, lead_status, old, new):
+        """Лид пользователя, сменившего регион или стадию, переходит вместе с ним"""
+        if old != new:
+            self.add(day, *old, lead_status, leads=-1)
+            self.add(day, *new, lead_status, leads=1)
+
+    def rows(self):
+        return [(*key, users, leads) for key, (users, leads) in self.deltas.items() if users or leads]
+
+    def __len__(self):
+        return len(self.deltas)
+
+    async def apply(self, tx):
+        """Запись изменений (tx - транзакция слоя database, в которой пишутся данные)"""
+        rows = self.rows()
+        if rows:
+            await tx.executemany(UPSERT_STATS_SQL, rows)
+
+
+def summarize(rows):
+    """Сводка из строк SUMMARY_SQL"""
+    summary = {
+        'users': 0, 'users_week': 0, 'users_today': 0,
+        'regions': {}, 'stages': {},
+        'leads': 0, 'leads_week': 0, 'lead_statuses': {},
+    }
+    for region, stage, lead_status, users, leads, users_week, users_today, leads_week in rows:
+        if lead_status:
+            summary['leads'] += leads
+            summary['leads_week'] += leads_week
+            summary['lead_statuses'][lead_status] = summary['lead_statuses'].get(lead_status, 0) + leads
+            continue
+        summary['users'] += users
+        summary['users_week'] += users_week
+        summary['users_today'] += users_today
+        if region:
+            summary['regions'][region] = summary['regions'].get(region, 0) + users
+        if stage:
+            summary['stages'][stage] = summary['stages'].get(stage, 0) + users
+    return summary
+
+
+class Stats:
+    """Сводка для бота с кэшем на ttl секунд (db - SQLiteDatabase или PostgresDatabase)"""
+
+    def __init__(self, db, ttl=STATS_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._cached = None
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _fetch(self):
+        return await self.db.fetch(SUMMARY_SQL, summary_params())
+
+    async def summary(self):
+        """Сводка; при одновременных запросах база читается один раз"""
+        if self._cached is not None and time.monotonic() < self._expires:
+            return self._cached
+        async with self._lock:
+            if self._cached is None or time.monotonic() >= self._expires:
+                self._cached = summarize(await self._fetch())
+                self._expires = time.monotonic() + self.ttl
+        return self._cached
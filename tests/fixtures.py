@@ -0,0 +1,186 @@
+"""
+Тестовые базы ReloCompass (общие для tests/ и bench.py)
+Копия db.sqlite3 с синтетическими объектами и таблицами из миграций
+admin_panel; та же схема в PostgreSQL (DATABASE_URL - тестовая база,
+таблицы бота в ней пересоздаются); Django без config.settings для команд
+admin_panel.
+"""
+
+import importlib
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+import database
+
+ROOT = Path(__file__).resolve().parent.parent
+
+POSTGRES = bool(os.getenv('DATABASE_URL')) or database.DB_ENGINE == 'postgres'
+
+# Параметры тестов, которые проверяются на обоих движках
+ENGINES = [
+    'sqlite',
+    pytest.param('postgres', marks=pytest.mark.skipif(
+        not POSTGRES, reason="PostgreSQL: задайте DATABASE_URL или DB_ENGINE=postgres",
+    )),
+]
+
+# Таблицы 0001_initial (в db.sqlite3) и миграций admin_panel
+DJANGO_TABLES = ('properties', 'property_images', 'telegram_users', 'leads', 'bot_settings')
+MIGRATIONS = ('0002_properties_source_external_id_idx', '0003_campaigns', '0004_admin_indexes', '0005_bot_tables')
+MIGRATION_TABLES = (
+    'campaigns', 'campaign_deliveries', 'stats_daily', 'amocrm_outbox', 'exchange_rates',
+    'property_image_files', 'bot_fsm_states',
+)
+
+# Типы SQLite -> типы, которые Django создает для тех же полей в PostgreSQL
+POSTGRES_TYPES = [
+    (r'integer NOT NULL PRIMARY KEY AUTOINCREMENT', 'integer NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY'),
+    (r'\bchar\(32\)', 'uuid'),
+    (r'\bdatetime\b', 'timestamp with time zone'),
+    (r'\bbool\b', 'boolean'),
+    (r'\bdecimal\b', 'numeric'),
+]
+
+REGIONS = ["phuket", "bali", "georgia", "turkey", "cyprus"]
+CITIES = {
+    "phuket": ["Patong", "Kata", "Rawai"],
+    "bali": ["Canggu", "Ubud", "Seminyak"],
+    "georgia": ["Tbilisi", "Batumi"],
+    "turkey": ["Antalya", "Alanya", "Istanbul"],
+    "cyprus": ["Limassol", "Paphos", "Larnaca"],
+}
+
+
+def apply_migration(conn, name):
+    """SQL миграции admin_panel (в них только RunSQL) без Django"""
+    for operation in importlib.import_module(f'admin_panel.migrations.{name}').Migration.operations:
+        conn.execute(operation.sql)
+
+
+PROPERTIES_SQL = (
+    "INSERT INTO properties (id, source, external_id, title, description, region, city, "
+    "price, price_currency, price_type, bedrooms, bathrooms, area, is_for_relocants, "
+    "has_furniture, good_internet, contact_phone, contact_email, boost_expiry, is_active, "
+    "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def property_rows(count, seed=1):
+    """Строки синтетических объектов для PROPERTIES_SQL"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def row(i):
+        region = rng.choice(REGIONS)
+        boost = rng.random()
+        boost_expiry = None
+        if boost < 0.1:
+            boost_expiry = str(now + timedelta(days=rng.randint(1, 30)))
+        elif boost < 0.2:
+            boost_expiry = str(now - timedelta(days=rng.randint(1, 30)))
+        bedrooms = rng.randint(0, 5)
+        city = rng.choice(CITIES[region])
+        return (
+            uuid.UUID(int=rng.getrandbits(128)).hex, rng.choice(["red", "client", "partner", "partner"]),
+            f"ext-{i}", f"{bedrooms} bedroom villa in {city}",
+            f"Cozy place in {city} with pool and good internet", region, city,
+            rng.randint(30, 1500) * 1000, "USD", "sale", bedrooms, rng.randint(1, 3),
+            rng.randint(30, 400), rng.random() < 0.5, rng.random() < 0.5, rng.random() < 0.5,
+            "", "", boost_expiry, True, str(now), str(now),
+        )
+
+    return [row(i) for i in range(count)]
+
+
+def synthetic_db(properties=0, seed=1):
+    """Копия db.sqlite3 во временной папке с синтетическими объектами"""
+    path = os.path.join(tempfile.mkdtemp(), 'db.sqlite3')
+    shutil.copy(ROOT / 'db.sqlite3', path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(PROPERTIES_SQL, property_rows(properties, seed))
+        # Таблицы бота из миграции admin_panel 0005
+        apply_migration(conn, '0005_bot_tables')
+    conn.close()
+    return path
+
+
+def postgres_schema():
+    """
+    Схема бота в PostgreSQL (DATABASE_URL или DB_*) с нуля: таблицы
+    0001_initial с типами Django для PostgreSQL и миграции 0002-0005
+    """
+    import psycopg2
+
+    source = sqlite3.connect(ROOT / 'db.sqlite3')
+    rows = source.execute(
+        f"SELECT type, tbl_name, sql FROM sqlite_master WHERE tbl_name IN ({', '.join('?' * len(DJANGO_TABLES))}) "
+        "AND sql IS NOT NULL",
+        DJANGO_TABLES,
+    ).fetchall()
+    source.close()
+    # Таблицы до индексов и в порядке внешних ключей
+    rows.sort(key=lambda row: (row[0] != 'table', DJANGO_TABLES.index(row[1])))
+    statements = [sql for _, _, sql in rows]
+    for pattern, replacement in POSTGRES_TYPES:
+        statements = [re.sub(pattern, replacement, sql) for sql in statements]
+    for name in MIGRATIONS:
+        for operation in importlib.import_module(f'admin_panel.migrations.{name}').Migration.operations:
+            statements.append(getattr(operation, 'postgresql_sql', operation.sql))
+
+    dsn = os.getenv('DATABASE_URL')
+    conn = psycopg2.connect(dsn) if dsn else psycopg2.connect(
+        dbname=database.DB_NAME, user=database.DB_USER, password=database.DB_PASSWORD,
+        host=database.DB_HOST, port=database.DB_PORT,
+    )
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {', '.join(DJANGO_TABLES + MIGRATION_TABLES)} CASCADE")
+            for sql in statements:
+                cursor.execute(sql)
+    finally:
+        conn.close()
+
+
+async def bot_database(engine, properties=0, seed=1):
+    """Запущенный слой database над схемой бота с синтетическими объектами"""
+    if engine == 'postgres':
+        postgres_schema()
+        db = database.PostgresDatabase(os.getenv('DATABASE_URL'))
+        await db.start()
+        await db.executemany(PROPERTIES_SQL, property_rows(properties, seed))
+        return db
+    db = database.SQLiteDatabase(synthetic_db(properties, seed))
+    await db.start()
+    return db
+
+
+def setup_django(path):
+    """Django с базой path без config.settings (для команд admin_panel)"""
+    import django
+    from django.conf import settings
+    if settings.configured:
+        # Несколько баз в одном процессе (тесты, бенчмарки): переключаем базу
+        from django.db import connection
+        connection.close()
+        connection.settings_dict['NAME'] = path
+        return
+    from database import django_databases
+    settings.configure(DATABASES=django_databases('sqlite', path), USE_TZ=True)
+    django.setup()
+
+
+def reopen(db):
+    """Еще один слой database над той же базой (как у другого процесса бота), не запущен"""
+    if db.engine == 'postgres':
+        return database.PostgresDatabase(db.dsn)
+    return database.SQLiteDatabase(db.path)
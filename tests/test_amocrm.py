@@ -0,0 +1,171 @@
+"""
+Выгрузка лидов в AmoCRM: очередь amocrm_outbox и отправка пачками
+"""
+
+import asyncio
+import json
+import math
+import time
+import uuid
+from email.utils import formatdate
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import database
+import fake_amocrm
+from amocrm import LeadExporter
+from tests.fixtures import ENGINES, bot_database, reopen
+
+
+async def leads_db(engine, count):
+    """Запущенная база с count лидами в очереди выгрузки"""
+    db = await bot_database(engine, 10)
+    now = database.now()
+    property_id, = await db.fetchone("SELECT id FROM properties LIMIT 1")
+    async with db.transaction() as tx:
+        user_id, = await tx.fetchone(
+            "INSERT INTO telegram_users (telegram_id, username, first_name, last_name, stage, "
+            "region, is_active, created_at, updated_at) VALUES (100001, 'test', 'Test', '', 'ready', 'bali', TRUE, ?, ?) "
+            "RETURNING id",
+            (now, now),
+        )
+        await tx.executemany(
+            "INSERT INTO leads (id, source, message, status, amo_crm_id, amo_crm_url, created_at, "
+            "updated_at, property_id, user_id) VALUES (?, 'telegram', '', 'new', '', '', ?, ?, ?, ?)",
+            [(uuid.UUID(int=i + 1).hex, now, now, property_id, user_id) for i in range(count)],
+        )
+        await tx.execute(
+            "INSERT INTO amocrm_outbox (lead_id, attempts, next_attempt_at, last_error, created_at) "
+            "SELECT id, 0, 0, '', 0 FROM leads"
+        )
+    return db
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_claim_is_exclusive_across_connections(engine):
+    # Как несколько процессов бота: у каждого свои соединения с базой
+    async def claim_all(exporter):
+        claimed = []
+        while rows := await exporter._claim():
+            claimed.extend(row[0] for row in rows)
+        return claimed
+
+    async def scenario():
+        db = await leads_db(engine, 200)
+        others = [reopen(db) for _ in range(3)]
+        for other in others:
+            await other.start()
+        try:
+            exporters = [LeadExporter(each, batch_size=5) for each in [db, *others]]
+            claimed = await asyncio.gather(*(claim_all(exporter) for exporter in exporters))
+        finally:
+            for each in [db, *others]:
+                await each.close()
+        return [lead_id for ids in claimed for lead_id in ids]
+
+    lead_ids = asyncio.run(scenario())
+    assert len(lead_ids) == len(set(lead_ids)) == 200
+
+
+def export(count, app, scenario, **kwargs):
+    """Лиды в очереди, фейковая AmoCRM app и выгрузчик на нее для scenario(exporter, db)"""
+    async def main():
+        db = await leads_db('sqlite', count)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        exporter = LeadExporter(db, base_url=f"http://127.0.0.1:{port}", token='test', rate=1000, **kwargs)
+        try:
+            return await scenario(exporter, db)
+        finally:
+            await exporter.close()
+            await runner.cleanup()
+            await db.close()
+
+    return asyncio.run(main())
+
+
+async def export_once(exporter, db):
+    """Одна пачка из очереди; состояние очереди после нее"""
+    exporter._session = aiohttp.ClientSession(headers={"Authorization": f"Bearer {exporter.token}"})
+    rows = await exporter._claim()
+    await exporter._export(rows)
+    return await db.fetch("SELECT attempts, next_attempt_at, last_error FROM amocrm_outbox")
+
+
+def test_leads_are_exported_in_batches():
+    async def scenario(exporter, db):
+        await exporter.start()
+        deadline = time.monotonic() + 10
+        while exporter.exported < 120 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        return (
+            await db.fetch("SELECT id, amo_crm_id, amo_crm_url FROM leads"),
+            await db.fetchone("SELECT COUNT(*) FROM amocrm_outbox"),
+        )
+
+    app = fake_amocrm.create_app(rate=1000)
+    leads, (queued,) = export(120, app, scenario, poll_interval=0.01)
+    assert sorted(app["stats"]["batches"]) == [20, 50, 50]
+    assert app["stats"]["requests"] == math.ceil(120 / 50)
+    assert queued == 0
+    amo_ids = {amo_crm_id for _, amo_crm_id, _ in leads}
+    assert len(amo_ids) == 120 and '' not in amo_ids
+    assert all(url.endswith(f"/leads/detail/{amo_crm_id}") for _, amo_crm_id, url in leads)
+
+
+@pytest.mark.parametrize('http_date, expected', [(False, 7), (True, 30)])
+def test_retry_after_postpones_batch(http_date, expected):
+    # Retry-After в секундах или HTTP-датой
+    retry_after = formatdate(time.time() + expected, usegmt=True) if http_date else str(expected)
+    app = fake_amocrm.create_app(rate=1000, faults=[(429, {"Retry-After": retry_after})])
+    started = time.time()
+    outbox = export(3, app, export_once)
+    assert len(outbox) == 3
+    for attempts, next_attempt_at, last_error in outbox:
+        assert attempts == 1 and last_error == "HTTP 429"
+        assert expected - 2 <= next_attempt_at - started <= expected + 2
+
+
+def test_server_errors_back_off():
+    app = fake_amocrm.create_app(rate=1000, faults=[(503, {})])
+    started = time.time()
+    outbox = export(3, app, export_once)
+    for attempts, next_attempt_at, last_error in outbox:
+        # backoff(1): от 0 до 2 секунд
+        assert attempts == 1 and last_error == "HTTP 503"
+        assert started <= next_attempt_at <= time.time() + 2
+
+
+def test_batch_fails_after_max_attempts():
+    async def scenario(exporter, db):
+        await db.execute("UPDATE amocrm_outbox SET attempts = ?", (exporter.max_attempts - 1,))
+        return await export_once(exporter, db)
+
+    app = fake_amocrm.create_app(rate=1000, faults=[(500, {})])
+    outbox = export(3, app, scenario)
+    assert [(attempts, next_attempt_at) for attempts, next_attempt_at, _ in outbox] == [(10, None)] * 3
+
+
+def test_lead_without_id_in_response_is_not_retried():
+    @web.middleware
+    async def drop_first_id(request, handler):
+        response = await handler(request)
+        created = json.loads(response.body)
+        del created[0]["id"]
+        return web.json_response(created)
+
+    async def scenario(exporter, db):
+        outbox = await export_once(exporter, db)
+        exported, = await db.fetchone("SELECT COUNT(*) FROM leads WHERE amo_crm_id != ''")
+        return outbox, exported, exporter.exported, exporter.failed
+
+    app = fake_amocrm.create_app(rate=1000)
+    app.middlewares.append(drop_first_id)
+    (failed,), exported, counted, failed_count = export(3, app, scenario)
+    assert exported == counted == 2 and failed_count == 1
+    assert failed[:2] == (1, None) and "нет id сделки" in failed[2]
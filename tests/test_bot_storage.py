@@ -0,0 +1,182 @@
+"""
+Модули бота на слое database: одинаково на SQLite и PostgreSQL
+PostgreSQL проверяется, если задан DATABASE_URL или DB_ENGINE=postgres.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+import database
+from amocrm import LeadExporter
+from bot_settings import BotSettings
+from catalog import Catalog
+from fsm_storage import DatabaseStorage
+from images import ImageStore
+from leads import LeadCapture
+from profiles import ProfileWriter
+from stats import Rollup, Stats, day
+from tests.fixtures import ENGINES, bot_database
+
+pytestmark = pytest.mark.parametrize('engine', ENGINES)
+
+
+def run(engine, scenario, properties=0):
+    """Сценарий на запущенной базе со схемой бота"""
+    async def main():
+        db = await bot_database(engine, properties)
+        try:
+            return await scenario(db)
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+def user(telegram_id):
+    return SimpleNamespace(id=telegram_id, username='', first_name=f"User {telegram_id}", last_name='')
+
+
+def test_catalog_loads_and_picks_up_changes(engine):
+    async def scenario(db):
+        catalog = Catalog(db)
+        await catalog.refresh()
+        loaded = len(catalog.listings)
+        pid, listing = next(iter(catalog.listings.items()))
+        await db.execute(
+            "UPDATE properties SET price = ?, updated_at = ? WHERE id = ?",
+            (listing.price + 1000, database.now(), pid),
+        )
+        await catalog.refresh()
+        return loaded, listing.price, catalog.listings[pid]
+
+    loaded, old_price, listing = run(engine, scenario, properties=50)
+    assert loaded == 50
+    assert len(listing.id) == 32
+    assert listing.price == old_price + 1000
+    assert listing.price_usd == listing.price
+
+
+def test_profiles_and_leads_update_stats(engine):
+    async def scenario(db):
+        profiles = ProfileWriter(db)
+        captures = LeadCapture(db, profiles=profiles)
+        await profiles.start()
+        await captures.start()
+        profiles.add(user(1), {"stage": "planning", "region": "bali"})
+        profiles.add(user(2), {"stage": "ready", "region": "phuket"})
+        await profiles.flush()
+        # Смена региона и заявка от пользователя без профиля
+        profiles.add(user(1), {"stage": "ready", "region": "phuket"})
+        pid, = await db.fetchone("SELECT id FROM properties LIMIT 1")
+        captures.capture(1, user(1), pid)
+        captures.capture(2, user(3), None)
+        await captures.close()
+        await profiles.close()
+        return await Stats(db).summary()
+
+    summary = run(engine, scenario, properties=5)
+    assert summary['users'] == 3
+    # Пользователь 1 перешел из bali/planning в phuket/ready
+    assert {region: count for region, count in summary['regions'].items() if count} == {'phuket': 2}
+    assert {stage: count for stage, count in summary['stages'].items() if count} == {'ready': 2}
+    assert summary['leads'] == 2
+
+
+def test_rollup_matches_backfill_after_profile_change(engine):
+    from admin_panel.management.commands.stats import RAW_SQL
+
+    async def scenario(db):
+        profiles = ProfileWriter(db)
+        captures = LeadCapture(db, profiles=profiles)
+        pids = [row[0] for row in await db.fetch("SELECT id FROM properties LIMIT 2")]
+        profiles.add(user(1), {"stage": "planning", "region": "bali"})
+        captures.capture(1, user(1), pids[0])
+        captures.capture(2, user(1), pids[1])
+        # Заявка до onboarding, затем профиль; затем первый пользователь сменил регион
+        captures.capture(3, user(2), pids[0])
+        await captures.flush()
+        profiles.add(user(2), {"stage": "ready", "region": "phuket"})
+        profiles.add(user(1), {"stage": "ready", "region": "phuket"})
+        await profiles.flush()
+        backfill = Rollup()
+        for created_at, region, stage, lead_status, users, leads in await db.fetch(RAW_SQL):
+            backfill.add(day(created_at), region, stage, lead_status, users, leads)
+        rows = await db.fetch("SELECT day, region, stage, lead_status, users, leads FROM stats_daily")
+        return sorted(backfill.rows()), sorted(tuple(row) for row in rows if row[4] or row[5])
+
+    backfill, rolled_up = run(engine, scenario, properties=5)
+    assert rolled_up == backfill
+    assert {(region, stage, leads) for _, region, stage, status, _, leads in backfill if status} == {
+        ('phuket', 'ready', 3),
+    }
+
+
+def test_fsm_state_survives_restart(engine):
+    key = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+    async def scenario(db):
+        storage = DatabaseStorage(db)
+        await storage.set_state(key, "UserStates:waiting_for_family")
+        await storage.update_data(key, {"stage": "ready"})
+        await storage.close()
+        restarted = DatabaseStorage(db, cache_size=0)
+        return await restarted.get_state(key), await restarted.get_data(key)
+
+    assert run(engine, scenario) == ("UserStates:waiting_for_family", {"stage": "ready"})
+
+
+def test_image_file_ids_are_remembered(engine):
+    async def scenario(db):
+        pid, = await db.fetchone("SELECT id FROM properties LIMIT 1")
+        await db.executemany(
+            'INSERT INTO property_images (image_url, is_primary, "order", created_at, property_id) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(f"https://cdn.example.com/{i}.jpg", i == 1, i, database.now(), pid) for i in range(3)],
+        )
+        store = ImageStore(db)
+        images = (await store.images(pid))[pid]
+        await store.remember(images[:1], [SimpleNamespace(photo=[SimpleNamespace(file_id="file-1")])])
+        reloaded = (await ImageStore(db).images(pid))[pid]
+        return [(image.url, image.file_id) for image in reloaded]
+
+    assert run(engine, scenario, properties=1) == [
+        ("https://cdn.example.com/1.jpg", "file-1"),
+        ("https://cdn.example.com/0.jpg", None),
+        ("https://cdn.example.com/2.jpg", None),
+    ]
+
+
+def test_settings_and_exchange_rates_reload(engine):
+    async def scenario(db):
+        settings = BotSettings(db, refresh_interval=3600)
+        catalog = Catalog(db)
+        await settings.refresh()
+        await catalog.rates.refresh()
+        now = database.now()
+        await db.execute(
+            "INSERT INTO bot_settings (key, value, description, created_at, updated_at) VALUES (?, ?, '', ?, ?)",
+            ("text_welcome", '"Привет"', now, now),
+        )
+        await db.execute(
+            "INSERT INTO exchange_rates (currency, usd_rate, updated_at) VALUES (?, ?, ?)", ("EUR", 1.1, now),
+        )
+        return await settings.refresh(), await catalog.rates.refresh(), catalog.rates.to_usd(100, "EUR")
+
+    assert run(engine, scenario) == ({"text_welcome"}, {"EUR"}, 110.0)
+
+
+def test_leads_from_admin_are_queued(engine):
+    async def scenario(db):
+        captures = LeadCapture(db)
+        await captures.start()
+        captures.capture(1, user(1))
+        await captures.close()
+        exporter = LeadExporter(db, base_url='')
+        await exporter._enqueue_missing()
+        return await db.fetch("SELECT o.lead_id, l.id FROM amocrm_outbox o JOIN leads l ON l.id = o.lead_id")
+
+    (queued, lead_id), = run(engine, scenario)
+    assert queued == lead_id and len(lead_id) == 32
@@ -0,0 +1,135 @@
+"""
+Команда bulk: каждое массовое действие - один запрос к базе
+Число запросов не зависит от числа затронутых строк.
+"""
+
+import io
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from tests.fixtures import setup_django, synthetic_db
+
+STATUSES = ["new", "in_progress", "won", "lost"]
+
+
+@pytest.fixture
+def db_path():
+    """200 объектов, 20 пользователей и 80 лидов; лиды lost остановились в очереди AmoCRM"""
+    path = synthetic_db(200)
+    now = str(datetime.now(timezone.utc).replace(tzinfo=None))
+    conn = sqlite3.connect(path)
+    property_ids = [row[0] for row in conn.execute("SELECT id FROM properties ORDER BY id")]
+    with conn:
+        conn.executemany(
+            "INSERT INTO telegram_users (id, telegram_id, username, first_name, last_name, stage, "
+            "region, is_active, created_at, updated_at) VALUES (?, ?, '', 'Test', '', 'ready', 'bali', 1, ?, ?)",
+            [(i, 100000 + i, now, now) for i in range(1, 21)],
+        )
+        conn.executemany(
+            "INSERT INTO leads (id, source, message, status, amo_crm_id, amo_crm_url, created_at, "
+            "updated_at, property_id, user_id) VALUES (?, 'telegram', '', ?, ?, '', ?, ?, ?, ?)",
+            # Половина новых лидов уже выгружена в AmoCRM
+            [(uuid.UUID(int=i).hex, STATUSES[i % 4], f"amo-{i}" if i % 8 == 0 else '', now, now,
+              property_ids[i], i % 20 + 1) for i in range(80)],
+        )
+        conn.execute(
+            "INSERT INTO amocrm_outbox (lead_id, attempts, next_attempt_at, last_error, created_at) "
+            "SELECT id, 10, NULL, 'HTTP 400', 0 FROM leads WHERE status = 'lost'"
+        )
+    conn.close()
+    setup_django(path)
+    return path
+
+
+def bulk(*args):
+    """Запуск manage.py bulk: (число запросов к базе, вывод команды)"""
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from admin_panel.management.commands.bulk import Command
+
+    stdout = io.StringIO()
+    with CaptureQueriesContext(connection) as queries:
+        call_command(Command(), *args, stdout=stdout)
+    return len(queries.captured_queries), stdout.getvalue()
+
+
+def query(path, sql, params=()):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def test_boost_region(db_path):
+    expected = query(db_path, "SELECT COUNT(*) FROM properties WHERE region = 'bali' AND is_active = 1")[0][0]
+    count, output = bulk("boost", "--region", "bali", "--days", "14")
+    assert count == 1
+    assert f"boost: {expected} строк" in output
+    boosted = query(
+        db_path,
+        "SELECT COUNT(*) FROM properties WHERE region = 'bali' AND boost_expiry > datetime('now', '+13 days')",
+    )[0][0]
+    assert boosted == expected
+
+
+def test_boost_ids(db_path):
+    ids = [str(uuid.UUID(row[0])) for row in query(db_path, "SELECT id FROM properties LIMIT 3")]
+    count, output = bulk("boost", *ids, "--days", "7")
+    assert count == 1
+    assert "boost: 3 строк" in output
+
+
+def test_deactivate_source(db_path):
+    count, _ = bulk("deactivate", "--source", "partner")
+    assert count == 1
+    assert query(db_path, "SELECT COUNT(*) FROM properties WHERE source = 'partner' AND is_active = 1") == [(0,)]
+    assert query(db_path, "SELECT COUNT(*) FROM properties WHERE source <> 'partner' AND is_active = 0") == [(0,)]
+
+
+def test_resend_status(db_path):
+    count, output = bulk("resend", "--status", "new")
+    assert count == 1
+    # 20 новых лидов, из них 10 уже выгружены
+    assert "resend: 10 строк" in output
+    queued = query(
+        db_path,
+        "SELECT COUNT(*) FROM amocrm_outbox o JOIN leads l ON l.id = o.lead_id "
+        "WHERE l.status = 'new' AND o.attempts = 0 AND o.next_attempt_at IS NOT NULL",
+    )
+    assert queued == [(10,)]
+
+
+def test_resend_failed(db_path):
+    started = time.time()
+    count, output = bulk("resend", "--failed")
+    assert count == 1
+    assert "resend: 20 строк" in output
+    assert query(db_path, "SELECT COUNT(*) FROM amocrm_outbox WHERE next_attempt_at IS NULL") == [(0,)]
+    assert query(db_path, "SELECT MIN(next_attempt_at) >= ?, MAX(attempts) FROM amocrm_outbox", (started,)) == [(1, 0)]
+
+
+def test_resend_failed_with_source(db_path):
+    # Только лиды источника, на которых выгрузка остановилась
+    count, output = bulk("resend", "--failed", "--source", "telegram")
+    assert count == 1
+    assert "resend: 20 строк" in output
+
+
+@pytest.mark.parametrize('args', [
+    ["boost", "--days", "7"],
+    ["boost", "--region", "bali", "--days", "0"],
+    ["deactivate"],
+    ["resend"],
+])
+def test_rejects_without_filter(db_path, args):
+    from django.core.management.base import CommandError
+
+    with pytest.raises(CommandError):
+        bulk(*args)
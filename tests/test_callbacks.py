@@ -0,0 +1,58 @@
+"""
+callback_data: сборка, лимит Telegram в байтах и проверка аргументов
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import keyboards
+from callbacks import MAX_CALLBACK_DATA, CallbackRouter, pack
+
+
+async def handler(callback, args):
+    return args
+
+
+def test_pack_rejects_separator_in_args():
+    assert pack("page", "n", "0.1f4.abc") == "page:n:0.1f4.abc"
+    with pytest.raises(ValueError, match="не может содержать"):
+        pack("region", "bali:ubud")
+
+
+def test_limit_is_counted_in_utf8_bytes():
+    # 31 кириллический символ - 62 байта: вместе с "q:" ровно лимит
+    assert len(pack("q", "я" * 31).encode()) == MAX_CALLBACK_DATA
+    with pytest.raises(ValueError, match="длиннее"):
+        pack("q", "я" * 32)
+
+    router = CallbackRouter()
+    router.register("q", handler, arity=1)
+    assert router.resolve("q:" + "я" * 31) is not None
+    # 33 символа, но 66 байт: такую callback_data Telegram не пришлет, это подделка
+    assert router.resolve("q:" + "я" * 32) is None
+
+
+def test_choices_can_change_without_restart():
+    allowed = {"bali"}
+    router = CallbackRouter()
+    router.register("region", handler, arity=1, choices=lambda: allowed)
+    assert router.resolve("region:bali") is not None
+    assert router.resolve("region:phuket") is None
+    allowed.add("phuket")
+    assert router.resolve("region:phuket") is not None
+    # Кнопки старого формата проверяются так же
+    assert router.resolve("region_phuket") is not None
+    assert router.resolve("region_mars") is None
+
+
+def test_regions_that_do_not_fit_callback_data_are_rejected(monkeypatch):
+    def regions(value):
+        monkeypatch.setattr(keyboards, "settings", SimpleNamespace(get=lambda key, default=None: value))
+        return keyboards.load_regions()
+
+    assert regions([["bali", "Бали"], ["phuket", "Пхукет"]]) == [("bali", "Бали"), ("phuket", "Пхукет")]
+    assert keyboards.region_codes() == {"bali", "phuket"}
+    # Двоеточие или слишком длинный код - список из bot_settings не используется
+    assert regions([["bali:ubud", "Убуд"]]) == keyboards.DEFAULT_REGIONS
+    assert regions([["x" * 70, "Длинный"]]) == keyboards.DEFAULT_REGIONS
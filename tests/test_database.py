@@ -0,0 +1,103 @@
+"""
+Слой database: одинаковые результаты на SQLite и PostgreSQL
+PostgreSQL проверяется, если задан DATABASE_URL или DB_ENGINE=postgres.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+import database
+from tests.fixtures import ENGINES
+
+
+@pytest.fixture(params=ENGINES)
+def run(request, tmp_path):
+    """Запуск сценария на базе с таблицей test_items (id 1..100, qty = id)"""
+    def create():
+        if request.param == 'postgres':
+            return database.PostgresDatabase(os.getenv('DATABASE_URL'))
+        return database.SQLiteDatabase(str(tmp_path / 'db.sqlite3'))
+
+    async def main(scenario):
+        db = create()
+        await db.start()
+        try:
+            await db.execute("DROP TABLE IF EXISTS test_items")
+            await db.execute(
+                "CREATE TABLE test_items (id integer PRIMARY KEY, name varchar(50) NOT NULL, qty integer NOT NULL)"
+            )
+            await db.executemany(
+                "INSERT INTO test_items (id, name, qty) VALUES (?, ?, ?)",
+                [(i, f"item {i}", i) for i in range(1, 101)],
+            )
+            return await scenario(db)
+        finally:
+            await db.execute("DROP TABLE IF EXISTS test_items")
+            await db.close()
+
+    return lambda scenario: asyncio.run(main(scenario))
+
+
+def test_execute_returns_rowcount(run):
+    async def scenario(db):
+        return await db.execute("UPDATE test_items SET qty = qty + ? WHERE id <= ?", (1000, 10))
+
+    assert run(scenario) == 10
+
+
+def test_upsert_updates_existing_row(run):
+    async def scenario(db):
+        await db.execute(
+            "INSERT INTO test_items (id, name, qty) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET qty = test_items.qty + excluded.qty", (5, "item 5", 1)
+        )
+        return await db.fetchone("SELECT name, qty FROM test_items WHERE id = ?", (5,))
+
+    assert run(scenario) == ("item 5", 6)
+
+
+def test_transaction_rolls_back_on_error(run):
+    async def scenario(db):
+        with pytest.raises(RuntimeError):
+            async with db.transaction() as tx:
+                await tx.execute("DELETE FROM test_items WHERE id > ?", (50,))
+                inside = await tx.fetchone("SELECT COUNT(*) FROM test_items")
+                raise RuntimeError("откат")
+        return inside, await db.fetchone("SELECT COUNT(*) FROM test_items")
+
+    assert run(scenario) == ((50,), (100,))
+
+
+def test_question_mark_in_literal_is_not_placeholder(run):
+    async def scenario(db):
+        await db.execute("INSERT INTO test_items (id, name, qty) VALUES (?, 'a?b', ?)", (101, 1000))
+        return await db.fetch(
+            "SELECT COUNT(*), SUM(qty) FROM test_items WHERE name <> 'a?b' AND qty >= ?", (50,)
+        )
+
+    assert run(scenario) == [(51, sum(range(50, 101)))]
+
+
+def test_fetch_with_several_placeholders(run):
+    async def scenario(db):
+        return await db.fetch("SELECT id FROM test_items WHERE id IN (?, ?) ORDER BY id", (7, 99))
+
+    assert run(scenario) == [(7,), (99,)]
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT * FROM t WHERE a = ? AND b = ?", "SELECT * FROM t WHERE a = $1 AND b = $2"),
+    ("SELECT '?' FROM t WHERE a = ?", "SELECT '?' FROM t WHERE a = $1"),
+    ('SELECT "a?" FROM t WHERE name <> \'it\'\'s?\' AND a = ?',
+     'SELECT "a?" FROM t WHERE name <> \'it\'\'s?\' AND a = $1'),
+])
+def test_to_postgres_placeholders(sql, expected):
+    assert database.to_postgres(sql) == expected
+
+
+def test_status_rowcount():
+    assert database.status_rowcount("UPDATE 3") == 3
+    assert database.status_rowcount("INSERT 0 1") == 1
+    assert database.status_rowcount("CREATE TABLE") == -1
@@ -0,0 +1,106 @@
+"""
+Команда import_feed: потоковое чтение JSON и деактивация пропавших объектов
+"""
+
+import io
+import json
+import sqlite3
+
+import pytest
+
+from tests.fixtures import setup_django, synthetic_db
+
+ITEMS = [
+    {"id": f"ext-{i}", "title": f"Listing {i}", "region": "bali", "price": 1000 + i, "description": "x" * i}
+    for i in range(40)
+]
+
+
+@pytest.fixture
+def db_path():
+    path = synthetic_db()
+    setup_django(path)
+    return path
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return str(path)
+
+
+def read_json(path, **kwargs):
+    from admin_panel.management.commands.import_feed import read_json
+
+    return read_json(path, **kwargs)
+
+
+@pytest.mark.parametrize('text', [
+    json.dumps(ITEMS),
+    json.dumps(ITEMS, indent=2),
+    "\n".join(map(json.dumps, ITEMS)) + "\n",
+    " [ " + " ,\n\n , ".join(map(json.dumps, ITEMS)) + " ,\t] ",
+], ids=['array', 'indented', 'lines', 'separators'])
+def test_json_is_read_across_chunks(tmp_path, db_path, text):
+    # Блоки меньше объекта: объекты и разделители режутся в любом месте
+    path = write(tmp_path / 'feed.json', text)
+    for chunk_size in (16, 64, 1 << 16):
+        assert list(read_json(path, chunk_size=chunk_size, max_chunks=64)) == ITEMS
+
+
+def test_broken_json_fails_without_reading_whole_feed(tmp_path, db_path):
+    from django.core.management.base import CommandError
+
+    path = write(tmp_path / 'feed.json', "[" + json.dumps(ITEMS[0]) + ", {oops " + json.dumps(ITEMS) * 100 + "]")
+    items = []
+    with pytest.raises(CommandError, match="Некорректный JSON в фиде"):
+        for item in read_json(path, chunk_size=64, max_chunks=4):
+            items.append(item)
+    assert items == ITEMS[:1]
+
+    with pytest.raises(CommandError, match="в конце фида"):
+        list(read_json(write(tmp_path / 'cut.json', json.dumps(ITEMS)[:-30])))
+
+
+def import_feed(path, **options):
+    from django.core.management import call_command
+    from admin_panel.management.commands.import_feed import Command
+
+    stdout = io.StringIO()
+    call_command(Command(), path, source='partner', stdout=stdout, **options)
+    return stdout.getvalue()
+
+
+def active(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT external_id, is_active FROM properties WHERE source = 'partner'"))
+    finally:
+        conn.close()
+
+
+def test_missing_objects_are_deactivated(tmp_path, db_path):
+    import_feed(write(tmp_path / 'feed.json', json.dumps(ITEMS[:3])))
+    output = import_feed(write(tmp_path / 'feed2.json', json.dumps(ITEMS[:2])))
+    assert "деактивировано: 1" in output
+    assert active(db_path) == {"ext-0": 1, "ext-1": 1, "ext-2": 0}
+
+
+def test_skipped_rows_keep_their_objects(tmp_path, db_path):
+    import_feed(write(tmp_path / 'feed.json', json.dumps(ITEMS[:3])))
+    # Партнер прислал ext-1 без цены, ext-2 - с нечисловой: объекты не пропали из фида
+    broken = [ITEMS[0], {**ITEMS[1], "price": ""}, {**ITEMS[2], "price": "по запросу"}]
+    output = import_feed(write(tmp_path / 'feed2.json', json.dumps(broken)))
+    assert "деактивировано: 0, пропущено: 2" in output
+    assert active(db_path) == {"ext-0": 1, "ext-1": 1, "ext-2": 1}
+
+
+def test_feed_without_valid_rows_does_not_deactivate_source(tmp_path, db_path):
+    from django.core.management.base import CommandError
+
+    import_feed(write(tmp_path / 'feed.json', json.dumps(ITEMS[:3])))
+    for name, text in [('empty.json', "[]"), ('broken.json', json.dumps([{"title": "no id"}]))]:
+        with pytest.raises(CommandError, match="деактивация источника partner отменена"):
+            import_feed(write(tmp_path / name, text))
+    assert active(db_path) == {"ext-0": 1, "ext-1": 1, "ext-2": 1}
+    import_feed(write(tmp_path / 'empty.json', "[]"), no_deactivate=True)
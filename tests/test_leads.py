@@ -0,0 +1,92 @@
+"""
+Заявки с повторными доставками и двойными нажатиями: ровно один лид на заявку
+PostgreSQL проверяется, если задан DATABASE_URL или DB_ENGINE=postgres.
+"""
+
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from amocrm import LeadExporter
+from leads import LeadCapture
+from tests.fixtures import ENGINES, bot_database, reopen
+
+
+def lead_stream(properties, requests, users, seed=5):
+    """
+    Апдейты заявок: у каждой исходный апдейт, его повторные доставки и нажатия
+    той же кнопки новыми апдейтами; повторы идут после исходного, вперемешку с другими
+    """
+    rng = random.Random(seed)
+    pairs = set()
+    while len(pairs) < requests:
+        pairs.add((rng.randint(1, users), rng.choice(properties)))
+    groups, update_id = [], 0
+    for telegram_id, property_id in sorted(pairs):
+        update_id += 1
+        group = [(update_id, telegram_id, property_id)] * (1 + rng.choice([0, 0, 1, 3]))
+        for _ in range(rng.choice([0, 0, 1, 2])):
+            update_id += 1
+            group.append((update_id, telegram_id, property_id))
+        groups.append(group)
+    events = []
+    for group in groups:
+        position = rng.randint(0, len(events))
+        events[position:position] = group[:1]
+        for event in group[1:]:
+            events.insert(rng.randint(position + 1, len(events)), event)
+    return events
+
+
+def user(telegram_id):
+    return SimpleNamespace(id=telegram_id, username='', first_name=f"User {telegram_id}", last_name='')
+
+
+async def replay(captures, events):
+    for capture in captures:
+        await capture.start()
+    for i, (update_id, telegram_id, property_id) in enumerate(events):
+        # Апдейт попадает в один из процессов; повторная доставка - не обязательно в тот же
+        captures[(update_id + i) % len(captures)].capture(update_id, user(telegram_id), property_id)
+        if i % 50 == 0:
+            await asyncio.sleep(0)
+    for capture in captures:
+        await capture.close()
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_duplicate_stream_gives_one_lead_per_request(engine):
+    requests = 300
+
+    async def scenario():
+        db = await bot_database(engine, 40)
+        properties = [row[0] for row in await db.fetch("SELECT id FROM properties")]
+        events = lead_stream(properties, requests, users=100)
+        # У каждого "процесса" свои соединения с базой
+        connections = [reopen(db) for _ in range(3)]
+        for each in connections:
+            await each.start()
+        try:
+            exporter = LeadExporter(db, base_url='')
+            captures = [LeadCapture(each, exporter=exporter, batch_size=50) for each in connections[:2]]
+            await replay(captures, events)
+            # Перезапуск без памяти о недавних заявках: Telegram присылает все заново
+            restarted = LeadCapture(connections[2], exporter=exporter, batch_size=50)
+            await replay([restarted], events)
+            counts = await db.fetchone(
+                "SELECT COUNT(*), (SELECT COUNT(*) FROM (SELECT DISTINCT user_id, property_id FROM leads) d), "
+                "(SELECT COALESCE(SUM(leads), 0) FROM stats_daily), (SELECT COUNT(*) FROM amocrm_outbox) "
+                "FROM leads"
+            )
+        finally:
+            for each in [db, *connections]:
+                await each.close()
+        return len(events), sum(c.created for c in captures), restarted.created, tuple(counts)
+
+    events, created, created_again, (leads, distinct, counted, queued) = asyncio.run(scenario())
+    assert events > requests
+    assert created == requests and created_again == 0
+    assert leads == distinct == requests
+    assert counted == queued == requests
@@ -0,0 +1,25 @@
+"""
+Супервизор run_mvp.py: вывод дочерних процессов
+"""
+
+import asyncio
+import sys
+
+from run_mvp import Service
+
+# Длиннее лимита StreamReader (64 КиБ), затем обычная строка и строка без перевода строки
+CHILD = "import sys; print('x' * 200000); print('after'); sys.stdout.write('tail')"
+
+
+def test_long_output_line_does_not_stop_reading(capsys):
+    async def scenario():
+        service = Service('child', [sys.executable, '-c', CHILD])
+        await service._spawn()
+        await asyncio.wait_for(service._stream(service.process.stdout), 10)
+        return await service.process.wait()
+
+    assert asyncio.run(scenario()) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert all(line.startswith('[child] ') for line in lines)
+    assert ''.join(line[len('[child] '):] for line in lines[:-2]) == 'x' * 200000
+    assert lines[-2:] == ['[child] after', '[child] tail']
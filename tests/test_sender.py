@@ -0,0 +1,67 @@
+"""
+Лимит отправки: доли бота и рассылок из SEND_RATE
+Общее ведро в Redis проверяется, если задан REDIS_URL.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import pytest
+
+from tests.fixtures import ROOT
+
+REDIS = bool(os.getenv('REDIS_URL'))
+
+
+def import_sender(**env):
+    return subprocess.run(
+        [sys.executable, '-c', 'import sender'], cwd=ROOT, capture_output=True, text=True,
+        env={**os.environ, **env},
+    )
+
+
+def test_campaign_share_must_leave_rate_for_bot():
+    result = import_sender(SEND_RATE='30', CAMPAIGN_SEND_RATE='30', SEND_BUDGET='split')
+    assert result.returncode != 0
+    assert 'CAMPAIGN_SEND_RATE=30 не оставляет боту лимита' in result.stderr
+
+
+def test_shared_budget_gives_bot_the_whole_rate():
+    assert import_sender(SEND_RATE='30', CAMPAIGN_SEND_RATE='30', SEND_BUDGET='redis').returncode == 0
+
+
+@pytest.mark.skipif(not REDIS, reason="Redis: задайте REDIS_URL")
+def test_campaign_takes_only_what_bot_leaves():
+    from sender import RedisBudget
+
+    rate, reserve, seconds = 20, 5, 1.5
+
+    async def take(budget, deadline):
+        taken = 0
+        while time.monotonic() < deadline:
+            await budget.acquire()
+            taken += 1
+        return taken
+
+    async def scenario(with_bot):
+        key = f"test_send_budget:{uuid.uuid4().hex}"
+        campaign = RedisBudget(reserve=reserve, rate=rate, key=key)
+        bot = RedisBudget(rate=rate, key=key)
+        deadline = time.monotonic() + seconds
+        try:
+            takers = [take(campaign, deadline)] + ([take(bot, deadline)] if with_bot else [])
+            return await asyncio.gather(*takers)
+        finally:
+            await campaign.close()
+            await bot.close()
+
+    # Без бота рассылка получает весь лимит, с занятым ботом - в основном стартовый запас ведра
+    alone, = asyncio.run(scenario(with_bot=False))
+    shared, bot = asyncio.run(scenario(with_bot=True))
+    assert alone >= rate * seconds * 0.8
+    assert shared < alone / 2
+    assert bot >= rate * seconds * 0.8
@@ -0,0 +1,146 @@
+"""
+Ограничение частоты апдейтов: шарды ведер, очистка, повторные нажатия
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from throttling import MemoryLimiter, ThrottlingMiddleware
+
+
+class Callback:
+    """Нажатие кнопки: считает вызовы answer()"""
+
+    def __init__(self, data, fail=False):
+        self.data = data
+        self.fail = fail
+        self.answered = 0
+
+    async def answer(self):
+        self.answered += 1
+        if self.fail:
+            raise RuntimeError("query is too old")
+
+
+def update(user_id, callback=None):
+    event = SimpleNamespace(callback_query=callback)
+    return event, {"event_from_user": SimpleNamespace(id=user_id)}
+
+
+async def handled(event, data):
+    return "handled"
+
+
+def test_buckets_are_sharded_by_user():
+    async def scenario():
+        limiter = MemoryLimiter(shards=4)
+        for user_id in range(10):
+            await limiter.allow(user_id)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert len(limiter) == 10
+    assert [sorted(shard) for shard in limiter.shards] == [[0, 4, 8], [1, 5, 9], [2, 6], [3, 7]]
+
+
+def test_flood_is_cut_to_burst():
+    async def scenario():
+        middleware = ThrottlingMiddleware(MemoryLimiter(rate=0.001, burst=3))
+        results = [await middleware(handled, *update(1)) for _ in range(100)]
+        other = await middleware(handled, *update(2))
+        return middleware, results, other
+
+    middleware, results, other = asyncio.run(scenario())
+    assert results.count("handled") == 3
+    assert middleware.dropped == 97
+    # Лимит у каждого пользователя свой
+    assert other == "handled"
+
+
+def test_idle_buckets_are_evicted():
+    limiter = MemoryLimiter(idle=60, shards=2)
+
+    async def fill():
+        for user_id in range(6):
+            await limiter.allow(user_id)
+
+    asyncio.run(fill())
+    now = time.monotonic()
+    assert limiter.evict(limiter.shards[0], now=now) == 0
+    assert limiter.evict(limiter.shards[0], now=now + 61) == 3
+    assert len(limiter) == 3 and not limiter.shards[0]
+
+
+def test_eviction_walks_all_shards_in_background():
+    async def scenario():
+        # Шард раз в idle / shards = 0.01 с
+        limiter = MemoryLimiter(idle=0.04, shards=4)
+        for user_id in range(20):
+            await limiter.allow(user_id)
+        await limiter.start()
+        await asyncio.sleep(0.3)
+        await limiter.close()
+        return len(limiter)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_repeated_press_is_coalesced_while_handled():
+    async def scenario():
+        middleware = ThrottlingMiddleware(MemoryLimiter(rate=100, burst=100), duplicate_window=60)
+        release = asyncio.Event()
+
+        async def slow(event, data):
+            await release.wait()
+            return "handled"
+
+        first = asyncio.create_task(middleware(slow, *update(1, Callback("page:n:2"))))
+        await asyncio.sleep(0)
+        repeated = Callback("page:n:2")
+        results = [
+            await middleware(handled, *update(1, repeated)),
+            # Другая кнопка и та же кнопка у другого пользователя проходят
+            await middleware(handled, *update(1, Callback("page:n:3"))),
+            await middleware(handled, *update(2, Callback("page:n:2"))),
+        ]
+        release.set()
+        results.insert(0, await first)
+        # После обработки повтор отбрасывается еще duplicate_window секунд
+        late = Callback("page:n:2")
+        results.append(await middleware(handled, *update(1, late)))
+        return middleware, results, repeated, late
+
+    middleware, results, repeated, late = asyncio.run(scenario())
+    assert results == ["handled", None, "handled", "handled", None]
+    assert middleware.coalesced == 2 and middleware.dropped == 0
+    assert repeated.answered == late.answered == 1
+
+
+def test_press_after_window_is_handled():
+    async def scenario():
+        middleware = ThrottlingMiddleware(MemoryLimiter(rate=100, burst=100), duplicate_window=0)
+        return [await middleware(handled, *update(1, Callback("menu"))) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == ["handled"] * 3
+
+
+def test_dropped_callback_is_answered():
+    async def scenario():
+        middleware = ThrottlingMiddleware(MemoryLimiter(rate=0.001, burst=1))
+        first, dropped, failing = Callback("a"), Callback("b"), Callback("c", fail=True)
+        results = [await middleware(handled, *update(1, callback)) for callback in (first, dropped, failing)]
+        return results, [callback.answered for callback in (first, dropped, failing)]
+
+    results, answered = asyncio.run(scenario())
+    # Ошибка answer() у отброшенного нажатия не доходит до диспетчера
+    assert results == ["handled", None, None]
+    assert answered == [0, 1, 1]
+
+
+def test_updates_without_user_pass():
+    async def scenario():
+        middleware = ThrottlingMiddleware(MemoryLimiter(rate=0.001, burst=0))
+        return await middleware(handled, SimpleNamespace(callback_query=None), {})
+
+    assert asyncio.run(scenario()) == "handled"
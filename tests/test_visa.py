@@ -0,0 +1,104 @@
+"""
+Виза-ассистент: таблица решений совпадает с последовательным перебором правил
+по каждому сочетанию ответов в каждом регионе; ошибочные правила отклоняются.
+"""
+
+import asyncio
+import copy
+import itertools
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+from database import SQLiteDatabase
+from tests.fixtures import synthetic_db
+from visa import DEFAULT_RULES, SETTINGS_KEY, DecisionTable, VisaQuiz, match_rules
+
+RULES = DecisionTable(DEFAULT_RULES)
+IDS = [q.id for q in RULES.questions]
+OPTIONS = [[code for code, _ in q.options] for q in RULES.questions]
+
+
+def rules_with(**changes):
+    """Копия DEFAULT_RULES с заменой правил регионов"""
+    data = copy.deepcopy(DEFAULT_RULES)
+    data["version"] += 1
+    data["regions"].update(changes)
+    return data
+
+
+@pytest.mark.parametrize('region', RULES.regions)
+def test_table_matches_rules_for_every_combination(region):
+    combinations = list(itertools.product(*OPTIONS))
+    for answers in combinations:
+        expected = match_rules(DEFAULT_RULES["regions"][region], dict(zip(IDS, answers)))
+        assert expected is not None, (region, answers)
+        assert RULES.table[(region, *answers)] == expected
+        assert RULES.lookup(region, dict(zip(IDS, answers))) == expected
+    assert sum(key[0] == region for key in RULES.table) == len(combinations)
+
+
+def test_lookup_needs_all_answers():
+    assert RULES.lookup(RULES.regions[0], {IDS[0]: OPTIONS[0][0]}) is None
+    assert RULES.next_question({IDS[0]: OPTIONS[0][0]}).id == IDS[1]
+    assert RULES.next_question(dict(zip(IDS, (options[0] for options in OPTIONS)))) is None
+
+
+def test_region_keyboard_is_rebuilt_after_reset():
+    rules = DecisionTable(DEFAULT_RULES)
+    keyboard = rules.region_keyboard()
+    assert rules.region_keyboard() is keyboard
+    rules.reset_region_keyboard()
+    assert rules.region_keyboard() is not keyboard
+
+
+def test_uncovered_combination_is_rejected():
+    # Без последнего правила (без условий) часть ответов остается без рекомендации
+    with pytest.raises(ValueError, match="Нет правила"):
+        DecisionTable(rules_with(bali=DEFAULT_RULES["regions"]["bali"][:-1]))
+
+
+@pytest.mark.parametrize('when', [{"unknown": ["x"]}, {IDS[0]: ["unknown"]}])
+def test_unknown_question_or_answer_is_rejected(when):
+    rules = [{"when": when, "visa": "-", "details": "-"}] + DEFAULT_RULES["regions"]["bali"]
+    with pytest.raises(ValueError, match="не совпадает с вопросами"):
+        DecisionTable(rules_with(bali=rules))
+
+
+def test_reload_from_settings_keeps_previous_version_on_error():
+    from bot_settings import BotSettings
+
+    broken = rules_with(bali=DEFAULT_RULES["regions"]["bali"][:-1])
+    fixed = rules_with()
+    fixed["version"] = broken["version"] + 1
+    path = synthetic_db()
+
+    async def scenario():
+        db = SQLiteDatabase(path)
+        await db.start()
+        settings = BotSettings(db, refresh_interval=3600)
+        quiz = VisaQuiz(settings)
+        await settings.start()
+        versions = []
+        try:
+            for data in (broken, fixed):
+                now = str(datetime.now(timezone.utc))
+                conn = sqlite3.connect(path)
+                with conn:
+                    conn.execute(
+                        "INSERT INTO bot_settings (key, value, description, created_at, updated_at) "
+                        "VALUES (?, ?, '', ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                        "value = excluded.value, updated_at = excluded.updated_at",
+                        (SETTINGS_KEY, json.dumps(data), now, now),
+                    )
+                conn.close()
+                await settings.refresh()
+                versions.append(quiz.rules.version)
+        finally:
+            await settings.close()
+            await db.close()
+        return versions
+
+    assert asyncio.run(scenario()) == [DEFAULT_RULES["version"], fixed["version"]]
@@ -0,0 +1,72 @@
+"""
+Многопроцессный режим: апдейт подтверждается только после записи буферов бота
+"""
+
+import asyncio
+import os
+import time
+
+from aiogram import Bot, Dispatcher
+
+import workers
+
+
+class BufferedWriter:
+    """Буфер, который сам в файл не пишет (как ProfileWriter с большим flush_interval)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.buffer = []
+
+    async def flush(self):
+        with open(self.path, 'a') as log:
+            log.writelines(f"{message_id}\n" for message_id in self.buffer)
+        self.buffer.clear()
+
+
+def buffered_app():
+    """Процесс-обработчик: каждый апдейт попадает только в буфер profile_writer"""
+    dp = Dispatcher()
+    writer = BufferedWriter(os.environ['TEST_LOG'])
+    dp["profile_writer"] = writer
+
+    @dp.message()
+    async def handler(message):
+        writer.buffer.append(message.message_id)
+
+    return dp, Bot(token="123456:TEST-TOKEN")
+
+
+def message_update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "text": "/start",
+        },
+    }
+
+
+def test_acknowledged_updates_are_written(tmp_path):
+    log_path = tmp_path / 'written.log'
+
+    async def scenario():
+        ingestion = workers.Ingestion(
+            workers=2, app='tests.test_workers:buffered_app', env={'TEST_LOG': str(log_path)},
+        )
+        await ingestion.start()
+        try:
+            for i in range(200):
+                await ingestion.put(message_update(i, i % 20))
+            await ingestion.join()
+            # Все апдейты подтверждены, обработчики еще работают
+            return ingestion.acked, log_path.read_text().split()
+        finally:
+            await ingestion.close()
+
+    acked, written = asyncio.run(scenario())
+    assert acked == 200
+    assert sorted(map(int, written)) == list(range(200))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Ограничение частоты апдейтов от одного пользователя
+Внешний middleware диспетчера: у каждого пользователя свое ведро токенов.
+Апдейты сверх лимита отбрасываются до обработчиков, нажатия кнопок
+закрываются пустым callback.answer(), чтобы у пользователя не висели часики.
+Повторное нажатие той же кнопки, пока первое еще обрабатывается, тоже
+отбрасывается: иначе каждое нажатие стоит лишнего edit_text.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from aiogram import BaseMiddleware
+
+from fsm_storage import get_redis_url
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Апдейтов в секунду на пользователя и сколько можно прислать подряд
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', 2))
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', 5))
+# Через сколько секунд без апдейтов пользователь забывается
+THROTTLE_IDLE = float(os.getenv('THROTTLE_IDLE', 600))
+# Сколько секунд после обработки нажатие той же кнопки считается повтором
+DUPLICATE_WINDOW = float(os.getenv('THROTTLE_DUPLICATE_WINDOW', 1))
+
+REDIS_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return allowed
+"""
+
+
+class MemoryLimiter:
+    """
+    Ведра пользователей в памяти процесса
+
+    Ведра разложены по shards словарям по user_id. Неактивные ведра удаляются
+    по одному шарду за раз, поэтому очистка не останавливает цикл событий
+    даже при сотнях тысяч пользователей.
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST, idle=THROTTLE_IDLE, shards=64):
+        self.rate = rate
+        self.burst = burst
+        self.idle = idle
+        self.shards = [{} for _ in range(shards)]
+        self._next_shard = 0
+        self._task = None
+
+    def __len__(self):
+        return sum(map(len, self.shards))
+
+    async def allow(self, user_id):
+        """Можно ли обработать апдейт пользователя"""
+        shard = self.shards[user_id % len(self.shards)]
+        bucket = shard.get(user_id)
+        if bucket is None:
+            bucket = shard[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket.try_acquire()
+
+    def evict(self, shard, now=None):
+        """Удаление ведер, которые не трогали дольше idle секунд"""
+        deadline = (now or time.monotonic()) - self.idle
+        idle = [user_id for user_id, bucket in shard.items() if bucket.updated < deadline]
+        for user_id in idle:
+            del shard[user_id]
+        return len(idle)
+
+    async def _evict_periodically(self):
+        # За idle секунд обходим все шарды
+        interval = self.idle / len(self.shards)
+        while True:
+            await asyncio.sleep(interval)
+            self.evict(self.shards[self._next_shard])
+            self._next_shard = (self._next_shard + 1) % len(self.shards)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._evict_periodically())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class RedisLimiter:
+    """Ведра пользователей в Redis: общий лимит для нескольких процессов бота"""
+
+    def __init__(self, url=None, rate=THROTTLE_RATE, burst=THROTTLE_BURST, idle=THROTTLE_IDLE,
+                 prefix='throttle'):
+        from redis import asyncio as aioredis
+
+        self.rate = rate
+        self.burst = burst
+        self.idle = int(idle)
+        self.prefix = prefix
+        self.redis = aioredis.from_url(url or get_redis_url())
+        self.script = self.redis.register_script(REDIS_SCRIPT)
+
+    async def allow(self, user_id):
+        """Можно ли обработать апдейт пользователя (при недоступном Redis - можно)"""
+        try:
+            return bool(await self.script(
+                keys=[f"{self.prefix}:{user_id}"],
+                args=[self.rate, self.burst, time.time(), self.idle],
+            ))
+        except Exception as e:
+            logger.warning(f"Redis недоступен для ограничения частоты: {e}")
+            return True
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_limiter(backend=None):
+    """Создание хранилища ведер по переменной THROTTLE_STORAGE (memory, redis)"""
+    backend = backend or os.getenv('THROTTLE_STORAGE', 'memory')
+    if backend == 'memory':
+        return MemoryLimiter()
+    if backend == 'redis':
+        return RedisLimiter()
+    raise ValueError(f"Неизвестное хранилище ограничения частоты: {backend}")
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для dp.update
+
+    Регистрируется после UserContextMiddleware диспетчера и берет
+    пользователя из data["event_from_user"].
+    """
+
+    def __init__(self, limiter=None, duplicate_window=DUPLICATE_WINDOW):
+        # MemoryLimiter без ведер пуст (len() == 0), поэтому проверка на None
+        self.limiter = limiter if limiter is not None else MemoryLimiter()
+        self.duplicate_window = duplicate_window
+        # (user_id, callback_data) -> до какого времени нажатие считается повтором
+        self.pressed = {}
+        self._purge_at = 0.0
+        self.dropped = 0
+        self.coalesced = 0
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        callback = event.callback_query
+        key = None
+        if callback is not None:
+            key = (user.id, callback.data)
+            now = time.monotonic()
+            until = self.pressed.get(key)
+            if until is not None and until > now:
+                self.coalesced += 1
+                return await self._drop(callback)
+
+        if not await self.limiter.allow(user.id):
+            self.dropped += 1
+            return await self._drop(callback)
+
+        if key is None:
+            return await handler(event, data)
+        # Пока нажатие обрабатывается, повторы отбрасываются без ограничения по времени
+        self.pressed[key] = float('inf')
+        try:
+            return await handler(event, data)
+        finally:
+            now = time.monotonic()
+            self.pressed[key] = now + self.duplicate_window
+            if now > self._purge_at:
+                self._purge(now)
+
+    async def _drop(self, callback):
+        if callback is None:
+            return None
+        try:
+            await callback.answer()
+        except Exception as e:
+            logger.debug(f"Не удалось ответить на отброшенный callback: {e}")
+        return None
+
+    def _purge(self, now):
+        """Удаление устаревших нажатий, не чаще раза в duplicate_window"""
+        self._purge_at = now + max(self.duplicate_window, 1)
+        for key in [key for key, until in self.pressed.items() if until <= now]:
+            del self.pressed[key]
+
+    async def start(self):
+        await self.limiter.start()
+
+    async def close(self):
+        await self.limiter.close()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Виза-ассистент: квиз из трех вопросов по региону пользователя
+Правила по регионам хранятся данными (DEFAULT_RULES или JSON в bot_settings
+под ключом visa_rules) и при загрузке компилируются в плоскую таблицу
+{(регион, ответ, ответ, ответ): рекомендация}: ответ на квиз - один поиск
+по словарю. Правила версионируются; при замене правил в bot_settings таблица
+пересобирается без перезапуска, а начатые по старой версии квизы
+начинаются заново.
+"""
+
+import itertools
+import logging
+from collections import namedtuple
+
+from callbacks import pack
+from keyboards import build_keyboard, load_regions
+
+logger = logging.getLogger(__name__)
+
+# Ключ bot_settings с правилами (тот же формат, что DEFAULT_RULES)
+SETTINGS_KEY = "visa_rules"
+
+Question = namedtuple('Question', ['id', 'text', 'options'])
+Verdict = namedtuple('Verdict', ['title', 'details'])
+
+# Правила: вопросы и по каждому региону список {"when": {вопрос: [ответы]}, ...}.
+# Побеждает первое подходящее правило; вопрос без условия - любой ответ.
+DEFAULT_RULES = {
+    "version": 1,
+    "questions": [
+        {
+            "id": "goal",
+            "text": "Какая основная цель переезда?",
+            "options": [
+                ["remote", "💻 Удаленная работа"],
+                ["business", "🏢 Бизнес или инвестиции"],
+                ["living", "🌴 Жизнь без работы"],
+            ],
+        },
+        {
+            "id": "stay",
+            "text": "Как долго планируете жить в стране?",
+            "options": [
+                ["short", "📅 До 3 месяцев"],
+                ["year", "🗓️ До года"],
+                ["long", "🏡 Больше года"],
+            ],
+        },
+        {
+            "id": "income",
+            "text": "Какой у вас ежемесячный доход?",
+            "options": [
+                ["low", "💵 До $2 000"],
+                ["mid", "💰 $2 000 - $5 000"],
+                ["high", "💎 Больше $5 000"],
+            ],
+        },
+    ],
+    "regions": {
+        "phuket": [
+            {"when": {"stay": ["short"]}, "visa": "Безвизовый въезд",
+             "details": "До 60 дней без визы, можно продлить на 30 дней в иммиграционном офисе."},
+            {"when": {"goal": ["remote"], "income": ["mid", "high"]}, "visa": "Destination Thailand Visa (DTV)",
+             "details": "Виза на 5 лет для удаленщиков, до 180 дней за въезд. Нужно 500 000 THB на счете."},
+            {"when": {"goal": ["business"]}, "visa": "Non-B + Work Permit",
+             "details": "Бизнес-виза через тайскую компанию; для крупных инвесторов - LTR на 10 лет."},
+            {"when": {"income": ["high"], "stay": ["long"]}, "visa": "Thailand Privilege",
+             "details": "Платная резидентская программа на 5-20 лет, от 900 000 THB."},
+            {"when": {}, "visa": "Туристическая виза TR",
+             "details": "60 дней с продлением на 30; для долгого проживания - учебная виза ED."},
+        ],
+        "bali": [
+            {"when": {"stay": ["short"]}, "visa": "Visa on Arrival (B1)",
+             "details": "30 дней по прилете, продление еще на 30 дней."},
+            {"when": {"goal": ["remote"], "income": ["high"]}, "visa": "Remote Worker KITAS (E33G)",
+             "details": "Год для удаленщиков с доходом от $60 000 в год от работодателя за рубежом."},
+            {"when": {"goal": ["business"]}, "visa": "Investor KITAS (E28A)",
+             "details": "ВНЖ инвестора через компанию PT PMA, от 10 млрд IDR вложений."},
+            {"when": {"income": ["high"], "stay": ["long"]}, "visa": "Second Home Visa",
+             "details": "ВНЖ на 5-10 лет при депозите 2 млрд IDR в индонезийском банке."},
+            {"when": {}, "visa": "Туристическая виза C1",
+             "details": "60 дней с продлениями до 180 дней, оформляется заранее онлайн."},
+        ],
+        "georgia": [
+            {"when": {"stay": ["short", "year"]}, "visa": "Безвизовый режим",
+             "details": "До года без визы и регистрации, можно работать и открыть ИП с налогом 1%."},
+            {"when": {"goal": ["business"]}, "visa": "Инвестиционный ВНЖ",
+             "details": "ВНЖ при инвестициях от $300 000 в бизнес или трудовой ВНЖ через свою компанию."},
+            {"when": {}, "visa": "ВНЖ за недвижимость",
+             "details": "Временный ВНЖ при покупке недвижимости от $100 000."},
+        ],
+        "turkey": [
+            {"when": {"stay": ["short"]}, "visa": "Безвизовый въезд",
+             "details": "До 60 дней без визы (не больше 90 дней за 180)."},
+            {"when": {"goal": ["business"], "income": ["high"]}, "visa": "Гражданство за инвестиции",
+             "details": "Паспорт при покупке недвижимости от $400 000 с запретом продажи 3 года."},
+            {"when": {"goal": ["business"]}, "visa": "Рабочий ВНЖ через компанию",
+             "details": "Регистрация компании и разрешение на работу для себя как сотрудника."},
+            {"when": {}, "visa": "Туристический ВНЖ (ikamet)",
+             "details": "ВНЖ на 1-2 года по договору аренды или покупке жилья."},
+        ],
+        "cyprus": [
+            {"when": {"stay": ["short"]}, "visa": "Национальная виза Кипра (pro-visa)",
+             "details": "Бесплатная электронная виза до 90 дней."},
+            {"when": {"goal": ["remote"], "income": ["high"]}, "visa": "Digital Nomad Visa",
+             "details": "До 3 лет для удаленщиков с доходом от €3 500 в месяц."},
+            {"when": {"goal": ["business"]}, "visa": "Бизнес-ВНЖ",
+             "details": "ВНЖ для сотрудников компании с иностранным капиталом, семья - вместе с вами."},
+            {"when": {"income": ["high"]}, "visa": "ПМЖ за инвестиции",
+             "details": "Постоянное проживание при покупке новой недвижимости от €300 000."},
+            {"when": {}, "visa": "Временный ВНЖ (Pink Slip)",
+             "details": "ВНЖ на год с продлением при подтвержденном доходе из-за рубежа."},
+        ],
+    },
+}
+
+
+def match_rules(rules, answers):
+    """Первое правило, подходящее под ответы {вопрос: ответ} (медленный путь для проверки)"""
+    for rule in rules:
+        if all(answers[question] in allowed for question, allowed in rule["when"].items()):
+            return Verdict(rule["visa"], rule["details"])
+    return None
+
+
+class DecisionTable:
+    """
+    Скомпилированные правила одной версии
+
+    table: {(регион, ответ на 1-й вопрос, ...): Verdict} по всем сочетаниям
+    ответов. Если какое-то сочетание не покрыто правилами или правила
+    ссылаются на несуществующие вопросы/ответы, компиляция падает с
+    ValueError, и бот продолжает работать на прежней версии.
+    """
+
+    def __init__(self, data):
+        self.version = data["version"]
+        self.questions = [
+            Question(q["id"], q["text"], [tuple(option) for option in q["options"]])
+            for q in data["questions"]
+        ]
+        self.regions = list(data["regions"])
+        self.table = self._compile(data["regions"])
+        self._keyboards = {}
+
+    def _compile(self, regions):
+        choices = {q.id: {code for code, _ in q.options} for q in self.questions}
+        table, unresolved = {}, []
+        for region, rules in regions.items():
+            for rule in rules:
+                for question, allowed in rule["when"].items():
+                    if question not in choices or not set(allowed) <= choices[question]:
+                        raise ValueError(f"{region}: условие {question}={allowed} не совпадает с вопросами")
+            for combination in itertools.product(*(sorted(choices[q.id]) for q in self.questions)):
+                verdict = match_rules(rules, dict(zip(choices, combination)))
+                if verdict is None:
+                    unresolved.append((region, *combination))
+                else:
+                    table[(region, *combination)] = verdict
+        if unresolved:
+            raise ValueError(f"Нет правила для ответов: {unresolved[:5]} (всего {len(unresolved)})")
+        return table
+
+    def lookup(self, region, answers):
+        """Рекомендация по ответам {вопрос: ответ}; None, если ответов не хватает"""
+        return self.table.get((region, *(answers.get(q.id) for q in self.questions)))
+
+    def next_question(self, answers):
+        """Первый вопрос без ответа (None, если ответы полные)"""
+        for question in self.questions:
+            if question.id not in answers:
+                return question
+        return None
+
+    def keyboard(self, question):
+        """Клавиатура вопроса (собирается один раз на версию правил)"""
+        keyboard = self._keyboards.get(question.id)
+        if keyboard is None:
+            keyboard = self._keyboards[question.id] = build_keyboard(
+                [[(title, pack("quiz", question.id, code))] for code, title in question.options]
+                + [[("🏠 Главное меню", "menu")]]
+            )
+        return keyboard
+
+    def region_keyboard(self):
+        """Выбор региона, если его нет в профиле (регионы с правилами)"""
+        keyboard = self._keyboards.get(None)
+        if keyboard is None:
+            keyboard = self._keyboards[None] = build_keyboard(
+                [[(title, pack("quiz", "region", code))] for code, title in load_regions() if code in self.regions]
+                + [[("🏠 Главное меню", "menu")]]
+            )
+        return keyboard
+
+    def reset_region_keyboard(self):
+        """Сброс клавиатуры выбора региона (изменились названия регионов)"""
+        self._keyboards.pop(None, None)
+
+
+class VisaQuiz:
+    """Текущие правила виза-ассистента с перезагрузкой из bot_settings"""
+
+    def __init__(self, settings=None):
+        self.settings = settings
+        self.rules = DecisionTable(DEFAULT_RULES)
+        if settings is not None:
+            settings.on_change(self._settings_changed)
+
+    def _settings_changed(self, keys):
+        if SETTINGS_KEY in keys:
+            self.reload(self.settings.get(SETTINGS_KEY) or DEFAULT_RULES)
+        elif "regions" in keys:
+            # Названия регионов в клавиатуре выбора региона
+            self.rules.reset_region_keyboard()
+
+    def reload(self, data):
+        """Замена правил; при ошибке в правилах остаются прежние"""
+        try:
+            rules = DecisionTable(data)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Правила визового квиза не загружены, остается версия {self.rules.version}: {e}")
+            return False
+        self.rules = rules
+        logger.info(f"Правила визового квиза: версия {rules.version}, {len(rules.table)} сочетаний")
+        return True
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Webhook-режим бота ReloCompass
+aiohttp-сервер принимает апдейты от Telegram, кладет их в ограниченные очереди
+и отдает пулу воркеров диспетчера. Апдейты одного чата всегда обрабатывает
+один и тот же воркер, поэтому порядок внутри чата сохраняется.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.getenv('BOT_WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+# Сколько ждать места в очереди, прежде чем вернуть Telegram 503 (он повторит апдейт)
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', 1.0))
+
+
+def get_chat_id(update):
+    """Чат апдейта по сырому JSON (без разбора в pydantic-модели)"""
+    for key, event in update.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+    return update.get('update_id', 0)
+
+
+class UpdateQueue:
+    """
+    Очереди апдейтов и пул воркеров
+
+    Каждый воркер читает свою очередь, чат закрепляется за воркером по
+    chat_id % workers. Суммарная емкость очередей равна queue_size.
+    """
+
+    def __init__(self, dp, bot, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE,
+                 enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT, on_done=None):
+        self.dp = dp
+        self.bot = bot
+        # None - ждать места в очереди без ограничения (обратное давление на источник)
+        self.enqueue_timeout = enqueue_timeout
+        # Вызывается с апдейтом после обработки (в том числе неудачной)
+        self.on_done = on_done
+        per_worker = max(1, queue_size // workers)
+        self.queues = [asyncio.Queue(maxsize=per_worker) for _ in range(workers)]
+        self.tasks = []
+        self.accepting = False
+
+        # Метрики
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=10000)
+
+    def start(self):
+        """Запуск воркеров"""
+        self.accepting = True
+        self.tasks = [
+            asyncio.create_task(self._worker(queue)) for queue in self.queues
+        ]
+
+    async def put(self, update):
+        """Постановка апдейта в очередь его чата; False, если очередь переполнена"""
+        if not self.accepting:
+            return False
+        queue = self.queues[hash(get_chat_id(update)) % len(self.queues)]
+        try:
+            await asyncio.wait_for(
+                queue.put((time.perf_counter(), update)), self.enqueue_timeout
+            )
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        self.received += 1
+        return True
+
+    async def _worker(self, queue):
+        while True:
+            enqueued_at, update = await queue.get()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+            finally:
+                self.latencies.append(time.perf_counter() - enqueued_at)
+                queue.task_done()
+                if self.on_done is not None:
+                    self.on_done(update)
+
+    async def drain(self):
+        """Плавная остановка: перестаем принимать и дожидаемся обработки очередей"""
+        self.accepting = False
+        await asyncio.gather(*(queue.join() for queue in self.queues))
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def metrics(self):
+        """Метрики очередей (глубина, отказы, задержка обработки)"""
+        latencies = sorted(self.latencies)
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+        return {
+            "accepting": self.accepting,
+            "queued": sum(queue.qsize() for queue in self.queues),
+            "capacity": sum(queue.maxsize for queue in self.queues),
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "p99_latency_ms": round(p99, 3),
+        }
+
+
+def create_app(dp, bot, path='/webhook', **queue_kwargs):
+    """aiohttp-приложение с обработчиком webhook и метриками"""
+    updates = UpdateQueue(dp, bot, **queue_kwargs)
+
+    async def handle_update(request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        try:
+            update = await request.json(loads=json.loads)
+        except ValueError:
+            return web.Response(status=400)
+        if not await updates.put(update):
+            # Telegram повторит доставку позже
+            return web.Response(status=503)
+        return web.Response()
+
+    async def handle_metrics(request):
+        return web.json_response(updates.metrics())
+
+    async def on_startup(app):
+        updates.start()
+        await dp.emit_startup(bot=bot)
+
+    async def on_shutdown(app):
+        logger.info("Дожидаемся обработки очереди апдейтов...")
+        await updates.drain()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+    app = web.Application()
+    app['updates'] = updates
+    app.router.add_post(path, handle_update)
+    app.router.add_get('/metrics', handle_metrics)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+async def run_webhook(dp, bot, webhook_url):
+    """Регистрация webhook в Telegram и запуск сервера"""
+    path = urlparse(webhook_url).path or '/webhook'
+    app = create_app(dp, bot, path=path)
+
+    await bot.set_webhook(
+        webhook_url,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{path}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Многопроцессный режим бота ReloCompass
+Один процесс приема получает апдейты от Telegram (long polling или webhook)
+и раздает их BOT_WORKERS процессам-обработчикам. Чат закрепляется за
+обработчиком rendezvous-хешированием по chat_id, поэтому апдейты одного чата
+обрабатываются по порядку в одном процессе. FSM-состояния общие (Redis или
+SQLite без кэша в памяти).
+
+Апдейт считается обработанным, когда обработчик подтвердил его через
+ACK_FD (после записи в базу FSM, профилей и лидов). Если обработчик упал, его неподтвержденные
+апдейты отдаются оставшимся, а на упавший приходятся только его чаты: чаты
+остальных не переезжают. Упавший обработчик перезапускается с паузой.
+
+python workers.py            - прием апдейтов и BOT_WORKERS обработчиков
+python workers.py --worker   - один обработчик (запускается процессом приема)
+"""
+
+import asyncio
+import importlib
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+
+import database
+from webhook import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, UpdateQueue, get_chat_id
+
+logger = logging.getLogger(__name__)
+
+BOT_WORKERS = int(os.getenv('BOT_WORKERS') or os.cpu_count() or 1)
+# Фабрика "модуль:функция", возвращающая (dp, bot) для процесса-обработчика
+WORKER_APP = os.getenv('WORKER_APP', 'workers:create_bot_app')
+# Сколько апдейтов процесс-обработчик держит в обработке одновременно
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 64))
+# Неподтвержденных апдейтов на обработчик, после чего прием ждет
+WORKER_MAX_INFLIGHT = int(os.getenv('WORKER_MAX_INFLIGHT', 1000))
+# Как часто обработчик сохраняет FSM и отправляет подтверждения (секунды)
+ACK_INTERVAL = 0.02
+# Пауза перед перезапуском упавшего обработчика: от MIN до MAX, удваивается
+RESTART_BACKOFF_MIN = 1.0
+RESTART_BACKOFF_MAX = 30.0
+# Long polling getUpdates (секунды)
+POLL_TIMEOUT = 30
+
+
+def create_bot_app():
+    """
+    Диспетчер и бот из bot_simple; лимит отправки делится между обработчиками
+    (с SEND_BUDGET=redis его и так делит общее ведро), лиды в AmoCRM выгружает
+    только обработчик 0 (лимит AMOCRM_RATE - на всех)
+    """
+    import bot_simple
+    from sender import BOT_SEND_RATE, SEND_BUDGET
+
+    workers = int(os.getenv('BOT_WORKERS_TOTAL', 1))
+    dp = bot_simple.create_dispatcher(export_leads=os.getenv('WORKER_INDEX', '0') == '0')
+    send_rate = BOT_SEND_RATE if SEND_BUDGET == 'redis' else BOT_SEND_RATE / workers
+    return dp, bot_simple.create_bot(dp, send_rate=send_rate)
+
+
+def load_app(spec):
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)()
+
+
+# Процесс-обработчик
+
+async def run_worker():
+    """Апдейты построчно из stdin, подтверждения - в ACK_FD"""
+    loop = asyncio.get_running_loop()
+    ack_fd = int(os.environ['ACK_FD'])
+    dp, bot = load_app(WORKER_APP)
+    storage = dp.fsm.storage
+    # Буферы записи бота: подтвержденный апдейт не должен пропасть при падении
+    # обработчика. Лиды пишутся первыми (LeadCapture сам дописывает их профили)
+    writers = [dp.workflow_data[name] for name in ('lead_capture', 'profile_writer') if name in dp.workflow_data]
+    done = []
+
+    updates = UpdateQueue(
+        dp, bot, workers=WORKER_CONCURRENCY, queue_size=WORKER_CONCURRENCY * 4,
+        enqueue_timeout=None, on_done=lambda update: done.append(update['update_id']),
+    )
+
+    async def send_acks():
+        if not done:
+            return
+        batch = done[:]
+        del done[:]
+        try:
+            for writer in writers:
+                await writer.flush()
+            # Состояния должны быть в общей базе раньше, чем чат сможет переехать
+            if hasattr(storage, 'flush'):
+                await storage.flush()
+        except Exception as e:
+            # Без подтверждения апдейты повторятся, если обработчик упадет
+            logger.error(f"Запись перед подтверждением не удалась, повторим: {e}")
+            done[:0] = batch
+            return
+        os.write(ack_fd, ''.join(f"{update_id}\n" for update_id in batch).encode())
+
+    async def send_acks_periodically():
+        while True:
+            await asyncio.sleep(ACK_INTERVAL)
+            await send_acks()
+
+    await dp.emit_startup(bot=bot)
+    updates.start()
+    acks = asyncio.create_task(send_acks_periodically())
+    os.write(ack_fd, b"ready\n")
+
+    reader = asyncio.StreamReader(limit=2 ** 22)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            # Очередь ограничена: пока она полна, stdin не читается и прием ждет
+            await updates.put(json.loads(line))
+    finally:
+        # stdin закрыт - дорабатываем очередь, отправляем последние подтверждения
+        await updates.drain()
+        acks.cancel()
+        await send_acks()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        os.close(ack_fd)
+
+
+# Процесс приема
+
+class Worker:
+    """Процесс-обработчик с точки зрения процесса приема"""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.alive = False
+        self.ready = asyncio.Event()
+        # update_id -> (chat_id, апдейт) до подтверждения
+        self.inflight = {}
+        self.room = asyncio.Event()
+        self.room.set()
+        # Падений подряд (для паузы перед перезапуском)
+        self.crashes = 0
+
+    def weight(self, chat_id):
+        """Вес rendezvous-хеширования: чат достается живому обработчику с наибольшим весом"""
+        return hash((chat_id, self.index))
+
+
+class Ingestion:
+    """Маршрутизация апдейтов по процессам-обработчикам"""
+
+    def __init__(self, workers=BOT_WORKERS, app=WORKER_APP, env=None):
+        self.workers = [Worker(i) for i in range(workers)]
+        self.app = app
+        self.env = env or {}
+        # chat_id -> [обработчик, неподтвержденных апдейтов]: чат не переезжает, пока они есть
+        self.chats = {}
+        self.any_alive = asyncio.Event()
+        # Сброшено, пока апдейты упавшего обработчика ждут нового владельца:
+        # новые апдейты не должны их обогнать
+        self.redelivered_all = asyncio.Event()
+        self.redelivered_all.set()
+        self._redelivering = 0
+        self.acked = 0
+        self.redelivered = 0
+        self._stopping = False
+        self._tasks = set()
+
+    def _spawn_task(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    # Обработчики
+
+    async def _start_worker(self, worker):
+        read_fd, write_fd = os.pipe()
+        env = {
+            **os.environ, **self.env,
+            'ACK_FD': str(write_fd),
+            'WORKER_APP': self.app,
+            'WORKER_INDEX': str(worker.index),
+            'BOT_WORKERS_TOTAL': str(len(self.workers)),
+            # Состояния FSM пишут все обработчики: хранилище в базе без кэша в памяти
+            'FSM_CACHE_SIZE': '0',
+        }
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--worker',
+            stdin=asyncio.subprocess.PIPE, env=env, pass_fds=(write_fd,),
+        )
+        os.close(write_fd)
+        self._spawn_task(self._watch(worker, read_fd))
+
+    async def _watch(self, worker, read_fd):
+        """Подтверждения обработчика и его завершение"""
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, 'rb')
+        )
+        started = time.monotonic()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line == b"ready\n":
+                    worker.alive = True
+                    worker.ready.set()
+                    self.any_alive.set()
+                    logger.info(f"Обработчик {worker.index} готов за {time.monotonic() - started:.1f} с")
+                else:
+                    self._ack(worker, int(line))
+        finally:
+            transport.close()
+        code = await worker.process.wait()
+        await self._worker_exited(worker, code, time.monotonic() - started)
+
+    def _ack(self, worker, update_id):
+        entry = worker.inflight.pop(update_id, None)
+        if entry is None:
+            return
+        self.acked += 1
+        owner = self.chats.get(entry[0])
+        if owner is not None and owner[0] is worker:
+            owner[1] -= 1
+            if not owner[1]:
+                del self.chats[entry[0]]
+        if len(worker.inflight) < WORKER_MAX_INFLIGHT:
+            worker.room.set()
+
+    async def _worker_exited(self, worker, code, uptime):
+        worker.alive = False
+        worker.ready.clear()
+        worker.room.set()
+        if not any(w.alive for w in self.workers):
+            self.any_alive.clear()
+        pending = sorted(worker.inflight.items())
+        worker.inflight.clear()
+        for chat_id in [chat_id for chat_id, owner in self.chats.items() if owner[0] is worker]:
+            del self.chats[chat_id]
+        if self._stopping:
+            return
+        logger.error(
+            f"Обработчик {worker.index} завершился с кодом {code}, "
+            f"апдейтов передано другим: {len(pending)}"
+        )
+        # Неподтвержденные апдейты - новым владельцам чатов, в исходном порядке
+        self.redelivered += len(pending)
+        self._redelivering += 1
+        self.redelivered_all.clear()
+        try:
+            await self.any_alive.wait()
+            await self._redeliver([update for _, (_, update) in pending])
+        finally:
+            self._redelivering -= 1
+            if not self._redelivering:
+                self.redelivered_all.set()
+        # Проработавший минуту обработчик считается стабильным: пауза сбрасывается
+        worker.crashes = 0 if uptime > 60 else worker.crashes + 1
+        await asyncio.sleep(min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_MIN * 2 ** (worker.crashes - 1)))
+        if not self._stopping:
+            await self._start_worker(worker)
+
+    async def _redeliver(self, updates):
+        """
+        Передача апдейтов без переключений между записями: новый апдейт чата
+        попадет в stdin обработчика только после переданных (лимит inflight
+        здесь не проверяется)
+        """
+        targets = set()
+        for update in updates:
+            worker = self.route(get_chat_id(update))
+            if self._send(worker, update):
+                targets.add(worker)
+        for worker in targets:
+            try:
+                await worker.process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    # Маршрутизация
+
+    def route(self, chat_id):
+        """Обработчик чата: текущий, если у него есть апдейты чата, иначе по весу"""
+        owner = self.chats.get(chat_id)
+        if owner is not None and owner[0].alive:
+            return owner[0]
+        alive = [worker for worker in self.workers if worker.alive]
+        return max(alive, key=lambda worker: worker.weight(chat_id)) if alive else None
+
+    async def put(self, update):
+        """Передача апдейта обработчику его чата (ждет, если все заняты или упали)"""
+        chat_id = get_chat_id(update)
+        while True:
+            if not self.redelivered_all.is_set():
+                await self.redelivered_all.wait()
+                continue
+            worker = self.route(chat_id)
+            if worker is None:
+                await self.any_alive.wait()
+                continue
+            if len(worker.inflight) >= WORKER_MAX_INFLIGHT:
+                worker.room.clear()
+                await worker.room.wait()
+                continue
+            if self._send(worker, update):
+                try:
+                    await worker.process.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            return
+
+    def _send(self, worker, update):
+        """
+        Запись апдейта в stdin обработчика; False - повтор или обработчик упал
+
+        Апдейт регистрируется до записи: подтверждение может прийти, пока
+        ждем drain(). Если обработчик упал, апдейт остается в inflight, и
+        _worker_exited передаст его другому вместе с остальными апдейтами
+        чата (поэтому обработчик не помечается упавшим здесь: иначе новые
+        апдейты чата ушли бы другому раньше старых).
+        """
+        update_id = update['update_id']
+        if update_id in worker.inflight:
+            # Повторная доставка апдейта, который обработчик еще не подтвердил
+            return False
+        chat_id = get_chat_id(update)
+        worker.inflight[update_id] = (chat_id, update)
+        owner = self.chats.setdefault(chat_id, [worker, 0])
+        owner[1] += 1
+        try:
+            worker.process.stdin.write(json.dumps(update).encode() + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+        return True
+
+    async def start(self):
+        """Запуск обработчиков и ожидание их готовности"""
+        for worker in self.workers:
+            await self._start_worker(worker)
+        await asyncio.gather(*(worker.ready.wait() for worker in self.workers))
+
+    async def join(self):
+        """Ожидание подтверждения всех переданных апдейтов"""
+        while any(worker.inflight for worker in self.workers):
+            await asyncio.sleep(ACK_INTERVAL)
+
+    async def close(self):
+        """Плавная остановка: обработчики дорабатывают очередь и выходят"""
+        self._stopping = True
+        for worker in self.workers:
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.stdin.close()
+        await asyncio.gather(
+            *(worker.process.wait() for worker in self.workers if worker.process is not None)
+        )
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# Источники апдейтов
+
+async def poll_updates(ingestion, token, stop):
+    """Long polling getUpdates: сырые апдейты без разбора в модели aiogram"""
+    api_url = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+    url = f"{api_url}/bot{token}/getUpdates"
+    offset = 0
+    async with ClientSession(timeout=ClientTimeout(total=POLL_TIMEOUT + 10)) as session:
+        await session.post(f"{api_url}/bot{token}/deleteWebhook")
+        while not stop.is_set():
+            try:
+                async with session.post(url, json={"offset": offset, "timeout": POLL_TIMEOUT}) as resp:
+                    result = await resp.json()
+            except (ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not result.get('ok'):
+                logger.error(f"getUpdates: {result.get('description')}")
+                await asyncio.sleep(result.get('parameters', {}).get('retry_after', 1))
+                continue
+            for update in result['result']:
+                await ingestion.put(update)
+                offset = update['update_id'] + 1
+        # Подтверждаем Telegram последние принятые апдейты
+        if offset:
+            await session.post(url, json={"offset": offset, "timeout": 0})
+
+
+async def serve_webhook(ingestion, token, webhook_url, stop):
+    """Webhook: апдейт принят, когда передан обработчику"""
+    from urllib.parse import urlparse
+
+    path = urlparse(webhook_url).path or '/webhook'
+
+    async def handle_update(request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await ingestion.put(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    api_url = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+    async with ClientSession() as session:
+        await session.post(
+            f"{api_url}/bot{token}/setWebhook",
+            json={"url": webhook_url, "secret_token": WEBHOOK_SECRET or None},
+        )
+    logger.info(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{path}")
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_ingestion():
+    token = os.getenv('BOT_TOKEN')
+    if not token:
+        logger.error("BOT_TOKEN не установлен!")
+        return False
+    db = database.create_database()
+    await db.start()
+    try:
+        missing = await database.missing_tables(db)
+    finally:
+        await db.close()
+    if missing:
+        logger.error(f"В базе нет таблиц {', '.join(missing)}: выполните python manage.py migrate")
+        return False
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    ingestion = Ingestion()
+    logger.info(f"Запуск {len(ingestion.workers)} обработчиков...")
+    await ingestion.start()
+    # Сигнал супервизору (run_mvp.py): все обработчики готовы
+    ready_fd = os.getenv('READY_FD')
+    if ready_fd:
+        os.write(int(ready_fd), f"{len(ingestion.workers)} обработчиков\n".encode())
+        os.close(int(ready_fd))
+
+    try:
+        if os.getenv('BOT_MODE', 'polling') == 'webhook':
+            await serve_webhook(ingestion, token, os.environ['BOT_WEBHOOK_URL'], stop)
+        else:
+            logger.info("Прием апдейтов в режиме polling...")
+            await poll_updates(ingestion, token, stop)
+    finally:
+        logger.info("Остановка: обработчики дорабатывают очереди...")
+        await ingestion.close()
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s'
+    )
+    if '--worker' in sys.argv:
+        # Строка на каждый апдейт от каждого обработчика - только при отладке
+        logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+        asyncio.run(run_worker())
+    else:
+        sys.exit(0 if asyncio.run(run_ingestion()) else 1)